@@ -4,53 +4,116 @@ from __future__ import print_function
 import os
 import re
 import shutil
+import multiprocessing
 from fnmatch import fnmatch, translate
 
 import yaml
-from straight.plugin import load
 
 import jules
 import jules.filters, jules.query, jules.plugins
-from jules import utils
+from jules import utils, incremental, cache, profiling
+from jules.registry import plugin_registry
 
 
 # FIXME: namespace hack.
 NAMESPACES = ['jules.plugins']
-add_namespace = NAMESPACES.append
+def add_namespace(namespace):
+    if namespace not in NAMESPACES:
+        NAMESPACES.append(namespace)
 import jules.plugins.post, jules.plugins.rendering
 
 PACKAGE_DIR = os.path.dirname(__file__)
 
+def config_path(src_path):
+    return os.path.join(src_path, 'site.yaml')
+
+def load_config(src_path):
+    path = config_path(src_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            config = yaml.safe_load(f)
+    else:
+        raise ValueError(
+            "No configuration file found. Looking for site.yaml at `{}`."
+            .format(src_path))
+
+    config.setdefault('entries', [])
+    
+    return config
+
+def find_cache_dir(src_path, config):
+    """Return the directory for caches and other build scratch space"""
+    return os.path.join(src_path, config.get('cache_dir', '.jules'))
+
 class JulesEngine(object):
-    def __init__(self, src_path):
+    # the BuildManifest of an incremental build, or None for a full build.
+    manifest = None
+    # the number of processes to use for the parallelizable parts of a build.
+    jobs = 1
+    # records timings for `jules build --profile`.
+    profiler = profiling.NullProfiler()
+    # a dict that the Renderer keeps the outputs in, instead of writing them
+    # to the output directory. See jules.writer.MemoryURLWriter.
+    outputs = None
+
+    def __init__(self, src_path, incremental=False, jobs=1, profile=False,
+                 previous=None, outputs=None):
+        """`previous` is the manifest state() of an incremental build that this
+        process just did, to use instead of loading the saved manifest.
+
+        `outputs` is the dict to keep the outputs in. Builds to memory are
+        always incremental, on top of `previous` (if given) and the outputs
+        already in the dict, and their manifest isn't saved.
+        """
         self.src_path = src_path
+        self.jobs = jobs
+        if profile:
+            self.profiler = profiling.Profiler()
         self.config = self._load_config()
+        self.cache_dir = find_cache_dir(self.src_path, self.config)
+        self.caches = {}
+        if outputs is not None:
+            self.outputs = outputs
+            self.manifest = jules.incremental.BuildManifest(None, previous)
+            self.manifest.check_config(self._config_path())
+        elif previous is not None:
+            self.manifest = jules.incremental.BuildManifest(
+                os.path.join(self.cache_dir, 'manifest'), previous)
+            self.manifest.check_config(self._config_path())
+        elif incremental:
+            self.manifest = jules.incremental.BuildManifest.load(
+                os.path.join(self.cache_dir, 'manifest'))
+            self.manifest.check_config(self._config_path())
         self.input_dirs = self._find_input_dirs()
         self.plugins = PluginDB(self)
         self.component_loader = ComponentLoader(self.config, self.plugins)
-        self.bundles = self.load_bundles()
+        with self.profiler.section('phase', 'discover'):
+            self.bundles = self.load_bundles()
         
         # try to defer circular dependencies until JulesEngine is as initialized
         # as possible. Here, plugins are passed partially-initialized
         # instances of JulesEngine. (BLEH.)
-        self.prepare_bundles()
+        with self.profiler.section('phase', 'prepare'):
+            self.prepare_bundles()
+        self.plugins.save()
         self.engine_plugins = list(self.plugins.produce_instances(
             jules.plugins.EnginePlugin))
         self.query_engine = jules.query.QueryEngine(self)
     
+    def _config_path(self):
+        return config_path(self.src_path)
+
     def _load_config(self):
-        config_path = os.path.join(self.src_path, 'site.yaml')
-        if os.path.exists(config_path):
-            with open(config_path) as f:
-                config = yaml.safe_load(f)
-        else:
-            raise ValueError(
-                "No configuration file found. Looking for site.yaml at `{}`."
-                .format(self.src_path))
-
-        config.setdefault('entries', [])
-        
-        return config
+        return load_config(self.src_path)
+
+    def get_cache(self, name):
+        """Return the persistent jules.cache.DiskCache called `name`"""
+        try:
+            return self.caches[name]
+        except KeyError:
+            return self.caches.setdefault(name, jules.cache.open_cache(
+                self.cache_dir, name,
+                self.config.get('cache_max_size', jules.cache.DEFAULT_MAX_SIZE)))
 
     def _find_input_dirs(self):
         input_dirs = []
@@ -86,14 +149,150 @@ class JulesEngine(object):
 
         return bundles
     
-    def prepare_bundles(self):
-        for k, bundle in self.bundles.iteritems():
-            bundle.prepare(self)
+    def prepare_bundles(self, bundles=None):
+        """Prepare bundles (by default, all of them), restoring the
+        components of those that didn't change from the manifest."""
+        if bundles is None:
+            bundles = self.bundles.values()
+        components = {}
+        if self.manifest is not None:
+            for bundle in bundles:
+                components[bundle.key] = self.manifest.restore_components(
+                    bundle)
+        changed = [bundle.key for bundle in bundles
+            if components.get(bundle.key) is None]
+
+        if self.jobs > 1 and len(changed) > 1:
+            components.update(self._load_components_in_pool(changed))
+
+        # Bundles are always prepared in the same order, even if their
+        # components were loaded in parallel, so that side effects (like
+        # static files found in bundles) happen in the same order too.
+        for bundle in bundles:
+            with self.profiler.section('bundle', bundle.key):
+                bundle.prepare(self, components.get(bundle.key))
+        if self.manifest is not None:
+            for key in changed:
+                self.manifest.record_bundle(self.bundles[key])
+            self.manifest.finish_bundles()
+
+    def _load_components_in_pool(self, keys):
+        """Load the components of the bundles with the given keys in a pool of
+        self.jobs processes.
+
+        Returns {key: components}.
+        """
+        # FIXME: relies on fork() to get the engine into the workers.
+        global _pool_engine
+        _pool_engine = self
+        pool = multiprocessing.Pool(self.jobs, self.profiler.reset)
+        try:
+            results = pool.map(_load_bundle_components, keys,
+                max(1, len(keys) // (self.jobs * 4)))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _pool_engine = None
+        loaded = []
+        for components, records in results:
+            self.profiler.merge(records)
+            loaded.append(components)
+        return dict(zip(keys, loaded))
     
+    def rebuild(self, changed):
+        """Do another incremental build with this engine, after the files at
+        the `changed` paths changed.
+
+        Only the bundles with changed files are prepared again (and bundles
+        are only looked for again if one was added or removed). The others,
+        the plugins and their caches, the bundle index and the jinja2
+        environment are all kept from the last build.
+
+        Returns False, without building, if site.yaml changed, since then
+        nothing can be kept: a new engine has to do the build.
+        """
+        changed = set(os.path.abspath(path) for path in changed)
+        if self.manifest is None or self._config_path() in changed:
+            return False
+        self.manifest = jules.incremental.BuildManifest(
+            self.manifest.path, self.manifest.state())
+        self.manifest.check_config(self._config_path())
+        for plugin in self.plugins.instance_cache.values():
+            plugin.reset()
+        with self.profiler.section('phase', 'prepare'):
+            added_or_removed = self.update_bundles(changed)
+        self.plugins.save()
+        # a change to any bundle's meta or components is a full rebuild.
+        self.query_engine.reset(self.bundles.values(),
+            reindex=added_or_removed or self.manifest.full_rebuild)
+        self.run()
+        return True
+
+    def update_bundles(self, changed):
+        """Prepare the bundles with files at the `changed` paths again, and
+        pick up added and removed bundles, keeping the rest as they are.
+
+        Returns True if bundles were added or removed.
+        """
+        by_path = {bundle.path: bundle for bundle in self.bundles.itervalues()}
+        touched = set()
+        rediscover = False
+        for path in changed:
+            for input_dir in self.input_dirs:
+                if not path.startswith(input_dir + os.sep):
+                    continue
+                name = path[len(input_dir) + 1:].split(os.sep)[0]
+                bundle = by_path.get(os.path.join(input_dir, name))
+                if bundle is None or not os.path.isdir(bundle.path):
+                    rediscover = True
+                else:
+                    touched.add(bundle.key)
+
+        bundles = self.bundles
+        added_or_removed = False
+        if rediscover:
+            bundles = {}
+            for key, bundle in self.load_bundles().iteritems():
+                old = self.bundles.get(key)
+                if old is not None and old.path == bundle.path:
+                    bundle = old
+                else:
+                    touched.add(key)
+                bundles[key] = bundle
+            for key, bundle in self.bundles.iteritems():
+                if bundles.get(key) is not bundle:
+                    self.unload_bundle(bundle)
+            added_or_removed = len(bundles) != len(self.bundles) or any(
+                self.bundles.get(key) is not bundle
+                for key, bundle in bundles.iteritems())
+
+        prepare = []
+        for key, bundle in bundles.iteritems():
+            if key not in touched:
+                self.manifest.keep_bundle(bundle)
+                continue
+            if bundle is self.bundles.get(key):
+                self.unload_bundle(bundle)
+                bundle.components = {}
+                bundle.meta = None
+            prepare.append(bundle)
+        self.bundles = bundles
+        self.prepare_bundles(prepare)
+        return added_or_removed
+
+    def unload_bundle(self, bundle):
+        for plugin in self.component_loader.component_plugins:
+            plugin.unload(bundle)
+
     def run(self):
         self.initialize()
-        self.render_all()
-        self.finalize()
+        with self.profiler.section('phase', 'query'):
+            self.render_all()
+        with self.profiler.section('phase', 'finalize'):
+            self.finalize()
     
     def initialize(self):
         for plugin in self.engine_plugins:
@@ -101,34 +300,96 @@ class JulesEngine(object):
     
     def finalize(self):
         for plugin in self.engine_plugins:
-            plugin.finalize()
+            with self.profiler.section('plugin', type(plugin).__name__):
+                plugin.finalize()
+        if self.manifest is not None:
+            self.manifest.save()
+        self.plugins.save()
+        for cache in self.caches.itervalues():
+            cache.prune()
         
     def render_all(self):
         """Render queries in `entries` section of config"""
+        if self.manifest is not None:
+            self.manifest.check_templates(self.template_paths())
         for q in self.config['entries']:
             (query_name, pipeline), = q.iteritems()
-            self._render_query(query_name, pipeline)
+            if self.manifest is None:
+                self._render_query(query_name, pipeline)
+            elif self.manifest.entry_is_stale(query_name):
+                self.manifest.begin_entry(query_name)
+                self._render_query(query_name, pipeline)
+                self.manifest.end_entry()
+            else:
+                self.manifest.keep_entry(query_name)
     
     def _render_query(self, name, pipeline):
-        results = self.bundles.values()
-        for stmt in pipeline:
-            (dispatch_key, arg), = stmt.iteritems()
-            results = self.query_engine.dispatch(dispatch_key, results, arg)
+        results = self.query_engine.all_bundles()
+        for stage in self.query_engine.plan(pipeline):
+            with self.profiler.section('operator', stage.label):
+                results = self.query_engine.dispatch(
+                    stage.method, results, stage.arg)
+            results = self.profiler.iterate(
+                'operator', stage.label, results, calls=0)
         list(results)
 
+    def source_paths(self):
+        """Return the paths of every file/directory the build reads."""
+        paths = [self._config_path()]
+        paths.extend(self.input_dirs)
+        paths.extend(self.template_paths())
+        plugins = self.plugins.produce_instances(
+            jules.plugins.rendering.RenderingPlugin)
+        for plugin in plugins:
+            paths.extend(plugin.get_source_paths())
+        return paths
+
+    def template_paths(self):
+        """Return the paths of everything that templates can depend on."""
+        paths = []
+        plugins = self.plugins.produce_instances(
+            jules.plugins.rendering.RenderingPlugin)
+        for plugin in plugins:
+            paths.extend(plugin.get_template_paths())
+        return paths
+
+# The engine whose bundles are being loaded by a process pool. The workers are
+# forked from the engine's process, so they inherit it rather than being sent it.
+_pool_engine = None
+
+def _load_bundle_components(key):
+    bundle = _pool_engine.bundles[key]
+    profiler = _pool_engine.profiler
+    with profiler.section('bundle', key):
+        components = bundle._load_components(_pool_engine, {}, unnamed=False)
+    return components, profiler.pop_records()
+
 class PluginDB(object):
     def __init__(self, engine, namespaces=None):
         self.instance_cache = {}
         self.nss = NAMESPACES if namespaces is None else namespaces
         self.engine = engine
+        self.persist_path = None
+        config = getattr(engine, 'config', None) or {}
+        if config.get('plugin_cache') and getattr(engine, 'cache_dir', None):
+            self.persist_path = os.path.join(engine.cache_dir, 'plugins')
+            for ns in plugin_registry.load(self.persist_path):
+                if namespaces is None:
+                    add_namespace(ns)
     
-    def _load(self, *args, **kwargs):
+    def _load(self, subclasses):
         # FIXME: namespace hack
         plugins = []
+        # (namespaces can be added while the loop runs, by importing plugins)
         for ns in self.nss:
-            plugins.extend(load(ns, *args, **kwargs))
+            plugins.extend(plugin_registry.classes(ns, subclasses))
 
         return plugins
+
+    def save(self):
+        """Persist the plugin class list for the next run, if configured to"""
+        if self.persist_path is not None:
+            plugin_registry.save(self.persist_path, self.nss)
     
     def produce_instances(self, base_cls):
         """Yield instances of a plugin type, caching them.
@@ -184,9 +445,10 @@ class ComponentLoader(object):
     
     def init_filter(self):
         ignorelist = self.config.setdefault('ignore', [])
+        # an empty pattern would match (and so ignore) everything.
         self.ignore_re = re.compile('|'.join(
             '(?:%s)' % translate(pattern)
-            for pattern in ignorelist))
+            for pattern in ignorelist) or '(?!)')
     
     def init_components(self):
         # FIXME: allow components to be placed in other directories via some
@@ -305,12 +567,27 @@ class Bundle(object):
         M = self.meta
         return M['updated_time'] or M['publish_time'] or M['created_time']
 
-    def prepare(self, engine):
-        """Prepare the bundle for querying and rendering."""
-        self._load_components(engine)
+    def prepare(self, engine, components=None):
+        """Prepare the bundle for querying and rendering.
+
+        `components` are the already-loaded components of this bundle (e.g.
+        from a previous incremental build), if any.
+        """
+        self._load_components(engine, components or {})
+        for component in self.components.itervalues():
+            if isinstance(component, jules.plugins.LazyComponent):
+                component.bind(engine)
         self._postprocess_compononents()
     
-    def _load_components(self, engine):
+    def _load_components(self, engine, restored, unnamed=True):
+        """Load this bundle's components, except for those in `restored`.
+
+        Components without a name are only loaded for their side effects, and
+        are skipped if `unnamed` is False.
+
+        Returns {name: component} for the named components that were loaded,
+        including those that came out as None.
+        """
         loader = engine.component_loader
         plugin_loads = {}
         #FIXME: multiple files with same basename
@@ -325,18 +602,28 @@ class Bundle(object):
             paths = plugin_loads.setdefault(plugin, {})
             paths[basename] = (ext, subpath)
         
+        loaded = {}
         for plugin in loader.component_plugins:
-            paths = plugin_loads.get(plugin, {})
-
-            # FIXME: handle missing dependencies gracefully
-            deps = {dep: self.components[dep]
-                for dep in plugin.component_dependencies}
-            args = [deps] if deps else []
-            component = plugin.maybe_load(*args, **{base:paths[base]
-                for base in plugin.basenames
-                if base in paths})
+            if plugin.name is None and not unnamed:
+                continue
+            if plugin.name in restored:
+                component = restored[plugin.name]
+            else:
+                paths = plugin_loads.get(plugin, {})
+
+                # FIXME: handle missing dependencies gracefully
+                deps = {dep: self.components[dep]
+                    for dep in plugin.component_dependencies}
+                args = [deps] if deps else []
+                with engine.profiler.section('plugin', type(plugin).__name__):
+                    component = plugin.maybe_load(*args, **{base:paths[base]
+                        for base in plugin.basenames
+                        if base in paths})
+                if plugin.name is not None:
+                    loaded[plugin.name] = component
             if component is not None:
                 self.components[plugin.name] = component
+        return loaded
 
     def _postprocess_compononents(self):
         self.components['meta']['key'] = self.key
@@ -4,6 +4,7 @@ import os
 import shutil
 import operator
 import itertools
+import threading
 from datetime import datetime
 
 import yaml
@@ -12,6 +13,9 @@ from straight.command import Command, SubCommand, Option
 from straight.plugin import load
 
 import jules
+import jules.server
+import jules.watch
+from jules.plugins.rendering.query import QueryRenderer
 
 
 def now_minute():
@@ -47,10 +51,38 @@ class Build(Command):
 
     sitelocation = Option(short='-L', dest='location', action='store')
     force = Option(short='-f', dest='force', action='store_true')
+    incremental = Option(short='-i', long='--incremental', dest='incremental',
+        action='store_true',
+        help="Only rebuild what changed since the last incremental build")
+    jobs = Option(short='-j', long='--jobs', dest='jobs', action='store',
+        default=1, help="Number of processes to prepare bundles and render with")
+    profile = Option(long='--profile', dest='profile', action='store_true',
+        help="Time the build, and print a report of where the time went")
+    profile_json = Option(long='--profile-json', dest='profile_json',
+        action='store', default=None,
+        help="Where to write the profile report as JSON "
+             "(default: profile.json in the cache directory)")
+    profile_top = Option(long='--profile-top', dest='profile_top',
+        action='store', default=10,
+        help="Number of the slowest bundles, templates and URLs to report")
 
     def execute(self, **kwargs):
-        engine = jules.JulesEngine(os.path.abspath(kwargs['location'] or '.'))
+        engine = jules.JulesEngine(
+            os.path.abspath(kwargs['location'] or '.'),
+            incremental=kwargs['incremental'],
+            jobs=int(kwargs['jobs']),
+            profile=kwargs['profile'])
         engine.run()
+        fragments = engine.plugins.produce_instance(
+            QueryRenderer).fragment_stats()
+        if fragments and (fragments['hits'] or fragments['misses']):
+            print("Fragment cache: {hits} hits, {misses} misses".format(
+                **fragments))
+        if kwargs['profile']:
+            self.report_profile(engine.profiler,
+                kwargs['profile_json'] or os.path.join(
+                    engine.cache_dir, 'profile.json'),
+                int(kwargs['profile_top']))
         #output_dir = engine.config.get('output', self.parent.args['output'])
         #if not os.path.exists(output_dir) or self.args['force']:
         #    engine.render_site(output_dir)
@@ -58,11 +90,25 @@ class Build(Command):
         #else:
         #    print("error: Refusing to replace {} output directory!".format(output_dir))
 
+    def report_profile(self, profiler, json_path, slowest):
+        profiler.finish()
+        print(profiler.report(slowest))
+        json_dir = os.path.dirname(os.path.abspath(json_path))
+        if not os.path.isdir(json_dir):
+            os.makedirs(json_dir)
+        profiler.write_json(json_path, slowest)
+        print()
+        print("Profile written to {}".format(json_path))
+
 
 class Tags(Command):
+
+    help = "List the tags used by the site's bundles."
+
+    sitelocation = Option(short='-L', dest='location', action='store')
+
     def execute(self, **kwargs):
-        engine = jules.JulesEngine(os.path.abspath('.'))
-        engine.prepare()
+        engine = jules.JulesEngine(os.path.abspath(kwargs['location'] or '.'))
         tags = set()
         for key, bundle in engine.bundles.items():
             for tag in bundle.meta.get('tags', []):
@@ -73,29 +119,65 @@ class Tags(Command):
 
 class Serve(Command):
 
+    sitelocation = Option(short='-L', dest='location', action='store')
+    watch = Option(short='-w', long='--watch', dest='watch',
+        action='store_true',
+        help="Build the site, and rebuild it whenever its sources change")
+    jobs = Option(short='-j', long='--jobs', dest='jobs', action='store',
+        default=1, help="Number of processes to build with, with --watch")
+    memory = Option(short='-m', long='--memory', dest='memory',
+        action='store_true',
+        help="Build the site and serve it from memory, without writing it "
+             "to the output directory")
+    quiet = Option(short='-q', long='--quiet', dest='quiet',
+        action='store_true', help="Don't log requests")
     port = Option(dest='port', default=8000)
     
     help = "Serve the site from the output directing, using a test server. Defaults to port 8000"
 
     def execute(self, port, **kwargs):
-        output_dir = self.parent.args['output']
+        output = jules.server.DirectoryOutput(self.parent.args['output'])
+        # without a build of our own, we don't know which URLs are
+        # fingerprinted, so nothing is cached for long.
+        immutable = ()
+        if kwargs['watch'] or kwargs['memory']:
+            src_path = os.path.abspath(kwargs['location'] or '.')
+            watcher = jules.watch.SiteWatcher(src_path,
+                jobs=int(kwargs['jobs']), memory=kwargs['memory'])
+            watcher.build()
+            immutable = watcher.fingerprinted
+            if kwargs['memory']:
+                output = jules.server.MemoryOutput(watcher.outputs)
+            else:
+                output = jules.server.DirectoryOutput(os.path.join(src_path,
+                    jules.load_config(src_path).get('output_dir', '_build')))
+
+        httpd = jules.server.PreviewServer(("", int(port)), output,
+            verbose=not kwargs['quiet'], immutable=immutable)
+        if not kwargs['watch']:
+            httpd.serve_forever()
+            return
+
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        watcher.watch()
+
+
+class Plan(Command):
+
+    help = "Show how each entry's pipeline is run, and which steps read all their input before producing anything."
 
-        # python 2
-        try:
-            import SimpleHTTPServer
-            import Socke3tServer
-            handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-            server = SocketServer.TCPServer
-        # python 3
-        except ImportError:
-            from http.server import SimpleHTTPRequestHandler as handler
-            from http.server import HTTPServer as server
-
-        handler.extensions_map[''] = 'text/html'
-        httpd = server(("", int(port)), handler)
+    sitelocation = Option(short='-L', dest='location', action='store')
 
-        os.chdir(output_dir)
-        httpd.serve_forever()
+    def execute(self, **kwargs):
+        engine = jules.JulesEngine(os.path.abspath(kwargs['location'] or '.'))
+        for q in engine.config['entries']:
+            (name, pipeline), = q.iteritems()
+            print(name)
+            for label, materializes in engine.query_engine.explain(pipeline):
+                print("  {:<20} {}".format(
+                    label, "materializes" if materializes else "").rstrip())
 
 
 class BundleMeta(Command):
@@ -106,16 +188,15 @@ class BundleMeta(Command):
     If property and value are specified, it is changed.
     """
 
+    sitelocation = Option(short='-L', dest='location', action='store')
     key = Option(dest='key')
     prop = Option(dest='prop', default=None)
     value = Option(dest='value', default=None)
 
     def execute(self, key, prop, value, **kwargs):
-        engine = jules.JulesEngine(os.path.abspath('.'))
-        engine.prepare()
-        engine.prepare_bundles()
+        engine = jules.JulesEngine(os.path.abspath(kwargs['location'] or '.'))
 
-        bundle = engine.get_bundle(key=key)
+        bundle = engine.bundles[key]
         label = bundle.meta.get('title', key)
         print("Bundle %s" % label)
         if prop:
@@ -126,6 +207,61 @@ class BundleMeta(Command):
             for prop in bundle.meta:
                 print("%s = %s" % (prop, bundle.meta.get(prop)))
 
+def format_size(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f GB" % size
+
+
+class CacheStats(Command):
+
+    help = "Show the size of each of the site's caches."
+
+    def execute(self, **kwargs):
+        src_path = os.path.abspath(self.args.get('location') or '.')
+        config = jules.load_config(src_path)
+        cache_dir = jules.find_cache_dir(src_path, config)
+        max_size = config.get('cache_max_size', jules.cache.DEFAULT_MAX_SIZE)
+        names = jules.cache.cache_names(cache_dir)
+        if not names:
+            print("No caches in {}".format(cache_dir))
+        for name in names:
+            stats = jules.cache.open_cache(cache_dir, name, max_size).stats()
+            print("{}: {} entries, {} (limit {})".format(
+                name,
+                stats['entries'],
+                format_size(stats['size']),
+                format_size(stats['max_size'])))
+
+
+class CacheClear(Command):
+
+    help = "Empty the site's caches, or just the named one."
+
+    name = Option(dest='name', default=None)
+
+    def execute(self, name, **kwargs):
+        src_path = os.path.abspath(self.args.get('location') or '.')
+        config = jules.load_config(src_path)
+        cache_dir = jules.find_cache_dir(src_path, config)
+        names = [name] if name else jules.cache.cache_names(cache_dir)
+        for name in names:
+            jules.cache.open_cache(cache_dir, name).clear()
+            print("Cleared {}".format(name))
+
+
+class Cache(Command):
+
+    help = "Inspect or clear the caches used to speed up builds."
+
+    sitelocation = Option(short='-L', dest='location', action='store')
+
+    stats = SubCommand('stats', CacheStats)
+    clear = SubCommand('clear', CacheClear)
+
+
 class JulesCommand(Command):
 
     version = "0.2"
@@ -137,6 +273,8 @@ class JulesCommand(Command):
     init = SubCommand('init', Init)
     meta = SubCommand('meta', BundleMeta)
     tags = SubCommand('tags', Tags)
+    plan = SubCommand('plan', Plan)
+    cache = SubCommand('cache', Cache)
 
 def main(argv=None):
     import logging
@@ -0,0 +1,142 @@
+"""Persistent, content-addressed caches, kept in the site's cache directory.
+
+Each cache is a directory of pickled values, one file per key. Keys are hashes
+of everything the value was computed from (see cache_key()), so an entry never
+has to be invalidated: when the inputs change, so does the key, and the stale
+entry eventually gets evicted.
+
+Writes are atomic (write to a temporary file, then rename), so a cache can be
+shared between the processes of a parallel build.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import cPickle as pickle
+
+# Default size limit of each cache, in bytes.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+def freeze(obj):
+    """Convert a structure of dicts/lists/sets to one that compares, hashes
+    and pickles the same way no matter what order it was built in."""
+    if isinstance(obj, dict):
+        return ('dict', tuple(sorted(
+            (freeze(k), freeze(v)) for k, v in obj.iteritems())))
+    if isinstance(obj, (set, frozenset)):
+        return ('set', tuple(sorted(freeze(v) for v in obj)))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(freeze(v) for v in obj))
+    return obj
+
+def cache_key(*parts):
+    """Return a key that identifies `parts`, which must be picklable"""
+    return hashlib.sha1(
+        pickle.dumps(freeze(parts), pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+class DiskCache(object):
+    """A size-bounded on-disk cache.
+
+    Eviction is least-recently-used, as judged by file modification times,
+    which are bumped on every hit. It only happens when prune() is called,
+    which the engine does once at the end of a build.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass # evicted in the meantime. Oh well.
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+    def _entries(self):
+        """Return a list of (mtime, size, path) for every entry"""
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for root, dirs, files in os.walk(self.path):
+            for filename in files:
+                if filename.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            'entries': len(entries),
+            'size': sum(size for mtime, size, path in entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def prune(self):
+        """Evict the least recently used entries until under max_size"""
+        entries = self._entries()
+        size = sum(size for mtime, size, path in entries)
+        entries.sort()
+        for mtime, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+def cache_names(cache_dir):
+    """Return the names of the caches that exist in `cache_dir`"""
+    root = os.path.join(cache_dir, 'cache')
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)))
+
+def open_cache(cache_dir, name, max_size=DEFAULT_MAX_SIZE):
+    return DiskCache(os.path.join(cache_dir, 'cache', name), max_size)
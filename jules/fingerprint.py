@@ -0,0 +1,87 @@
+"""Static files at content-hash fingerprinted URLs.
+
+With the `fingerprint` config on (`true` for the usual asset types, or a list
+of extensions), each static file with one of them is written at an URL with
+a hash of its output in it, /style.<hash>.css instead of /style.css. Its
+contents never change, so it can be cached forever (see jules.server), and
+a changed file gets a new URL.
+
+The Renderer works out the fingerprinted URLs before any entry runs. Templates
+get them from the `fingerprint` filter, and references in HTML (href and src
+attributes) and CSS (url() and @import) are rewritten when those are
+postprocessed (see jules.plugins.rendering.postprocessing.assets).
+"""
+
+import re
+import posixpath
+
+# python 2
+try:
+    from urlparse import urljoin, urlsplit, urlunsplit
+# python 3
+except ImportError:
+    from urllib.parse import urljoin, urlsplit, urlunsplit
+
+HASH_LENGTH = 10
+
+DEFAULT_EXTENSIONS = [
+    '.css', '.js',
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp',
+    '.woff', '.woff2', '.ttf', '.eot', '.otf',
+]
+
+# how long fingerprinted URLs can be cached for.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+def extensions(config):
+    """Return the extensions to fingerprint, given the `fingerprint` config"""
+    if config is True:
+        return DEFAULT_EXTENSIONS
+    if isinstance(config, list):
+        return config
+    return []
+
+def fingerprinted_url(url, digest):
+    base, ext = posixpath.splitext(url)
+    return '%s.%s%s' % (base, digest[:HASH_LENGTH], ext)
+
+def resolve_reference(ref, base_url):
+    """Return the URL that ref, a reference in the output at base_url, refers
+    to, or None if it's to another site (or only has a query or fragment)"""
+    parts = urlsplit(ref)
+    if parts.scheme or parts.netloc or not parts.path:
+        return None
+    return urljoin(base_url, parts.path)
+
+def rewrite_reference(ref, base_url, fingerprints):
+    """Return ref, a reference in the output at base_url, pointing at the
+    fingerprinted URL of what it refers to, if that has one.
+
+    `fingerprints` maps URLs to their fingerprinted URLs. Only the file name
+    changes, so relative references stay relative.
+    """
+    parts = urlsplit(ref)
+    if parts.scheme or parts.netloc or not parts.path:
+        return ref
+    new = fingerprints.get(resolve_reference(ref, base_url))
+    if new is None:
+        return ref
+    dirname = parts.path[:len(parts.path) - len(posixpath.basename(parts.path))]
+    return urlunsplit(('', '',
+        dirname + posixpath.basename(new), parts.query, parts.fragment))
+
+CSS_URL = re.compile(r'''(url\(\s*(['"]?))([^'"()\s]+)(\2\s*\))''')
+CSS_IMPORT = re.compile(r'''(@import\s+(['"]))([^'"]+)(\2)''')
+
+def css_references(css):
+    """Return the references in the url()s and @imports of css"""
+    return ([match.group(3) for match in CSS_URL.finditer(css)]
+        + [match.group(3) for match in CSS_IMPORT.finditer(css)])
+
+def rewrite_css(css, base_url, fingerprints):
+    """Rewrite the url()s and @imports in css, the output at base_url"""
+    def rewrite(match):
+        return (match.group(1)
+            + rewrite_reference(match.group(3), base_url, fingerprints)
+            + match.group(4))
+    return CSS_IMPORT.sub(rewrite, CSS_URL.sub(rewrite, css))
@@ -0,0 +1,360 @@
+"""Bookkeeping for incremental builds.
+
+A full build reparses every bundle, reruns every entry in `config['entries']`
+and replaces the whole output directory. An incremental build instead keeps a
+manifest from the previous build which maps
+
+ - each source file's fingerprint to the bundle it belongs to,
+ - each bundle to its prepared components,
+ - each entry (query pipeline) to the bundles it selected and the URLs it
+   rendered, and
+ - each output URL to a hash of what was written there.
+
+Bundles whose files didn't change are restored from the manifest instead of
+being prepared again, entries that don't depend on anything that changed are
+skipped, and only outputs whose contents changed are rewritten.
+
+The dependency tracking is deliberately conservative:
+
+ - A change to site.yaml or to any template reruns every entry, and so does
+   a change to the fingerprinted URL of a static file (see jules.fingerprint).
+ - A change to a bundle's meta data (or adding/removing a bundle, or changing
+   which components it has) reruns every entry, since meta is what `where`,
+   `order_by` and friends look at.
+ - Any other change to a bundle only reruns the entries that selected it, and
+   entries whose templates looked at the global `bundles` result set.
+"""
+
+import os
+import hashlib
+import logging
+import cPickle as pickle
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the format of the manifest changes.
+MANIFEST_VERSION = 1
+
+# Marker for entries that depend on every bundle.
+ALL_BUNDLES = '*'
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def data_digest(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+def walk_files(path):
+    """Yield every file under `path`, or `path` itself if it's a file."""
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            yield os.path.join(root, filename)
+
+def bundle_summary(components):
+    """What a change to reruns every entry: the component names and meta"""
+    return sorted(components), components.get('meta')
+
+def unpicklable_components(components):
+    """Return the names of the components that can't be pickled"""
+    names = []
+    for name, component in sorted(components.iteritems()):
+        try:
+            pickle.dumps(component, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            names.append(name)
+    return names
+
+class Fingerprints(object):
+    """Fingerprints of source files: {path: (mtime, size, sha1)}.
+
+    The mtime and size are checked first, and the (comparatively expensive)
+    hash is only computed when those differ. This way touching a file without
+    changing it doesn't count as a change.
+    """
+    def __init__(self, old=None):
+        self.old = old or {}
+        self.new = {}
+
+    def fingerprint(self, path):
+        try:
+            return self.new[path]
+        except KeyError:
+            pass
+        st = os.stat(path)
+        old = self.old.get(path)
+        if old is not None and old[:2] == (st.st_mtime, st.st_size):
+            fp = old
+        else:
+            fp = (st.st_mtime, st.st_size, file_digest(path))
+        self.new[path] = fp
+        return fp
+
+    def tree(self, paths):
+        """Return {path: sha1} for every file under each of `paths`"""
+        return {
+            filepath: self.fingerprint(filepath)[2]
+            for path in paths
+            if os.path.exists(path)
+            for filepath in walk_files(path)}
+
+class BuildManifest(object):
+    """The on-disk record of the previous build, plus the one in progress.
+
+    A manifest without a path is never saved, for builds whose outputs are
+    only kept in memory (see JulesEngine.outputs).
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        old = state or {}
+        if old.get('version') != MANIFEST_VERSION:
+            old = {}
+        self.old = old
+        self.fingerprints = Fingerprints(old.get('fingerprints'))
+
+        self.full_rebuild = not old
+        self.config_changed = not old
+        self.changed_bundles = set() # keys of bundles that changed at all
+
+        self.new_bundles = {} # key -> {'files': {path: sha1}, 'components': pickled}
+        self.new_entries = {} # name -> {'bundles': set | ALL, 'outputs': [...]}
+        self.new_outputs = {} # final url -> sha1 of written data
+        self.kept_entries = [] # names of entries that weren't rerun
+        self.config = None
+        self.templates = None
+        self.fingerprinted = {} # url -> fingerprinted url, see jules.fingerprint
+
+        self.current_entry = None
+        self.all_bundles_entries = set() # names, see pop_updates()
+
+    @classmethod
+    def load(cls, path):
+        state = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                try:
+                    state = pickle.load(f)
+                except Exception:
+                    # corrupt or from an incompatible version: start over.
+                    state = None
+        return cls(path, state)
+
+    def state(self):
+        """Return what's saved, which is the `old` of the next build"""
+        return {
+            'version': MANIFEST_VERSION,
+            'fingerprints': self.fingerprints.new,
+            'config': self.config,
+            'templates': self.templates,
+            'fingerprinted': self.fingerprinted,
+            'bundles': self.new_bundles,
+            'entries': self.new_entries,
+            'outputs': self.new_outputs,
+        }
+
+    def save(self):
+        if self.path is None:
+            return
+        state = self.state()
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self.path)
+
+    # site-wide inputs
+
+    def check_config(self, path):
+        """Fingerprint site.yaml. If it changed, nothing can be reused."""
+        self.config = self.fingerprints.tree([path])
+        if self.config != self.old.get('config'):
+            self.config_changed = self.full_rebuild = True
+
+    def check_templates(self, paths):
+        """Fingerprint the templates. If any changed, rerun every entry."""
+        self.templates = self.fingerprints.tree(paths)
+        if self.templates != self.old.get('templates'):
+            self.full_rebuild = True
+
+    def check_fingerprinted(self, fingerprints):
+        """Record the fingerprinted URLs of the static files. If any changed,
+        rerun every entry, since their outputs can refer to them."""
+        self.fingerprinted = fingerprints
+        if fingerprints != self.old.get('fingerprinted', {}):
+            self.full_rebuild = True
+
+    # bundles
+
+    def restore_components(self, bundle):
+        """Return the components of an unchanged bundle, or None.
+
+        None means that the bundle changed (or is new) and must be prepared,
+        and then passed to record_bundle().
+        """
+        files = self.fingerprints.tree([bundle.path])
+        old = self.old.get('bundles', {}).get(bundle.key)
+        new = self.new_bundles[bundle.key] = {'files': files, 'components': None}
+        if not self.config_changed and old is not None and old['files'] == files:
+            if old['components']:
+                new['components'] = old['components']
+                return pickle.loads(old['components'])
+            if old.get('summary') is not None:
+                # unchanged, but it couldn't be pickled, see record_bundle().
+                return None
+
+        self.changed_bundles.add(bundle.key)
+        return None
+
+    def keep_bundle(self, bundle):
+        """Record that a bundle whose files didn't change was kept as it is
+        (see JulesEngine.rebuild), without looking at its files again."""
+        old = self.new_bundles[bundle.key] = self.old['bundles'][bundle.key]
+        for path in old['files']:
+            fingerprint = self.fingerprints.old.get(path)
+            if fingerprint is not None:
+                self.fingerprints.new[path] = fingerprint
+
+    def record_bundle(self, bundle):
+        """Record the prepared components of a prepared bundle.
+
+        A bundle whose components can't be pickled is prepared again on every
+        build. Only its component names and meta are kept, to tell whether
+        that changed, and it only counts as changed if its files did.
+        """
+        new = self.new_bundles[bundle.key]
+        try:
+            new['components'] = pickle.dumps(
+                bundle.components, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            names = unpicklable_components(bundle.components)
+            logger.warning(
+                "Can't pickle component(s) %s of bundle %r, so it's prepared "
+                "again on every build", ', '.join(names), bundle.key)
+            if 'meta' in names:
+                self.full_rebuild = True
+                return
+            new['summary'] = bundle_summary(bundle.components)
+
+        if bundle.key not in self.changed_bundles:
+            return
+        old = self.old.get('bundles', {}).get(bundle.key)
+        if old is None:
+            self.full_rebuild = True
+        elif old['components']:
+            if (bundle_summary(pickle.loads(old['components']))
+                    != bundle_summary(bundle.components)):
+                self.full_rebuild = True
+        elif old.get('summary') != bundle_summary(bundle.components):
+            self.full_rebuild = True
+
+    def finish_bundles(self):
+        """Check for removed bundles, after every bundle was prepared."""
+        if set(self.old.get('bundles', ())) != set(self.new_bundles):
+            self.full_rebuild = True
+
+    # entries
+
+    def entry_is_stale(self, name):
+        if self.full_rebuild:
+            return True
+        try:
+            old = self.old['entries'][name]
+        except KeyError:
+            return True
+        if not self.changed_bundles:
+            return False
+        if old['bundles'] == ALL_BUNDLES:
+            return True
+        return bool(old['bundles'] & self.changed_bundles)
+
+    def keep_entry(self, name):
+        self.new_entries[name] = self.old['entries'][name]
+        self.kept_entries.append(name)
+
+    def begin_entry(self, name):
+        self.current_entry = self.new_entries[name] = {
+            'name': name,
+            'bundles': set(),
+            'outputs': []}
+
+    def end_entry(self):
+        self.current_entry = None
+
+    def record_selected(self, bundle):
+        """Record that the current entry selected `bundle`"""
+        entry = self.current_entry
+        if entry is not None and entry['bundles'] != ALL_BUNDLES:
+            entry['bundles'].add(bundle.key)
+
+    def record_all_bundles(self, entry=None):
+        """Record that an entry (by default, the current one) depends on every
+        bundle"""
+        if entry is None:
+            entry = self.current_entry
+        if entry is not None:
+            entry['bundles'] = ALL_BUNDLES
+            self.all_bundles_entries.add(entry['name'])
+
+    def pop_updates(self):
+        """Return what was recorded since the last call, for apply_updates().
+        
+        Streamed templates can be rendered in worker processes, which use this
+        to send back what they recorded.
+        """
+        updates = self.all_bundles_entries
+        self.all_bundles_entries = set()
+        return updates
+
+    def apply_updates(self, updates):
+        for name in updates:
+            self.new_entries[name]['bundles'] = ALL_BUNDLES
+
+    def record_output(self, url, canonical):
+        """Record that the current entry renders `url`"""
+        if self.current_entry is not None:
+            self.current_entry['outputs'].append((url, canonical))
+
+    def kept_outputs(self):
+        """Yield (url, canonical) for every output of entries not rerun"""
+        for name in self.kept_entries:
+            for output in self.new_entries[name]['outputs']:
+                yield output
+
+    # outputs
+
+    def output_changed(self, url, digest):
+        """Return True if `digest` isn't what was written to `url` last build
+
+        This doesn't modify the manifest, so it's safe to call from a worker
+        process of a parallel render.
+        """
+        return self.old.get('outputs', {}).get(url) != digest
+
+    def had_output(self, url):
+        """Return True if `url` was written last build"""
+        return url in self.old.get('outputs', ())
+
+    def add_output(self, url, digest):
+        self.new_outputs[url] = digest
+
+    def keep_output(self, url):
+        try:
+            self.new_outputs[url] = self.old['outputs'][url]
+        except KeyError:
+            pass
+
+    def stale_outputs(self):
+        """Return the URLs written last build that weren't written this build"""
+        return sorted(set(self.old.get('outputs', ())) - set(self.new_outputs))
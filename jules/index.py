@@ -0,0 +1,357 @@
+"""Secondary indexes over bundles, for the query operators.
+
+The query engine builds one BundleIndex after the bundles are prepared. A
+pipeline starts out with IndexedResults over every bundle, and select, where
+and order_by keep returning IndexedResults as long as they can answer their
+arguments from the index:
+
+ - select: always (it only looks at which components a bundle has).
+ - where: for each leading clause that's an equality, membership or range
+   test of a meta key against a literal, e.g. ``meta["directory"] == "posts"``,
+   ``"python" in meta["tags"]`` or ``meta["order"] >= 3``.
+ - order_by: when the key is a meta key, e.g. ``meta["date_published"]``.
+
+Anything else falls back to evaluating expressions against every item, as
+usual.
+
+An index is only used when it gives exactly the same results as evaluating
+the expression would, errors included. For instance, if some bundle doesn't
+have the meta key at all, evaluating ``meta["key"]`` raises KeyError, so
+the expression is evaluated after all, and raises.
+"""
+
+import ast
+import itertools
+import bisect
+
+NUMBER_TYPES = (int, long, float)
+
+def unpack_components(components, require_components, maybe_components):
+    d = {}
+    for k in require_components:
+        d[k] = components.get(k, None)
+    for k in maybe_components:
+        d[k] = components.get(k, None)
+    return d
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+def _same_type(values):
+    """Return True if values can all be compared with each other, sanely."""
+    types = set(type(v) for v in values)
+    return len(types) <= 1 or all(issubclass(t, NUMBER_TYPES) for t in types)
+
+class MetaKeyIndex(object):
+    """Index of the value of one meta key across all bundles.
+
+    Each part of the index is only built when it's first needed, and is None
+    if it can't be built (e.g. an equality index when some values aren't
+    hashable).
+    """
+    def __init__(self, key, bundles):
+        self.key = key
+        self.values = {} # position -> value, for bundles with the key
+        for i, bundle in enumerate(bundles):
+            meta = bundle.components.get('meta')
+            if isinstance(meta, dict) and key in meta:
+                self.values[i] = meta[key]
+        self.missing = set(xrange(len(bundles))) - set(self.values)
+        self._eq = self._members = self._sorted = self._sorted_desc = False
+
+    def eq(self):
+        """{value: set(positions)}"""
+        if self._eq is False:
+            self._eq = {}
+            for i, value in self.values.iteritems():
+                if not _hashable(value):
+                    self._eq = None
+                    break
+                self._eq.setdefault(value, set()).add(i)
+        return self._eq
+
+    def members(self):
+        """{member: set(positions)} for keys whose values are collections"""
+        if self._members is False:
+            self._members = {}
+            for i, value in self.values.iteritems():
+                if not isinstance(value, (list, tuple, set, frozenset)):
+                    self._members = None
+                    break
+                for member in value:
+                    if not _hashable(member):
+                        self._members = None
+                        break
+                    self._members.setdefault(member, set()).add(i)
+                if self._members is None:
+                    break
+        return self._members
+
+    def sorted_positions(self, descending=False):
+        """The positions, sorted by value, stably"""
+        if self._sorted is False:
+            if _same_type(self.values.itervalues()):
+                positions = sorted(self.values)
+                self._sorted = sorted(positions, key=self.values.__getitem__)
+                self._sorted_desc = sorted(positions,
+                    key=self.values.__getitem__, reverse=True)
+            else:
+                self._sorted = self._sorted_desc = None
+        return self._sorted_desc if descending else self._sorted
+
+    def range(self, op, literal):
+        """Return the set of positions whose value `op` literal is true"""
+        positions = self.sorted_positions()
+        if positions is None:
+            return None
+        values = [self.values[i] for i in positions]
+        if values and not _same_type([values[0], literal]):
+            return None
+        if op == '<':
+            return set(positions[:bisect.bisect_left(values, literal)])
+        if op == '<=':
+            return set(positions[:bisect.bisect_right(values, literal)])
+        if op == '>':
+            return set(positions[bisect.bisect_right(values, literal):])
+        if op == '>=':
+            return set(positions[bisect.bisect_left(values, literal):])
+
+class BundleIndex(object):
+    def __init__(self, bundles):
+        self.bundles = list(bundles)
+        self.components = {} # component name -> set(positions)
+        for i, bundle in enumerate(self.bundles):
+            for name in bundle.components:
+                self.components.setdefault(name, set()).add(i)
+        self._meta = {}
+
+    def meta(self, key):
+        try:
+            return self._meta[key]
+        except KeyError:
+            return self._meta.setdefault(key, MetaKeyIndex(key, self.bundles))
+
+    def all(self):
+        return IndexedResults(self)
+
+class IndexedResults(object):
+    """Results that are (a projection of) some of the indexed bundles.
+
+    - positions: the indexes of the bundles in the results, in order, or None
+      for all of them in their original order.
+    - projection: None if the results are the bundles themselves, or
+      (require_components, maybe_components) if they're the dicts produced
+      by select.
+    """
+    def __init__(self, index, positions=None, projection=None):
+        self.index = index
+        self.positions = positions
+        self.projection = projection
+
+    def __iter__(self):
+        bundles = self.index.bundles
+        positions = self.positions
+        if positions is None:
+            positions = xrange(len(bundles))
+        if self.projection is None:
+            for i in positions:
+                yield bundles[i]
+        else:
+            require_components, maybe_components = self.projection
+            for i in positions:
+                yield unpack_components(
+                    bundles[i].components, require_components, maybe_components)
+
+    def __len__(self):
+        if self.positions is None:
+            return len(self.index.bundles)
+        return len(self.positions)
+
+    def bundles(self):
+        """Iterate over the bundles behind the results"""
+        if self.positions is None:
+            return iter(self.index.bundles)
+        return (self.index.bundles[i] for i in self.positions)
+
+    def in_original_order(self):
+        positions = self.positions
+        return positions is None or all(
+            a < b for a, b in zip(positions, positions[1:]))
+
+    def restrict(self, matches):
+        """Return the results, with only the positions in the set `matches`"""
+        if self.positions is None:
+            positions = sorted(matches)
+        else:
+            positions = [i for i in self.positions if i in matches]
+        return IndexedResults(self.index, positions, self.projection)
+
+    def contains_all(self, positions):
+        """Return True if every result's position is in `positions`"""
+        if self.positions is None:
+            return len(positions) >= len(self.index.bundles)
+        return all(i in positions for i in self.positions)
+
+    def select(self, require_components, maybe_components, forbid_components):
+        """Return the result of the select operator, or None if unindexable"""
+        if self.projection is not None:
+            return None
+        index = self.index
+        matches = set(xrange(len(index.bundles)))
+        for name in require_components:
+            matches &= index.components.get(name, set())
+        for name in forbid_components:
+            matches -= index.components.get(name, set())
+        results = self.restrict(matches)
+        results.projection = (tuple(require_components), tuple(maybe_components))
+        return results
+
+    def meta_index(self, subject):
+        """Return the MetaKeyIndex for a subject from parse_subject(), if it
+        can stand in for evaluating the subject on every result."""
+        if subject is None or self.projection is None:
+            return None
+        name, key = subject
+        if name != 'meta' or 'meta' not in self.projection[0] + self.projection[1]:
+            return None
+        meta_index = self.index.meta(key)
+        if self.positions is None:
+            if meta_index.missing:
+                return None
+        elif not meta_index.missing.isdisjoint(self.positions):
+            return None
+        return meta_index
+
+    def where(self, clause):
+        """Return the results filtered by a clause, or None if unindexable"""
+        test = parse_clause(clause)
+        if test is None:
+            return None
+        kind, subject, literal = test
+        meta_index = self.meta_index(subject)
+        if meta_index is None:
+            return None
+
+        if kind == '==':
+            eq = meta_index.eq()
+            if eq is None or not _hashable(literal):
+                return None
+            return self.restrict(eq.get(literal, set()))
+        if kind == 'in':
+            # `subject in (literal, literal, ...)`
+            eq = meta_index.eq()
+            if eq is None or not all(_hashable(v) for v in literal):
+                return None
+            matches = set()
+            for value in literal:
+                matches |= eq.get(value, set())
+            return self.restrict(matches)
+        if kind == 'contains':
+            # `literal in subject`
+            members = meta_index.members()
+            if members is None or not _hashable(literal):
+                return None
+            return self.restrict(members.get(literal, set()))
+        matches = meta_index.range(kind, literal)
+        if matches is None:
+            return None
+        return self.restrict(matches)
+
+    def order_by(self, key, descending, n=None):
+        """Return the results sorted by key (only the first `n` of them, if
+        given), or None if unindexable"""
+        if not self.in_original_order():
+            # sorting is stable, and the index only knows the original order.
+            return None
+        meta_index = self.meta_index(parse_subject(key))
+        if meta_index is None:
+            return None
+        positions = meta_index.sorted_positions(descending)
+        if positions is None:
+            return None
+        if self.positions is not None:
+            included = set(self.positions)
+            positions = (i for i in positions if i in included)
+        if n is not None:
+            positions = itertools.islice(positions, n)
+        return IndexedResults(self.index, list(positions), self.projection)
+
+# recognizing expressions
+
+REVERSED_OPS = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '=='}
+AST_OPS = {
+    ast.Eq: '==',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+    ast.In: 'in',
+}
+
+def _parse(expr):
+    try:
+        return ast.parse(expr.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+
+def _subject(node):
+    """`name["key"]` -> (name, key), otherwise None"""
+    if (isinstance(node, ast.Subscript)
+    and isinstance(node.value, ast.Name)
+    and isinstance(node.slice, ast.Index)
+    and isinstance(node.slice.value, ast.Str)):
+        return (node.value.id, node.slice.value.s)
+    return None
+
+def _literal(node):
+    """Return (True, value) for literal nodes, otherwise (False, None)"""
+    try:
+        return True, ast.literal_eval(node)
+    except ValueError:
+        return False, None
+
+def parse_subject(expr):
+    """Parse an expression of the form `name["key"]`, into (name, key)"""
+    node = _parse(expr)
+    return None if node is None else _subject(node)
+
+def parse_clause(expr):
+    """Parse a clause that compares a subject to a literal.
+
+    Returns (kind, (name, key), literal), or None if the clause isn't of a
+    recognized form. kind is one of '==', '<', '<=', '>', '>=', 'in' (the
+    subject is in a literal collection) and 'contains' (the literal is in the
+    subject).
+    """
+    node = _parse(expr)
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1:
+        return None
+    op = AST_OPS.get(type(node.ops[0]))
+    if op is None:
+        return None
+    left, right = node.left, node.comparators[0]
+
+    subject = _subject(left)
+    if subject is not None:
+        is_literal, literal = _literal(right)
+        if not is_literal:
+            return None
+        if op == 'in':
+            if not isinstance(literal, (list, tuple, set, frozenset)):
+                return None
+            return ('in', subject, literal)
+        return (op, subject, literal)
+
+    subject = _subject(right)
+    if subject is not None:
+        is_literal, literal = _literal(left)
+        if not is_literal:
+            return None
+        if op == 'in':
+            return ('contains', subject, literal)
+        return (REVERSED_OPS[op], subject, literal)
+    return None
@@ -22,11 +22,119 @@ class BaseJulesPlugin(object):
     def init(self):
         """Convenience init method, instead of that super() nonsense."""
 
+    def reset(self):
+        """Called before every build of an engine after its first (see
+        JulesEngine.rebuild), to forget what the last build left behind."""
+
 class ComponentPlugin(BaseJulesPlugin):
     component_dependencies = ()
 
+    def unload(self, bundle):
+        """Undo the side effects of loading bundle's components (e.g. static
+        files it added), before it's prepared again or after it's removed,
+        by JulesEngine.rebuild."""
+
+    def load_lazy(self, *args):
+        """Load a component that maybe_load() returned as
+        LazyComponent(type(self), args)."""
+        raise NotImplementedError
+
+# Names that LazyComponent doesn't pass on to the loaded value, since
+# they're looked up by pickle and copy before there is one.
+_LAZY_OWN_NAMES = frozenset(['_plugin_class', '_args', '_engine', '_value'])
+
+class LazyComponent(object):
+    """A component that's only loaded when it's first used.
+
+    A ComponentPlugin's maybe_load() can return one for a component that's
+    expensive to load, but that queries don't look at (they only look at
+    meta), so that bundles that no entry renders never load it. It stands in
+    for the loaded value, and using it in (almost) any way, like rendering
+    it, comparing it or getting its attributes, loads it, by calling
+    load_lazy(*args) on the engine's instance of `plugin_class`.
+
+    Unless it's been loaded, it pickles as just the plugin class and args,
+    so it can go in the incremental build manifest and come back from the
+    worker processes of a parallel prepare. The engine is set again (with
+    bind()) when the bundle is prepared.
+    """
+    _unloaded = object()
+
+    def __init__(self, plugin_class, args, engine=None):
+        self._plugin_class = plugin_class
+        self._args = args
+        self._engine = engine
+        self._value = self._unloaded
+
+    def bind(self, engine):
+        if self._engine is None:
+            self._engine = engine
+
+    def loaded(self):
+        return self._value is not self._unloaded
+
+    def load(self):
+        if self._value is self._unloaded:
+            engine = self._engine
+            with engine.profiler.section('plugin', self._plugin_class.__name__):
+                plugin = engine.plugins.produce_instance(self._plugin_class)
+                self._value = plugin.load_lazy(*self._args)
+            self._args = None
+        return self._value
+
+    def __getstate__(self):
+        return {'_plugin_class': self._plugin_class, '_args': self._args}
+
+    def __setstate__(self, state):
+        self.__init__(state['_plugin_class'], state['_args'])
+
+    def __reduce_ex__(self, protocol):
+        if self._value is not self._unloaded:
+            # no need for the engine to load it again.
+            return _loaded_component, (self._plugin_class, self._value)
+        return object.__reduce_ex__(self, protocol)
+
+    def __getattr__(self, name):
+        if name in _LAZY_OWN_NAMES or (
+                name.startswith('__') and name != '__html__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        if self._value is self._unloaded:
+            return '<LazyComponent of %s>' % self._plugin_class.__name__
+        return repr(self._value)
+
+    def __unicode__(self): return unicode(self.load())
+    def __str__(self): return str(self.load())
+    def __nonzero__(self): return bool(self.load())
+    def __len__(self): return len(self.load())
+    def __iter__(self): return iter(self.load())
+    def __contains__(self, item): return item in self.load()
+    def __getitem__(self, key): return self.load()[key]
+    def __hash__(self): return hash(self.load())
+    def __eq__(self, other): return self.load() == other
+    def __ne__(self, other): return self.load() != other
+    def __lt__(self, other): return self.load() < other
+    def __le__(self, other): return self.load() <= other
+    def __gt__(self, other): return self.load() > other
+    def __ge__(self, other): return self.load() >= other
+    def __add__(self, other): return self.load() + other
+    def __radd__(self, other): return other + self.load()
+    def __mod__(self, other): return self.load() % other
+
+def _loaded_component(plugin_class, value):
+    component = LazyComponent(plugin_class, None)
+    component._value = value
+    return component
+
 class QueryPlugin(BaseJulesPlugin):
-    pass
+    # names of the methods whose results only depend on their arguments, so
+    # that queries templates run on `bundles` can be memoized.
+    pure_methods = ()
+    # names of the methods that read all of their input before producing
+    # any output (see QueryEngine.explain).
+    materializing_methods = ()
 
 class EnginePlugin(BaseJulesPlugin):
     def initialize(self):
@@ -1,16 +1,10 @@
 import itertools
+import heapq
 import code
 
-import jinja2
-
 import jules
 from jules.query import cache, unwrapping_kwargs, method_registrar
-
-def unpack_components(components, require_components, maybe_components):
-    d = {}
-    for k in itertools.chain(require_components, maybe_components):
-        d[k] = components.get(k, None)
-    return d
+from jules.index import IndexedResults, unpack_components
 
 def precompile(exprs):
     return [compile(e, '<query>', 'eval') for e in exprs]
@@ -19,6 +13,9 @@ class BaseQuery(jules.plugins.QueryPlugin):
     """Basic querying operations"""
     methods = []
     register = method_registrar(methods)
+    pure_methods = ('select', 'order_by', 'where', 'limit', 'top',
+        'group_by_in', 'group_by_eq', 'rename', 'count')
+    materializing_methods = ('order_by', 'group_by_in', 'group_by_eq', 'debug')
     
     @register
     @unwrapping_kwargs
@@ -28,6 +25,19 @@ class BaseQuery(jules.plugins.QueryPlugin):
         maybe_components = (),
         forbid_components = ()):
     
+        if isinstance(results, IndexedResults):
+            selected = results.select(
+                require_components, maybe_components, forbid_components)
+            if selected is not None:
+                if self.engine.manifest is not None:
+                    for bundle in selected.bundles():
+                        self.engine.manifest.record_selected(bundle)
+                return selected
+        return self._select(results,
+            require_components, maybe_components, forbid_components)
+
+    def _select(self,
+        results, require_components, maybe_components, forbid_components):
         for bundle in results:
             if not all(comp in bundle.components for comp in require_components):
                 continue
@@ -35,18 +45,58 @@ class BaseQuery(jules.plugins.QueryPlugin):
                 continue
             # FIXME: find reporting mechanism for bundles??? maybe set to
             #        accessed_bundles attribute of self or something.
+            if self.engine.manifest is not None:
+                self.engine.manifest.record_selected(bundle)
             yield unpack_components(bundle.components, require_components, maybe_components)
 
     @register
     @unwrapping_kwargs
     def order_by(self, results, key, descending=False):
+        if isinstance(results, IndexedResults):
+            ordered = results.order_by(key, descending)
+            if ordered is not None:
+                return ordered
         key, = precompile([key])
         return sorted(results,
             reverse=descending,
             key=lambda item: eval(key, {}, item))
     
+    @register
+    @unwrapping_kwargs
+    def top(self, results, key, n, descending=False):
+        """The same as order_by and then limit, but only keeps n results in
+        memory, rather than sorting all of them.
+
+        The query planner (QueryEngine.plan) uses this for an order_by
+        followed by a limit.
+        """
+        if isinstance(results, IndexedResults):
+            ordered = results.order_by(key, descending, n)
+            if ordered is not None:
+                return ordered
+        key, = precompile([key])
+        keyfunc = lambda item: eval(key, {}, item)
+        # these are documented to be the same as sorted(...)[:n]
+        if descending:
+            return heapq.nlargest(n, results, keyfunc)
+        return heapq.nsmallest(n, results, keyfunc)
+
     @register
     def where(self, results, clauses):
+        # Clauses are evaluated in order, stopping at the first false one, so
+        # only a leading run of clauses can be answered from the index.
+        clauses = list(clauses)
+        while clauses and isinstance(results, IndexedResults):
+            filtered = results.where(clauses[0])
+            if filtered is None:
+                break
+            results = filtered
+            clauses.pop(0)
+        if not clauses:
+            return results
+        return self._where(results, clauses)
+
+    def _where(self, results, clauses):
         clauses = precompile(clauses)
         for item in results:
             if all(eval(clause, {}, item) for clause in clauses):
@@ -82,20 +132,27 @@ class BaseQuery(jules.plugins.QueryPlugin):
     def _group_by(self, results, valuesets):
         """The backend implementation of group_by_in (and eq, secretly.)
         
-        Requires that the resultset be cached as a list (not an iterator)
+        Groups come out in the order their values were first seen, and the
+        items in each group in the order of `results`. This is a single pass
+        over the results, keeping one group per distinct value.
         """
-        grouped_values = set()
-        for valueset in valuesets:
+        groups = {}
+        keys = []
+        for item, valueset in itertools.izip(results, valuesets):
+            seen = set()
             for value in valueset:
-                if value in grouped_values:
+                if value in seen:
                     continue
-                grouped_values.add(value)
-                
-                group = [item
-                    for item, valueset in itertools.izip(results, valuesets)
-                    if value in valueset]
-                
-                yield {'group': group, 'key': value}
+                seen.add(value)
+                try:
+                    group = groups[value]
+                except KeyError:
+                    group = groups[value] = []
+                    keys.append(value)
+                group.append(item)
+        
+        for value in keys:
+            yield {'group': groups[value], 'key': value}
     
     @register
     def rename(self, results, renames):
@@ -1,7 +1,9 @@
+import copy
+
 from straight.plugin import load
 
 import jules
-from jules.plugins import ComponentPlugin, BaseJulesPlugin
+from jules.plugins import ComponentPlugin, BaseJulesPlugin, LazyComponent
 
 jules.add_namespace(__package__)
 
@@ -22,19 +24,33 @@ class PostComponent(ComponentPlugin):
                 ext_plugins[ext] = plugin
     
     def maybe_load(self, components, post):
+        """Parse the post, or, if parsing it can't change the meta data, return
+        a LazyComponent that parses it when it's first used."""
         meta = components['meta']
         post_ext, post_path = post
         
-        post = open(post_path)
         try:
-            return self.ext_plugins[post_ext].parse_post(meta, post.read())
+            parser = self.ext_plugins[post_ext]
         except KeyError:
             return None
-        finally:
-            post.close()
+        with open(post_path) as post:
+            src = post.read()
+        if parser.affects_meta(meta, src):
+            return parser.parse_post(meta, src)
+        # parse_post() gets the meta data as it is now, just like when it's
+        # parsed right away.
+        return LazyComponent(type(self), (post_ext, copy.deepcopy(meta), src))
+
+    def load_lazy(self, post_ext, meta, src):
+        return self.ext_plugins[post_ext].parse_post(meta, src)
 
 class PostParserPlugin(BaseJulesPlugin):
-    pass
+    def affects_meta(self, meta, src):
+        """Return True if parse_post(meta, src) can change `meta`.
+
+        If it can't, the post is only parsed once something uses it.
+        """
+        return True
 
 ##class TemplatePlugin(object):
 
@@ -1,83 +1,79 @@
 import re
+import copy
 
-from docutils.core import publish_parts
-from docutils import nodes, utils
-from docutils.parsers.rst import roles, directives, Directive
-
-import yaml
-
+from jules.plugins import BaseJulesPlugin
 from jules.plugins.post import PostParserPlugin
-from jules.plugins.rendering import Renderer
-
-class RstContentParser(PostParserPlugin):
-    """Parses any .rst files in a bundle."""
-    extensions = ('.rst',)
-    
-    def parse_post(self, meta, src):
-        parts = publish_parts(source=src, writer_name='html',
-            settings_overrides={
-                'meta': meta
-        })
-        
-        meta.setdefault('title', parts['title'])
-        meta.setdefault('subtitle', parts['subtitle'])
-        return parts['html_body']
-
-
-def doclink(name, rawtext, text, lineno, inliner, options={}, content=[]):
-    """Link to another document.
+from jules.cache import cache_key
 
-    Returns 2 part tuple containing list of nodes to insert into the
-    document and a list of system messages. Both are allowed to be
-    empty.
+class RstExtensionPlugin(BaseJulesPlugin):
+    """Adds roles or directives to docutils.
 
-    :param name: The role name used in the document.
-    :param rawtext: The entire markup snippet, with role.
-    :param text: The text marked with the role.
-    :param lineno: The line number where rawtext appears in the input.
-    :param inliner: The inliner instance that called us.
-    :param options: Directive options for customization.
-    :param content: The directive content for customization.
+    register() is called just before the first post is parsed, which is when
+    docutils (and whatever else the extension needs) should be imported.
+    Then settings() can add to the docutils settings of every post, which
+    is where roles and directives can find things that belong to the engine.
     """
+    def register(self):
+        raise NotImplementedError
 
-    try:
-        m = re.match(r'(.*)<([-\w]+)(#[-\w]+)?>', text)
-        label, key, anchor = m.groups()
-    except (AttributeError, re.error):
-        label = None
-        anchor = None
-        key = text
+    def settings(self):
+        return {}
 
-    # FIXME: this creates an external reference. Need to make internal (how?)
-    node = nodes.reference(
-        rawtext,
-        utils.unescape(label or ''),
-        refuri="jules:canon/" + key + ("#" + anchor if anchor else ''),
-        **options)
+JULES_DIRECTIVE = re.compile(r'^\s*\.\.\s+jules\s*::', re.MULTILINE)
 
-    return [node], []
-
-roles.register_canonical_role('doclink', doclink)
-
-class JulesMeta(Directive):
-
-    required_arguments = 0
-    optional_arguments = 0
-    has_content = True
+class RstContentParser(PostParserPlugin):
+    """Parses any .rst files in a bundle.
 
-    def run(self):
-        try:
-            d = yaml.load('\n'.join(self.content))
-        except yaml.parser.ParserError:
-            raise ValueError("Invalid YAML data")
+    Parsing is cached (see jules.cache), keyed by everything that affects
+    the output: the source, the meta data, the docutils version and the
+    registered roles and directives.
 
-        # docutils is stupid.
-        meta = self.state_machine.document.settings.meta
-        update_meta(meta, d)
+    docutils itself is only imported once there's something to parse (see
+    jules.rst), and its components and default settings are set up once, and
+    used for every post (see jules.rst.Publisher).
+    """
+    extensions = ('.rst',)
 
-        return []
+    def init(self):
+        self.cache = self.engine.get_cache('rst')
+        self._rst = None
+        self._publisher = None
+
+    def rst(self):
+        """Return the jules.rst module, importing it and registering the
+        RstExtensionPlugins the first time."""
+        if self._rst is None:
+            from jules import rst
+            settings = {}
+            for extension in self.engine.plugins.produce_instances(
+                    RstExtensionPlugin):
+                extension.register()
+                settings.update(extension.settings())
+            self._publisher = rst.Publisher(settings)
+            self._rst = rst
+        return self._rst
+
+    def affects_meta(self, meta, src):
+        """Parsing sets the title and subtitle, unless the meta data has them
+        already, and so can the `jules` directive (and anything else)."""
+        return ('title' not in meta or 'subtitle' not in meta
+            or JULES_DIRECTIVE.search(src) is not None)
 
-directives.register_directive("jules", JulesMeta)
+    def parse_post(self, meta, src):
+        rst = self.rst()
+        key = cache_key(src, meta, rst.parser_version())
+        parsed = self.cache.get(key)
+        if parsed is None:
+            parsed = self._publisher.parse(meta, src)
+            self.cache.set(key, parsed)
+        else:
+            # replay what the `jules` directive did during the real parse.
+            for update in parsed['meta_updates']:
+                update_meta(meta, copy.deepcopy(update))
+
+        meta.setdefault('title', parsed['title'])
+        meta.setdefault('subtitle', parsed['subtitle'])
+        return parsed['html_body']
 
 def update_meta(meta, update):
     for k, v in update.iteritems():
@@ -90,4 +86,3 @@ def update_meta(meta, update):
                 continue
         # else (for all of them) (thank goodness we don't need goto here)
         meta[k] = v
-    
@@ -1,5 +1,23 @@
+"""Tests for the reStructuredText post parser.
+
+Run this module directly to time parsing the fixtures below, scaled up to
+thousands of posts, with docutils' publish_parts() and with jules.rst.Publisher:
+
+    python -m jules.plugins.post.tests.test_rst [posts]
+"""
+
+from __future__ import print_function
+
 import unittest
 
+import sys
+import time
+import tempfile
+import shutil
+import threading
+
+import jules
+from jules import cache
 from jules.plugins.post import rst
 
 class TestUpdateMeta(unittest.TestCase):
@@ -57,3 +75,157 @@ class TestUpdateMeta(unittest.TestCase):
         m = {1: {}, 2: []}
         rst.update_meta(m, {1: 2, 2: 3})
         self.assertEqual(m, {1: 2, 2: 3})
+
+class Engine(object):
+    def __init__(self, cache):
+        self.cache = cache
+        self.plugins = jules.PluginDB(self)
+    def get_cache(self, name):
+        return self.cache
+
+class TestParseCache(unittest.TestCase):
+    src = '\n'.join([
+        '.. jules::',
+        '',
+        '    title: Override',
+        '    tags: [b]',
+        '',
+        '=====',
+        'Title',
+        '=====',
+        '',
+        'Hello',
+    ])
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.cache = cache.open_cache(self.tempdir, 'rst')
+        self.parser = rst.RstContentParser(Engine(self.cache), {}, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def parse(self):
+        meta = {'tags': ['a']}
+        return self.parser.parse_post(meta, self.src), meta
+
+    def test_cached(self):
+        uncached = self.parse()
+        cached = self.parse()
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(cached, uncached)
+        self.assertEqual(cached[1],
+            {'title': 'Override', 'subtitle': '', 'tags': ['a', 'b']})
+
+    def test_meta_in_key(self):
+        self.parse()
+        self.parser.parse_post({}, self.src)
+        self.assertEqual(self.cache.misses, 2)
+
+class TestAffectsMeta(unittest.TestCase):
+    def setUp(self):
+        self.parser = rst.RstContentParser(Engine(None), {}, {})
+
+    def test_title(self):
+        self.assertTrue(self.parser.affects_meta({}, 'Hello'))
+        self.assertTrue(self.parser.affects_meta({'title': 'T'}, 'Hello'))
+        self.assertFalse(self.parser.affects_meta(
+            {'title': 'T', 'subtitle': 'S'}, 'Hello'))
+
+    def test_directive(self):
+        self.assertTrue(self.parser.affects_meta(
+            {'title': 'T', 'subtitle': 'S'}, TestParseCache.src))
+
+
+PLAIN_SRC = '\n'.join([
+    '=====',
+    'Title',
+    '=====',
+    '',
+    '--------',
+    'Subtitle',
+    '--------',
+    '',
+    'Hello, *world*. A `link <http://example.com/>`_.',
+    '',
+    '* one',
+    '* two',
+])
+
+def fixtures(n):
+    """n (meta, src) pairs, made from the fixtures in this module"""
+    srcs = [TestParseCache.src, PLAIN_SRC]
+    return [({'tags': ['a']}, srcs[i % len(srcs)] + '\n\nPost %d.' % i)
+            for i in range(n)]
+
+def publish_parts_parse(meta, src):
+    """Parse the way jules.rst did before Publisher"""
+    from docutils.core import publish_parts
+    meta_updates = []
+    parts = publish_parts(source=src, writer_name='html',
+        settings_overrides={
+            'meta': meta,
+            'jules_meta_updates': meta_updates,
+    })
+    return {
+        'html_body': parts['html_body'],
+        'title': parts['title'],
+        'subtitle': parts['subtitle'],
+        'meta_updates': meta_updates,
+    }
+
+class TestPublisher(unittest.TestCase):
+    def setUp(self):
+        self.parser = rst.RstContentParser(Engine(None), {}, {})
+        self.parser.rst()
+        self.publisher = self.parser._publisher
+
+    def test_same_as_publish_parts(self):
+        for meta, src in fixtures(4):
+            expected_meta = dict(meta, tags=list(meta['tags']))
+            expected = publish_parts_parse(expected_meta, src)
+            self.assertEqual(self.publisher.parse(meta, src), expected)
+            self.assertEqual(meta, expected_meta)
+
+    def test_meta_per_post(self):
+        meta = {'tags': ['a']}
+        parsed = self.publisher.parse(meta, TestParseCache.src)
+        self.assertEqual(meta, {'title': 'Override', 'tags': ['a', 'b']})
+        self.assertEqual(parsed['meta_updates'],
+            [{'title': 'Override', 'tags': ['b']}])
+
+        meta = {}
+        parsed = self.publisher.parse(meta, PLAIN_SRC)
+        self.assertEqual(meta, {})
+        self.assertEqual(parsed['meta_updates'], [])
+        self.assertTrue('tags' not in self.publisher.defaults)
+
+    def test_threads(self):
+        results = {}
+        def parse(i):
+            results[i] = [self.publisher.parse(meta, src)
+                for meta, src in fixtures(10)]
+        threads = [threading.Thread(target=parse, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expected = [publish_parts_parse(meta, src) for meta, src in fixtures(10)]
+        for i in range(4):
+            self.assertEqual(results[i], expected)
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    parser = rst.RstContentParser(Engine(None), {}, {})
+    parser.rst()
+    for name, parse in [
+            ('publish_parts', publish_parts_parse),
+            ('Publisher', parser._publisher.parse)]:
+        posts = fixtures(n)
+        start = time.time()
+        for meta, src in posts:
+            parse(meta, src)
+        seconds = time.time() - start
+        print("%-14s %d posts  %7.3fs  %6.3fms/post" %
+            (name, n, seconds, seconds * 1000 / n))
@@ -1,86 +1,16 @@
-# -*- coding: utf-8 -*-
-"""
-    The Pygments reStructuredText directive
-    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+from jules.plugins.post.rst import RstExtensionPlugin
 
-    This fragment is a Docutils_ 0.5 directive that renders source code
-    (to HTML only, currently) via Pygments.
+class PygmentsDirective(RstExtensionPlugin):
+    """The ``sourcecode`` directive, highlighting code with Pygments.
 
-    To use it, adjust the options below and copy the code into a module
-    that you import on initialization.  The code then automatically
-    registers a ``sourcecode`` directive that you can use instead of
-    normal code blocks like this::
-
-        .. sourcecode:: python
-
-            My code goes here.
-
-    If you want to have different code styles, e.g. one with line numbers
-    and one without, add formatters with their names in the VARIANTS dict
-    below.  You can invoke them instead of the DEFAULT one by using a
-    directive option::
-
-        .. sourcecode:: python
-            :linenos:
-
-            My code goes here.
-
-    Look at the `directive documentation`_ to get all the gory details.
-
-    .. _Docutils: http://docutils.sf.net/
-    .. _directive documentation:
-       http://docutils.sourceforge.net/docs/howto/rst-directives.html
-
-    :copyright: Copyright 2006-2009 by the Pygments team, see AUTHORS.
-    :license: BSD, see LICENSE for details.
-"""
-
-# From http://stefan.sofa-rockers.org/2010/01/13/django-highlighting-rest-using-pygments/
-
-from __future__ import absolute_import
-
-# Options
-# ~~~~~~~
-
-# Set to True if you want inline CSS styles instead of classes
-INLINESTYLES = False
-
-from pygments.formatters import HtmlFormatter
-
-# The default formatter
-DEFAULT = HtmlFormatter(noclasses=INLINESTYLES)
-
-# Add name -> formatter pairs for every variant you want to use
-VARIANTS = {
-    # 'linenos': HtmlFormatter(noclasses=INLINESTYLES, linenos=True),
-}
-
-
-from docutils import nodes
-from docutils.parsers.rst import directives, Directive
-
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, TextLexer
-
-class Pygments(Directive):
-    """ Source code syntax hightlighting.
+    See jules.sourcecode, which is only imported (along with Pygments) once
+    a post is parsed. Highlighted code is cached in the `pygments` cache.
     """
-    required_arguments = 1
-    optional_arguments = 0
-    final_argument_whitespace = True
-    option_spec = dict([(key, directives.flag) for key in VARIANTS])
-    has_content = True
-
-    def run(self):
-        self.assert_has_content()
-        try:
-            lexer = get_lexer_by_name(self.arguments[0])
-        except ValueError:
-            # no lexer found - use the text one instead of an exception
-            lexer = TextLexer()
-        # take an arbitrary option if more than one is given
-        formatter = self.options and VARIANTS[self.options.keys()[0]] or DEFAULT
-        parsed = highlight('\n'.join(self.content), lexer, formatter)
-        return [nodes.raw('', parsed, format='html')]
-
-directives.register_directive('sourcecode', Pygments)
+    def register(self):
+        # importing it registers the directive.
+        import jules.sourcecode
+
+    def settings(self):
+        from jules.sourcecode import Highlighter
+        return {'jules_highlighter':
+            Highlighter(self.engine.get_cache('pygments'))}
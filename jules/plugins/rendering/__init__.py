@@ -1,21 +1,36 @@
 import os
+import hashlib
+import logging
 import tempfile
-import shutil
+import multiprocessing
+import multiprocessing.pool
 import posixpath
 
-import genshi
-import jinja2
-
 import jules
 from jules.query import cache, unwrapping_kwargs, method_registrar
-from jules import writer, utils
+from jules import writer, utils, incremental, publish, fingerprint
 
-from .postprocessing import MutatingPostProcessingPlugin
+from .postprocessing import (MutatingPostProcessingPlugin,
+    MutatingPostProcessingStreamPlugin, SiblingPostProcessingPlugin)
 
 jules.add_namespace(__package__)
 
+logger = logging.getLogger(__name__)
+
 class CanonConflictError(Exception): pass
 
+# The renderer whose URLs are being rendered by a process pool. The workers
+# are forked from the renderer's process, so they inherit it.
+_pool_renderer = None
+
+def _render_url(i):
+    digest = _pool_renderer.render_url(i)
+    engine = _pool_renderer.engine
+    updates = None
+    if engine.manifest is not None:
+        updates = engine.manifest.pop_updates()
+    return digest, updates, engine.profiler.pop_records()
+
 class Renderer(jules.plugins.EnginePlugin):
     """Query operatings for rendering results to disk.
     
@@ -34,36 +49,168 @@ class Renderer(jules.plugins.EnginePlugin):
        using the collect_urls() method.
      * Render to disk.
        This is done during the finalization phase of the EnginePlugin,
-       using the render_urls() method.
+       using the render_urls() method, into a staging directory in the cache
+       directory.
      * Put rendered data into final location.
-       This is also done during finalization, but in final_move()
+       This is also done during finalization, but in publish(), which only
+       replaces the files that changed (see jules.publish).
+
+    During an incremental build (when the engine has a manifest), the data is
+    instead written directly to the final location, skipping anything that is
+    unchanged since the last build, and the outputs that are no longer
+    produced are removed in remove_stale().
+
+    Either way, what changed in the output directory is written to the
+    change manifest.
+
+    Outputs can have siblings, made from their data as written (see
+    SiblingPostProcessingPlugin), e.g. /style.css.gz next to /style.css.
+
+    If the engine has an `outputs` dict, that's the final location instead of
+    the output directory (see jules.writer.MemoryURLWriter).
+
+    With the `fingerprint` config, static files are postprocessed and hashed
+    before any entry runs, in initialize(), so that their fingerprinted URLs
+    are known to templates and to the postprocessors that rewrite references
+    to them (see jules.fingerprint).
     """
     
+    config = utils.named_keywords('render_backend', 'change_manifest',
+        'fingerprint')
+
     def init(self):
         self.config.output_dir = os.path.join(
             self.engine.src_path,
             getattr(self.config, 'output_dir', '_build'))
+        self.reset()
 
+    def reset(self):
         self.url_canon = {} # map names -> (url, title)
         self.name_canon = {} # map urls -> (name, title)
 
-        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.fingerprints = {} # map final urls -> fingerprinted urls
+        self.prerendered = {} # map urls -> postprocessed data, see initialize()
+
+        self.changes = publish.Changes()
+        if self.engine.manifest is None and self.engine.outputs is None:
+            # in the cache directory, so that it's (probably) on the same
+            # filesystem as the output directory, for publish().
+            cache_dir = self.engine.cache_dir
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            self.tempdir = tempfile.mkdtemp(suffix='-jules', dir=cache_dir)
+        else:
+            self.tempdir = None
     
     def init_postprocessors(self):
-        postprocessors = self.engine.plugins.produce_instances(
-            MutatingPostProcessingPlugin)
+        postprocessors = [p for p in self.engine.plugins.produce_instances(
+            MutatingPostProcessingPlugin) if p.enabled]
         self.postprocessors = list(utils.topsort(
             {p: p.processing_dependencies
             for p in postprocessors}))
+        self.sibling_makers = []
+        if self.engine.outputs is None:
+            self.sibling_makers = [p for p in
+                self.engine.plugins.produce_instances(
+                    SiblingPostProcessingPlugin) if p.enabled]
     
+    def initialize(self):
+        extensions = fingerprint.extensions(
+            getattr(self.config, 'fingerprint', False))
+        if extensions:
+            self.init_postprocessors()
+            with self.engine.profiler.section('phase', 'fingerprint'):
+                self.fingerprint_static(extensions)
+        if self.engine.manifest is not None:
+            self.engine.manifest.check_fingerprinted(self.fingerprints)
+
+    def fingerprint_static(self, extensions):
+        """Work out the fingerprinted URLs of the static files with one of
+        `extensions`, postprocessing the ones that have postprocessors now.
+
+        The references in stylesheets are rewritten, so their fingerprints
+        depend on those of the files they refer to; see fingerprint_order.
+        """
+        renders = {}
+        for plugin in self.engine.plugins.produce_instances(RenderingPlugin):
+            for url, canon, data in plugin.get_static_render_actions():
+                final_url = self.postprocess_url(url)
+                if posixpath.splitext(final_url)[1] in extensions:
+                    renders[final_url] = url, data
+        order = self.fingerprint_order(renders)
+        self.prepare_postprocessors([renders[final_url] for final_url in order])
+
+        manifest = self.engine.manifest
+        for final_url in order:
+            url, data = renders[final_url]
+            if self.has_postprocessors(url):
+                with self.engine.profiler.section('url', url):
+                    processed = utils.join_chunks(
+                        self.postprocess_data(url, data.read()))
+                if isinstance(processed, unicode):
+                    processed = processed.encode('utf-8')
+                self.prerendered[url] = processed
+                digest = incremental.data_digest(processed)
+            elif manifest is not None:
+                digest = manifest.fingerprints.fingerprint(data.path)[2]
+            else:
+                digest = incremental.file_digest(data.path)
+            self.fingerprints[final_url] = fingerprint.fingerprinted_url(
+                final_url, digest)
+
+    def fingerprint_order(self, renders):
+        """Return the final URLs in renders ({final url: (url, data)}) in the
+        order to fingerprint them: other files first, then each stylesheet
+        after the stylesheets it refers to.
+
+        Stylesheets that refer to each other in a cycle (or to one in a cycle)
+        can't be ordered, so they're left out and keep their plain URLs.
+        """
+        order = sorted(final_url for final_url in renders
+            if not final_url.endswith('.css'))
+        stylesheets = {}
+        for final_url, (url, data) in renders.iteritems():
+            if final_url.endswith('.css'):
+                refs = [fingerprint.resolve_reference(ref, final_url)
+                    for ref in fingerprint.css_references(data.read())]
+                stylesheets[final_url] = set(ref for ref in refs
+                    if ref in renders and ref.endswith('.css'))
+        try:
+            for final_url in utils.topsort(stylesheets):
+                order.append(final_url)
+        except utils.CircularDependencyError as e:
+            logger.warning("Not fingerprinting stylesheets that refer to each "
+                "other in a cycle: %s", ', '.join(sorted(e.args[0])))
+        return order
+
+    def fingerprint_url(self, url):
+        """Return the fingerprinted URL of the static file at url, or url if
+        it has none (the `fingerprint` template filter)"""
+        return self.fingerprints.get(url, url)
+
     def finalize(self):
         self.init_postprocessors() # FIXME: circular dependencies are disgusting man.
         self.collect_urls()
-        self.render_urls()
-        self.final_move()
+        profiler = self.engine.profiler
+        with profiler.section('phase', 'render'):
+            self.render_urls()
+        with profiler.section('phase', 'move'):
+            if self.engine.manifest is not None:
+                self.remove_stale()
+            elif self.engine.outputs is None:
+                self.publish()
+        if self.engine.outputs is None:
+            self.changes.write(self.change_manifest_path())
     
     def collect_urls(self):
         self.renders = []
+
+        if self.engine.manifest is not None:
+            # Entries that weren't rerun still own their URLs and names.
+            for url, canon in self.engine.manifest.kept_outputs():
+                if canon is not None:
+                    name, title = canon
+                    self.update_canon(name, title, url)
         
         for url, canon, data in self.get_render_actions():
             if canon is not None:
@@ -72,14 +219,223 @@ class Renderer(jules.plugins.EnginePlugin):
             self.renders.append((url, data))
     
     def render_urls(self):
-        urlwriter = writer.URLWriter(self.tempdir)
+        """Postprocess the collected data and write it out.
+
+        With engine.jobs > 1, this happens in a pool of processes (or threads,
+        with the render_backend config set to 'thread'). Either way, every URL
+        is claimed up front, in order, so that URLWriteConflicts are exactly
+        the ones of a serial render.
+        """
+        manifest = self.engine.manifest
+        if manifest is None and self.engine.outputs is None:
+            urlwriter = writer.URLWriter(self.tempdir)
+        else:
+            urlwriter = self.output_writer()
+        self.memory_writer = (
+            urlwriter if self.engine.outputs is not None else None)
+        if manifest is not None:
+            for url, canon in manifest.kept_outputs():
+                url = self.postprocess_url(url)
+                urlwriter.urlpath(url)
+                manifest.keep_output(url)
+                for maker, sibling_url, path in self.siblings_for(
+                        url, urlwriter):
+                    manifest.keep_output(sibling_url)
+
+        self.render_paths = []
+        self.render_siblings = []
         for url, data in self.renders:
-            data = self.postprocess_data(url, data)
-            url = self.postprocess_url(url)
-            with urlwriter.urlopen(url) as f:
-                f.write(data)
+            final_url = self.postprocess_url(url)
+            self.render_paths.append(
+                (final_url, urlwriter.urlpath(final_url)))
+            self.render_siblings.append(self.siblings_for(final_url, urlwriter))
+            if manifest is not None and isinstance(data, writer.SourceFile):
+                # fingerprint here rather than in a worker, so that it's
+                # remembered for the next build.
+                manifest.fingerprints.fingerprint(data.path)
+
+        self.prepare_postprocessors([(url, data) for url, data in self.renders
+            if url not in self.prerendered])
+
+        indices = range(len(self.renders))
+        jobs = self.engine.jobs
+        if jobs > 1 and len(indices) > 1:
+            digests = self.map_in_pool(indices, jobs)
+        else:
+            digests = map(self.render_url, indices)
+
+        if manifest is not None:
+            for (final_url, path), siblings, digest in zip(
+                    self.render_paths, self.render_siblings, digests):
+                # a sibling is recorded with the digest of its output.
+                urls = [final_url] + [url for maker, url, _ in siblings]
+                for url in urls:
+                    if not manifest.had_output(url):
+                        self.changes.added.append(output_path(url))
+                    elif manifest.output_changed(url, digest):
+                        self.changes.changed.append(output_path(url))
+                    manifest.add_output(url, digest)
         
         self.renders = []
+        self.render_paths = []
+        self.render_siblings = []
+        self.memory_writer = None
+
+    def siblings_for(self, final_url, urlwriter):
+        """Claim the URLs of the siblings of the output at final_url, returning
+        a list of (maker, sibling url, path to write it at)."""
+        url = urlwriter.normalize_url(final_url)
+        siblings = []
+        for maker in self.sibling_makers:
+            if maker.applies_to(url):
+                sibling_url = url + maker.suffix
+                siblings.append(
+                    (maker, sibling_url, urlwriter.urlpath(sibling_url)))
+        return siblings
+
+    def output_writer(self):
+        """Return the URLWriter for the final location of the outputs"""
+        if self.engine.outputs is not None:
+            return writer.MemoryURLWriter(self.engine.outputs)
+        return writer.URLWriter(self.config.output_dir)
+
+    def render_url(self, i):
+        """Postprocess and write the i'th collected URL, returning a digest of
+        the data written."""
+        url, data = self.renders[i]
+        with self.engine.profiler.section('url', url):
+            digest = self._write_url(i)
+            if self.render_siblings[i]:
+                self.write_siblings(i, digest)
+            return digest
+
+    def write_siblings(self, i, digest):
+        """Make the siblings of the i'th collected URL, from what was written,
+        unless it's unchanged and they're already there."""
+        final_url, path = self.render_paths[i]
+        manifest = self.engine.manifest
+        profiler = self.engine.profiler
+        data = None
+        for maker, sibling_url, sibling_path in self.render_siblings[i]:
+            if (manifest is not None
+                    and not manifest.output_changed(sibling_url, digest)
+                    and os.path.isfile(sibling_path)):
+                continue
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            with profiler.section('plugin', type(maker).__name__):
+                sibling = maker.make_sibling(data)
+            tmp_path = sibling_path + '.jules-tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(sibling)
+            os.rename(tmp_path, sibling_path)
+
+    def _write_url(self, i):
+        url, data = self.renders[i]
+        final_url, path = self.render_paths[i]
+        manifest = self.engine.manifest
+        if url in self.prerendered:
+            # postprocessed already, to fingerprint it.
+            data = self.prerendered[url]
+        else:
+            if isinstance(data, writer.SourceFile):
+                if self.has_postprocessors(url):
+                    data = data.read()
+                elif self.memory_writer:
+                    self.memory_writer.write(path, data)
+                    return manifest.fingerprints.fingerprint(data.path)[2]
+                else:
+                    return self.copy_url(data, final_url, path)
+            data = self.postprocess_data(url, data)
+        if self.memory_writer:
+            data = utils.join_chunks(data)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            self.memory_writer.write(path, data)
+            return incremental.data_digest(data)
+        if manifest is None:
+            with open(path, 'w') as f:
+                return write_chunks(f, data)
+
+        if isinstance(data, basestring):
+            digest = incremental.data_digest(data)
+            if manifest.output_changed(final_url, digest) or not os.path.isfile(path):
+                tmp_path = path + '.jules-tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.rename(tmp_path, path)
+            return digest
+
+        # Streamed data: only know whether it changed once it's all written.
+        tmp_path = path + '.jules-tmp'
+        with open(tmp_path, 'w') as f:
+            digest = write_chunks(f, data)
+        if manifest.output_changed(final_url, digest) or not os.path.isfile(path):
+            os.rename(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+        return digest
+
+    def copy_url(self, source, final_url, path):
+        """Copy a SourceFile to the output, returning its digest if needed"""
+        manifest = self.engine.manifest
+        if manifest is None:
+            writer.copy_file(source.path, path, source.link)
+            return None
+        
+        digest = manifest.fingerprints.fingerprint(source.path)[2]
+        if manifest.output_changed(final_url, digest) or not os.path.isfile(path):
+            tmp_path = path + '.jules-tmp'
+            writer.copy_file(source.path, tmp_path, source.link)
+            os.rename(tmp_path, path)
+        return digest
+
+    def map_in_pool(self, indices, jobs):
+        """Call render_url for each index in a pool, returning the results"""
+        global _pool_renderer
+        # outputs kept in memory have to be kept in this process.
+        threaded = (self.engine.outputs is not None
+            or getattr(self.config, 'render_backend', 'process') == 'thread')
+        if threaded:
+            pool = multiprocessing.pool.ThreadPool(jobs)
+            f = self.render_url
+        else:
+            # FIXME: relies on fork() to get the renderer into the workers.
+            _pool_renderer = self
+            pool = multiprocessing.Pool(jobs, self.engine.profiler.reset)
+            f = _render_url
+        try:
+            results = pool.map(f, indices, max(1, len(indices) // (jobs * 4)))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _pool_renderer = None
+        if threaded:
+            return results
+        
+        digests = []
+        for digest, updates, records in results:
+            if updates:
+                self.engine.manifest.apply_updates(updates)
+            self.engine.profiler.merge(records)
+            digests.append(digest)
+        return digests
+
+    def remove_stale(self):
+        urlwriter = self.output_writer()
+        for url in self.engine.manifest.stale_outputs():
+            urlwriter.remove(url)
+            self.changes.removed.append(output_path(url))
+
+    def change_manifest_path(self):
+        path = getattr(self.config, 'change_manifest', None)
+        if path is None:
+            return os.path.join(self.engine.cache_dir, 'changes.json')
+        return os.path.join(self.engine.src_path, path)
     
     def postprocessors_for(self, url):
         # FIXME: MIME types instead, perhaps?
@@ -102,9 +458,59 @@ class Renderer(jules.plugins.EnginePlugin):
                 # don't need to reset. Don't hate the coder, hate the code.
                 break
     
+    def prepare_postprocessors(self, renders):
+        """Give each postprocessor the URLs (in renders, a list of (url,
+        data)) it comes first for, to prepare"""
+        batches = {}
+        for url, data in renders:
+            for postprocessor in self.postprocessors_for(url):
+                batches.setdefault(postprocessor, []).append((url, data))
+                break
+        profiler = self.engine.profiler
+        for postprocessor in self.postprocessors:
+            if postprocessor in batches:
+                with profiler.section('plugin', type(postprocessor).__name__):
+                    postprocessor.prepare(batches[postprocessor])
+
+    def has_postprocessors(self, url):
+        for postprocessor in self.postprocessors_for(url):
+            return True
+        return False
+    
     def postprocess_data(self, url, data):
+        """Postprocess data for an URL.
+        
+        `data` is either a string or an iterable of string chunks, and so is
+        the return value. Chunks are only joined together when a
+        postprocessor needs the whole string.
+        """
+        # Runs of stream postprocessors share one parse and one serialization.
+        profiler = self.engine.profiler
+        parser = stream = None
         for postprocessor in self.postprocessors_for(url):
-            data = postprocessor.process_data(data)
+            name = type(postprocessor).__name__
+            if isinstance(postprocessor, MutatingPostProcessingStreamPlugin):
+                if stream is not None and parser.markup != postprocessor.markup:
+                    data = parser.serialize(stream)
+                    stream = None
+                with profiler.section('plugin', name):
+                    if stream is None:
+                        parser = postprocessor
+                        if isinstance(data, basestring):
+                            stream = parser.parse(data)
+                        else:
+                            stream = parser.parse(utils.ChunkReader(data))
+                    stream = postprocessor.process_url_stream(url, stream)
+                stream = profiler.iterate('plugin', name, stream, calls=0)
+            else:
+                if stream is not None:
+                    data = parser.serialize(stream)
+                    stream = None
+                with profiler.section('plugin', name):
+                    data = postprocessor.process_url_data(
+                        url, utils.join_chunks(data))
+        if stream is not None:
+            data = parser.serialize_chunks(stream)
         return data
     
     def postprocess_url(self, url):
@@ -113,24 +519,11 @@ class Renderer(jules.plugins.EnginePlugin):
         ext = os.path.splitext(url)[1]
         for postprocessor in self.postprocessors_for(url):
             ext = postprocessor.output_extension or ext
-        return os.path.splitext(url)[0] + ext
-
-    def final_move(self):
-        out = self.config.output_dir
-
-        # race conditions ahoy, unavoidable, don't care.
-        # should I even bother with this?
-        old_out = None
-        if os.path.isdir(out):
-            temp_storage = tempfile.mkdtemp(suffix='-jules')
-            old_out = os.path.join(temp_storage, os.path.basename(out))
-            shutil.move(out, old_out)
-        try:
-            shutil.move(self.tempdir, out)
-        except:
-            if old_out is not None:
-                shutil.move(old_out, out)
-            raise
+        final_url = os.path.splitext(url)[0] + ext
+        return self.fingerprints.get(final_url, final_url)
+
+    def publish(self):
+        self.changes = publish.publish(self.tempdir, self.config.output_dir)
 
     def get_render_actions(self):
         plugins = self.engine.plugins.produce_instances(RenderingPlugin)
@@ -167,6 +560,20 @@ class Renderer(jules.plugins.EnginePlugin):
         self.url_canon[name] = url, title
         self.name_canon[url] = name, title
 
+def write_chunks(f, data):
+    """Write a string or iterable of string chunks to f, returning a digest"""
+    if isinstance(data, basestring):
+        data = [data]
+    h = hashlib.sha1()
+    for chunk in data:
+        f.write(chunk)
+        h.update(chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk)
+    return h.hexdigest()
+
+def output_path(url):
+    """Return the path of an URL's output, relative to the output directory"""
+    return writer.URLWriter.normalize_url(url).lstrip('/')
+
 def fmt_title(t):
     return "no title" if t is None else "title %r" % t
 
@@ -182,3 +589,28 @@ class RenderingPlugin(jules.plugins.BaseJulesPlugin):
         is a file whose content is at the URL.
         """
         raise NotImplementedError
+
+    def get_template_paths(self):
+        """Return iterable of paths of files/directories used as templates.
+
+        If any file under them changes, an incremental build reruns every
+        entry.
+        """
+        return ()
+
+    def get_static_render_actions(self):
+        """Return iterable of the render actions (see get_render_actions) of
+        static files, whose data is a jules.writer.SourceFile.
+
+        These are known before any entry runs, and can be fingerprinted (see
+        Renderer.initialize).
+        """
+        return ()
+
+    def get_source_paths(self):
+        """Return iterable of paths of other files/directories rendered from.
+
+        These are watched by `jules serve --watch`, along with the bundles,
+        templates and site.yaml.
+        """
+        return ()
@@ -7,9 +7,11 @@ class MutatingPostProcessingPlugin(BaseJulesPlugin):
     # TODO: support MIME types?
     input_extension = None
     output_extension = None
+    # postprocessors that are off (e.g. by config) can set this to False.
+    enabled = True
     
     def process_data(self, data):
-        """Process data and return replacement data.
+        """Process data (a string) and return replacement data.
         
         If the extension of the replacement data is different, then the class
         attribute output_extension must be different. A plugin can't currently
@@ -17,6 +19,80 @@ class MutatingPostProcessingPlugin(BaseJulesPlugin):
         """
         return data
 
+    def process_url_data(self, url, data):
+        """Process the data of the output at url (before any change of
+        extension). Defaults to process_data, for postprocessors that don't
+        care where the data goes."""
+        return self.process_data(data)
+
+    def prepare(self, items):
+        """Called before any URL is rendered, with a list of (url, data) for
+        the URLs whose data this postprocessor is the first to process.
+
+        `data` is a jules.writer.SourceFile, a string, or an iterable of
+        string chunks, which mustn't be consumed here. This is a chance to do
+        work for all of them at once, e.g. in parallel.
+        """
+
+class MutatingPostProcessingStreamPlugin(MutatingPostProcessingPlugin):
+    """A postprocessor that works on a parsed (event stream) document.
+    
+    When several of these apply to the same data one after another, and they
+    share a `markup` language, the Renderer parses the data once, passes the
+    stream through each of them in order, and serializes it once at the end.
+    """
+    abstract = True
+    markup = None
+    
+    def parse(self, data):
+        """Parse data of this plugin's markup language into a stream
+        
+        `data` is either a string or a file-like object to read from.
+        """
+        raise NotImplementedError
+    
+    def serialize(self, stream):
+        """Serialize a stream of this plugin's markup language into data"""
+        raise NotImplementedError
+    
+    def serialize_chunks(self, stream):
+        """Serialize a stream into an iterable of string chunks"""
+        return [self.serialize(stream)]
+    
+    def process_stream(self, stream):
+        """Process a stream and return a replacement stream"""
+        return stream
+    
+    def process_url_stream(self, url, stream):
+        """Process the stream of the output at url, like process_url_data"""
+        return self.process_stream(stream)
+    
+    def process_data(self, data):
+        return self.serialize(self.process_stream(self.parse(data)))
+    
+    def process_url_data(self, url, data):
+        return self.serialize(self.process_url_stream(url, self.parse(data)))
+
+class SiblingPostProcessingPlugin(BaseJulesPlugin):
+    """Makes another output next to each output it applies to, at the same URL
+    plus `suffix`, from the output's data (e.g. a compressed copy).
+
+    Siblings are made while rendering, after the output is written, and aren't
+    remade when an incremental build finds the output unchanged. Builds kept
+    in memory (for `jules serve`) don't make them.
+    """
+    abstract = True
+    suffix = None
+    enabled = True
+
+    def applies_to(self, url):
+        """Return True if the output at url (a normalized URL) gets a sibling"""
+        return False
+
+    def make_sibling(self, data):
+        """Return the sibling's data, given the output's data (a string)"""
+        raise NotImplementedError
+
 # TODO:
 ##BEGINNING = 0
 ##END = -1
@@ -0,0 +1,44 @@
+"""Rewriting references to static files to their fingerprinted URLs (see
+jules.fingerprint), in HTML and CSS outputs."""
+
+from jules import utils, fingerprint
+from .. import Renderer
+from . import MutatingPostProcessingPlugin
+from .xml import MutatingPostProcessingHTMLPlugin
+
+# the attributes of HTML elements that refer to other files.
+REFERENCE_ATTRIBUTES = ('href', 'src')
+
+def rewrite_html_references(stream, base_url, fingerprints):
+    from genshi.core import START
+    for kind, data, pos in stream:
+        if kind is START:
+            element, attrs = data
+            for name in REFERENCE_ATTRIBUTES:
+                ref = attrs.get(name)
+                if ref is None:
+                    continue
+                new = fingerprint.rewrite_reference(ref, base_url, fingerprints)
+                if new != ref:
+                    attrs |= [(name, new)]
+            data = element, attrs
+        yield kind, data, pos
+
+class AssetRewriter(object):
+    """Mixin for the rewriters, which are on when fingerprinting is"""
+    dependencies = {'renderer': Renderer}
+    config = utils.named_keywords('fingerprint')
+
+    def init(self):
+        self.enabled = bool(fingerprint.extensions(
+            getattr(self.config, 'fingerprint', False)))
+
+class HtmlAssetRewriter(AssetRewriter, MutatingPostProcessingHTMLPlugin):
+    def process_url_stream(self, url, stream):
+        return rewrite_html_references(stream, url, self.renderer.fingerprints)
+
+class CssAssetRewriter(AssetRewriter, MutatingPostProcessingPlugin):
+    input_extension = '.css'
+
+    def process_url_data(self, url, data):
+        return fingerprint.rewrite_css(data, url, self.renderer.fingerprints)
@@ -0,0 +1,75 @@
+"""Precompressed copies of outputs, for web servers to serve as they are
+(e.g. nginx's gzip_static): /style.css.gz, and /style.css.br if the brotli
+module is installed, next to /style.css.
+
+Turned on by the `precompress` config, either `true` for every encoding
+that's available or a list of them (`gzip`, `br`). Compressed data is cached
+(in the `precompressed` cache), so full builds don't recompress unchanged
+outputs either.
+"""
+
+import gzip
+import hashlib
+from io import BytesIO
+
+from jules import utils
+from jules.cache import cache_key
+from . import SiblingPostProcessingPlugin
+
+class Compressor(SiblingPostProcessingPlugin):
+    abstract = True
+    config = utils.named_keywords('precompress')
+    encoding = None
+
+    def init(self):
+        precompress = getattr(self.config, 'precompress', False)
+        self.enabled = self.available() and (precompress is True
+            or isinstance(precompress, list) and self.encoding in precompress)
+        if self.enabled:
+            self.cache = self.engine.get_cache('precompressed')
+
+    def available(self):
+        return True
+
+    def applies_to(self, url):
+        from jules.server import content_type, compressible
+        return compressible(content_type(url))
+
+    def make_sibling(self, data):
+        key = cache_key(self.encoding, hashlib.sha1(data).hexdigest())
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = self.compress(data)
+            self.cache.set(key, compressed)
+        return compressed
+
+    def compress(self, data):
+        raise NotImplementedError
+
+class GzipCompressor(Compressor):
+    encoding = 'gzip'
+    suffix = '.gz'
+
+    def compress(self, data):
+        buf = BytesIO()
+        # no file name or mtime, so that the same data always compresses to
+        # the same bytes.
+        with gzip.GzipFile(filename='', fileobj=buf, mode='wb',
+                compresslevel=9, mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+
+class BrotliCompressor(Compressor):
+    encoding = 'br'
+    suffix = '.br'
+
+    def available(self):
+        try:
+            import brotli
+        except ImportError:
+            return False
+        return True
+
+    def compress(self, data):
+        import brotli
+        return brotli.compress(data, quality=11)
@@ -0,0 +1,285 @@
+"""Minifying HTML, CSS and JavaScript outputs.
+
+Turned on by the `minify` config, either `true` for all of them or a list of
+the ones to minify (`html`, `css`, `js`). All of them are conservative: they
+drop comments and whitespace, but never rewrite anything else.
+
+HTML is minified in the same parse as the other HTML postprocessors. Minified
+CSS and JavaScript are cached (in the `minify` cache), so unchanged
+stylesheets and scripts aren't minified again.
+"""
+
+import re
+
+from jules import utils
+from jules.cache import cache_key
+from . import MutatingPostProcessingPlugin
+from .xml import MutatingPostProcessingHTMLPlugin
+
+# bump this when the minifiers change their output, to invalidate the cache.
+VERSION = 1
+
+def minify_enabled(config, kind):
+    minify = getattr(config, 'minify', False)
+    return minify is True or isinstance(minify, list) and kind in minify
+
+# HTML
+
+# elements whose whitespace matters.
+PRESERVE_WHITESPACE = frozenset(['pre', 'textarea', 'script', 'style'])
+WHITESPACE = re.compile(u'[ \t\n\r\f]+')
+
+def minify_html_stream(stream):
+    """Drop comments (except conditional comments) and collapse whitespace
+    in a genshi stream"""
+    from genshi.core import START, END, TEXT, COMMENT
+    preserving = 0
+    for kind, data, pos in stream:
+        if kind is START:
+            if data[0].localname in PRESERVE_WHITESPACE:
+                preserving += 1
+        elif kind is END:
+            if data.localname in PRESERVE_WHITESPACE:
+                preserving -= 1
+        elif kind is TEXT:
+            if not preserving:
+                data = WHITESPACE.sub(u' ', data)
+        elif kind is COMMENT:
+            if not data.startswith(u'[') and not data.startswith(u'<!['):
+                continue
+        yield kind, data, pos
+
+class HtmlMinifier(MutatingPostProcessingHTMLPlugin):
+    config = utils.named_keywords('minify')
+
+    def init(self):
+        self.enabled = minify_enabled(self.config, 'html')
+
+    def process_stream(self, stream):
+        return minify_html_stream(stream)
+
+# CSS
+
+CSS_TOKEN = re.compile(r'''
+      (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<comment>/\*.*?(?:\*/|\Z))
+    | (?P<space>\s+)
+    | (?P<punctuation>[{};,>:])
+    | (?P<other>[^"'/\s{};,>:]+|/)
+''', re.VERBOSE | re.DOTALL)
+
+# whitespace next to these can always go, and so can whitespace after a colon
+# (but not before one: `a :hover` isn't `a:hover`).
+CSS_PUNCTUATION = '{};,>'
+
+def minify_css(css):
+    out = []
+    space = False
+    for match in CSS_TOKEN.finditer(css):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'space':
+            space = True
+            continue
+        if kind == 'comment':
+            if not token.startswith('/*!'):
+                # a comment still separates what's either side of it.
+                space = True
+                continue
+        if space and out and out[-1][-1] not in CSS_PUNCTUATION + ':' \
+                and token[0] not in CSS_PUNCTUATION:
+            out.append(' ')
+        space = False
+        if token[0] == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(token)
+    return ''.join(out)
+
+# JavaScript
+
+class UnterminatedError(ValueError):
+    pass
+
+def is_alphanum(c):
+    return c is not None and (c.isalnum() or c in '_$\\' or ord(c) > 126)
+
+# a / after any of these starts a regular expression, not a division.
+REGEX_PRECEDERS = '(,=:[!&|?+-~*/{};}\n'
+
+class JsMinifier(object):
+    """Douglas Crockford's JSMin: drops comments and whitespace that doesn't
+    separate anything, and leaves the rest (strings, regular expressions and
+    all) alone."""
+
+    def __init__(self, js):
+        self.js = js
+        self.pos = 0
+        self.out = []
+        self.lookahead = None
+
+    def get(self):
+        c = self.lookahead
+        self.lookahead = None
+        if c is None:
+            if self.pos >= len(self.js):
+                return None
+            c = self.js[self.pos]
+            self.pos += 1
+        if c >= ' ' or c == '\n':
+            return c
+        if c == '\r':
+            return '\n'
+        return ' '
+
+    def peek(self):
+        self.lookahead = self.get()
+        return self.lookahead
+
+    def next(self):
+        """get(), skipping comments"""
+        c = self.get()
+        if c == '/':
+            p = self.peek()
+            if p == '/':
+                while True:
+                    c = self.get()
+                    if c is None or c == '\n':
+                        return c
+            if p == '*':
+                self.get()
+                while True:
+                    c = self.get()
+                    if c is None:
+                        raise UnterminatedError("unterminated comment")
+                    if c == '*' and self.peek() == '/':
+                        self.get()
+                        return ' '
+        return c
+
+    def action(self, d):
+        if d <= 1:
+            self.out.append(self.a)
+        if d <= 2:
+            self.a = self.b
+            if self.a in ('"', "'", '`'):
+                quote = self.a
+                while True:
+                    self.out.append(self.a)
+                    self.a = self.get()
+                    if self.a == quote:
+                        break
+                    if self.a == '\\':
+                        self.out.append(self.a)
+                        self.a = self.get()
+                    if self.a is None:
+                        raise UnterminatedError("unterminated string")
+        self.b = self.next()
+        if self.b == '/' and self.a is not None and self.a in REGEX_PRECEDERS:
+            self.out.append(self.a)
+            if self.a in '/*':
+                self.out.append(' ')
+            self.out.append(self.b)
+            while True:
+                self.a = self.get()
+                if self.a == '[':
+                    while True:
+                        self.out.append(self.a)
+                        self.a = self.get()
+                        if self.a == ']':
+                            break
+                        if self.a == '\\':
+                            self.out.append(self.a)
+                            self.a = self.get()
+                        if self.a is None:
+                            raise UnterminatedError(
+                                "unterminated set in regular expression")
+                elif self.a == '/':
+                    break
+                elif self.a == '\\':
+                    self.out.append(self.a)
+                    self.a = self.get()
+                if self.a is None:
+                    raise UnterminatedError("unterminated regular expression")
+                self.out.append(self.a)
+            self.b = self.next()
+
+    def space_needed(self):
+        """Whether deleting the space before b would join `+ +` (or `- -`)
+        into `++` (or `--`)"""
+        return self.b in ('+', '-') and self.out and self.out[-1] == self.b
+
+    def minify(self):
+        self.a = '\n'
+        self.action(3)
+        while self.a is not None:
+            a, b = self.a, self.b
+            if a == ' ':
+                if is_alphanum(b) or self.space_needed():
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif a == '\n':
+                if b is not None and b in '{[(+-!~`"\'':
+                    self.action(1)
+                elif b == ' ':
+                    self.action(3)
+                elif is_alphanum(b):
+                    self.action(1)
+                else:
+                    self.action(2)
+            elif b == ' ':
+                if is_alphanum(a) or (a in ('+', '-') and self.peek() == a):
+                    self.action(1)
+                else:
+                    self.action(3)
+            elif b == '\n':
+                if a in '}])+-"\'`' or is_alphanum(a):
+                    self.action(1)
+                else:
+                    self.action(3)
+            else:
+                self.action(1)
+        return ''.join(self.out).strip('\n')
+
+def minify_js(js):
+    if js.startswith('\xef\xbb\xbf'):
+        js = js[3:]
+    return JsMinifier(js).minify()
+
+class CachingMinifier(MutatingPostProcessingPlugin):
+    abstract = True
+    config = utils.named_keywords('minify')
+    kind = None
+
+    def init(self):
+        self.enabled = minify_enabled(self.config, self.kind)
+        if self.enabled:
+            self.cache = self.engine.get_cache('minify')
+
+    def process_data(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        key = cache_key(self.kind, VERSION, data)
+        minified = self.cache.get(key)
+        if minified is None:
+            minified = self.minify(data)
+            self.cache.set(key, minified)
+        return minified
+
+class CssMinifier(CachingMinifier):
+    input_extension = '.css'
+    kind = 'css'
+
+    def minify(self, data):
+        return minify_css(data)
+
+class JavaScriptMinifier(CachingMinifier):
+    input_extension = '.js'
+    kind = 'js'
+
+    def minify(self, data):
+        try:
+            return minify_js(data)
+        except UnterminatedError:
+            # leave it for the browser to complain about.
+            return data
@@ -1,14 +1,169 @@
-from scss import Scss
+"""Compiling .scss files to CSS, with pyScss.
 
-from .. import Renderer
+Compiled CSS is cached (in the `scss` cache), keyed by the stylesheet and
+the paths and contents of every file it @imports, directly or not (see
+ScssCompiler.import_graph), so an unchanged stylesheet tree is never
+recompiled. Imports are looked up the way pyScss looks them up, in the
+current directory, pyScss' own load paths and the static directories.
+
+Before rendering, every stylesheet that isn't cached is compiled, in a pool
+of engine.jobs processes when there's more than one.
+"""
+
+import os
+import re
+import hashlib
+import multiprocessing
+
+from jules.cache import cache_key
+from jules.writer import SourceFile
+from .. import RenderingPlugin
 from . import MutatingPostProcessingPlugin
 
+IMPORT = re.compile(r'@import\s+([^;\n]+)')
+
+def imports(data):
+    """Return the names that data @imports"""
+    names = []
+    for match in IMPORT.finditer(data):
+        for name in match.group(1).split(','):
+            name = name.strip().strip('"\'')
+            # pyScss won't go to any of these.
+            if '..' in name or '://' in name or 'url(' in name:
+                continue
+            names.append(name)
+    return names
+
+def compile_scss(args):
+    data, load_paths = args
+    from scss import Scss
+    return Scss(scss_opts={'load_paths': list(load_paths)}).compile(data)
+
 class ScssCompiler(MutatingPostProcessingPlugin):
     input_extension = '.scss'
     output_extension = '.css'
-    
+
     def init(self):
-        self.css = Scss()
-    
+        self.cache = self.engine.get_cache('scss')
+        self.compiled = {} # key -> css
+        self.keys = {} # data -> key, for the rest of the build
+        self._load_paths = None
+
+    def reset(self):
+        # the imported files might have changed.
+        self.keys = {}
+
+    def load_paths(self):
+        """Return (pyScss' load paths, the static directories)"""
+        if self._load_paths is None:
+            from scss import config
+            paths = config.LOAD_PATHS
+            if hasattr(paths, 'split'):
+                paths = paths.split(',')
+            static = []
+            for plugin in self.engine.plugins.produce_instances(
+                    RenderingPlugin):
+                static.extend(plugin.get_source_paths())
+            self._load_paths = (list(paths), static)
+        return self._load_paths
+
+    def resolve(self, name, importer=None):
+        """Return the path of the file that @import name finds, in the file
+        at `importer` (None for the stylesheet itself), or None."""
+        paths, static = self.load_paths()
+        dirname, filename = os.path.split(name)
+        basepaths = ['./']
+        if importer is not None:
+            basepaths.append(os.path.dirname(importer))
+        for path in ['./'] + paths + static:
+            for basepath in basepaths:
+                full_path = os.path.realpath(
+                    os.path.join(path, basepath, dirname))
+                for candidate in ['_' + filename + '.scss',
+                        filename + '.scss', '_' + filename, filename]:
+                    candidate = os.path.join(full_path, candidate)
+                    if os.path.isfile(candidate):
+                        return candidate
+        return None
+
+    def import_graph(self, data):
+        """Return a sorted list of (path, sha1 of its contents) for every file
+        that data imports, directly or not.
+
+        Imports that can't be found are (name, None).
+        """
+        graph = set()
+        seen = set()
+        todo = [(data, None)]
+        while todo:
+            data, importer = todo.pop()
+            for name in imports(data):
+                path = self.resolve(name, importer)
+                if path is None:
+                    graph.add((name, None))
+                    continue
+                if path in seen:
+                    continue
+                seen.add(path)
+                with open(path, 'rb') as f:
+                    contents = f.read()
+                graph.add((path, hashlib.sha1(contents).hexdigest()))
+                todo.append((contents, path))
+        return sorted(graph)
+
+    def key(self, data):
+        try:
+            return self.keys[data]
+        except KeyError:
+            pass
+        import scss
+        return self.keys.setdefault(data, cache_key(data,
+            self.import_graph(data), self.load_paths(), scss.__version__))
+
+    def prepare(self, items):
+        """Compile every stylesheet that isn't cached"""
+        sources = {} # key -> data
+        for url, data in items:
+            if isinstance(data, SourceFile):
+                data = data.read()
+            elif not isinstance(data, basestring):
+                continue
+            key = self.key(data)
+            if key in self.compiled or key in sources:
+                continue
+            css = self.cache.get(key)
+            if css is None:
+                sources[key] = data
+            else:
+                self.compiled[key] = css
+
+        keys = sorted(sources)
+        args = [(sources[key], self.load_paths()[1]) for key in keys]
+        jobs = self.engine.jobs
+        if jobs > 1 and len(args) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(args)))
+            try:
+                results = pool.map(compile_scss, args)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = map(compile_scss, args)
+        for key, css in zip(keys, results):
+            self.cache.set(key, css)
+            self.compiled[key] = css
+
     def process_data(self, data):
-        return self.css.compile(data)
\ No newline at end of file
+        key = self.key(data)
+        try:
+            return self.compiled[key]
+        except KeyError:
+            pass
+        css = self.cache.get(key)
+        if css is None:
+            css = compile_scss((data, self.load_paths()[1]))
+            self.cache.set(key, css)
+        return self.compiled.setdefault(key, css)
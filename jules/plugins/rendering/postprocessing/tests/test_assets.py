@@ -0,0 +1,107 @@
+import unittest
+
+import os
+import json
+import shutil
+import tempfile
+
+from jules.tests.test_jules import run_jules
+
+TEMPLATE = ('<html><head>'
+    '<link rel="stylesheet" href="{{ "/testcss.css"|fingerprint }}">'
+    '</head><body><img src="../img.png?v=1">'
+    '{% for post in posts %}{{post.post_num}} {% endfor %}</body></html>')
+
+class TestFingerprinting(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        self.build_dir = os.path.join(self.projectdir, '_build')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'a') as f:
+            f.write('\nfingerprint: true\n')
+        with open(self.source('templates', 'content', 'posts.j2'), 'w') as f:
+            f.write(TEMPLATE)
+        with open(self.source('static', 'testcss.scss'), 'a') as f:
+            f.write('\nb { background: url(img.png); }\n')
+        self.write_image('image')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def source(self, *path):
+        return os.path.join(self.projectdir, *path)
+
+    def write_image(self, data):
+        with open(self.source('static', 'img.png'), 'w') as f:
+            f.write(data)
+
+    def build(self, *args):
+        run_jules(['build', '-L', self.projectdir] + list(args))
+        with open(os.path.join(self.projectdir, '.jules', 'changes.json')) as f:
+            return json.load(f)
+
+    def output(self, *path):
+        with open(os.path.join(self.build_dir, *path)) as f:
+            return f.read()
+
+    def fingerprinted(self, prefix):
+        found, = [name for name in os.listdir(self.build_dir)
+            if name.startswith(prefix + '.')]
+        return found
+
+    def check_references(self):
+        css = self.fingerprinted('testcss')
+        image = self.fingerprinted('img')
+        self.assertNotEqual(image, 'img.png')
+        self.assertFalse(os.path.exists(os.path.join(self.build_dir, 'img.png')))
+        self.assertEqual(self.output(image), self.image)
+        page = self.output('content', 'index.html')
+        self.assertTrue('href="/%s"' % css in page)
+        self.assertTrue('src="../%s?v=1"' % image in page)
+        self.assertTrue('url(%s)' % image in self.output(css))
+        return css, image
+
+    def check_rebuild(self, *args):
+        self.image = 'image'
+        self.build(*args)
+        css, image = self.check_references()
+
+        self.image = 'changed image'
+        self.write_image(self.image)
+        changes = self.build(*args)
+        new_css, new_image = self.check_references()
+        self.assertNotEqual(new_image, image)
+        # the stylesheet refers to the image, so its fingerprint changes too.
+        self.assertNotEqual(new_css, css)
+        self.assertTrue(new_css in changes['added'])
+        self.assertTrue(image in changes['removed'])
+
+    def test_full_build(self):
+        self.check_rebuild()
+
+    def test_incremental_build(self):
+        self.check_rebuild('-i')
+        changes = self.build('-i')
+        self.assertEqual(changes, {'added': [], 'changed': [], 'removed': []})
+
+    def write_static(self, name, data):
+        with open(self.source('static', name), 'w') as f:
+            f.write(data)
+
+    def test_stylesheet_references(self):
+        # a.css sorts before z.css, but must be fingerprinted after it.
+        self.write_static('a.css', '@import "z.css";\n')
+        self.write_static('z.css', 'b { background: url(img.png); }\n')
+        self.build()
+        a, z = self.fingerprinted('a'), self.fingerprinted('z')
+        self.assertNotEqual(z, 'z.css')
+        self.assertEqual(self.output(a), '@import "%s";\n' % z)
+        self.assertTrue(os.path.exists(os.path.join(self.build_dir, z)))
+
+    def test_stylesheet_cycle(self):
+        self.write_static('a.css', '@import "z.css";\n')
+        self.write_static('z.css', 'b { background: url(a.css); }\n')
+        self.build()
+        self.assertEqual(self.output('a.css'), '@import "z.css";\n')
+        self.assertEqual(self.output('z.css'), 'b { background: url(a.css); }\n')
@@ -0,0 +1,83 @@
+import unittest
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+
+from jules.tests.test_jules import run_jules
+
+class TestPrecompress(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        self.build_dir = os.path.join(self.projectdir, '_build')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        self.configure('\nminify: true\nprecompress: true\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def configure(self, config):
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'a') as f:
+            f.write(config)
+
+    def build(self, *args):
+        run_jules(['build', '-L', self.projectdir] + list(args))
+        with open(os.path.join(self.projectdir, '.jules', 'changes.json')) as f:
+            return json.load(f)
+
+    def output(self, *path):
+        with open(os.path.join(self.build_dir, *path)) as f:
+            return f.read()
+
+    def gunzipped(self, *path):
+        with gzip.open(os.path.join(self.build_dir, *path)) as f:
+            return f.read()
+
+    def mtime(self, *path):
+        return os.stat(os.path.join(self.build_dir, *path)).st_mtime
+
+    def edit_post(self):
+        post = os.path.join(self.projectdir, 'content', 'post2', 'post.rst')
+        with open(post) as f:
+            src = f.read()
+        with open(post, 'w') as f:
+            f.write(src.replace('Hello there!', 'Hello again!'))
+
+    def check_siblings(self):
+        page = self.output('content', '1', 'index.html')
+        self.assertFalse('\n\n' in page)
+        self.assertEqual(self.gunzipped('content', '1', 'index.html.gz'), page)
+        self.assertEqual(self.gunzipped('static1.txt.gz'),
+            self.output('static1.txt'))
+
+    def check_rebuild(self, *args):
+        changes = self.build(*args)
+        self.assertTrue('content/1/index.html.gz' in changes['added'])
+        self.check_siblings()
+        mtime = self.mtime('content', '0', 'index.html.gz')
+
+        self.edit_post()
+        changes = self.build(*args)
+        self.assertTrue('content/1/index.html.gz' in changes['changed'])
+        self.assertFalse('content/0/index.html.gz' in changes['changed'])
+        self.check_siblings()
+        self.assertTrue('Hello again!' in
+            self.gunzipped('content', '1', 'index.html.gz'))
+        self.assertEqual(self.mtime('content', '0', 'index.html.gz'), mtime)
+
+    def test_full_build(self):
+        self.check_rebuild()
+
+    def test_incremental_build(self):
+        self.check_rebuild('-i')
+
+    def test_turned_off(self):
+        self.build('-i')
+        self.configure('\nprecompress: false\n')
+        changes = self.build('-i')
+        self.assertTrue('content/1/index.html.gz' in changes['removed'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir, 'content', '1', 'index.html.gz')))
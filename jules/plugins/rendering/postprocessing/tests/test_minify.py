@@ -0,0 +1,97 @@
+import unittest
+
+import shutil
+import tempfile
+
+import genshi
+
+from jules import cache
+from jules.plugins.rendering.postprocessing import minify
+
+class TestMinifyHtml(unittest.TestCase):
+    def minify(self, html):
+        return genshi.Stream(
+            minify.minify_html_stream(genshi.HTML(html))).render()
+
+    def test_whitespace(self):
+        self.assertEqual(
+            self.minify(u'<p>\n  Hello   <b>there</b>\n  world &nbsp; </p>'),
+            u'<p> Hello <b>there</b> world \xa0 </p>')
+
+    def test_preserved(self):
+        html = u'<div><pre>  a\n   b</pre><script>\n  x  =  1</script></div>'
+        self.assertEqual(self.minify(html), html)
+
+    def test_comments(self):
+        self.assertEqual(
+            self.minify(u'<p><!-- a --><!--[if IE]>ie<![endif]--></p>'),
+            u'<p><!--[if IE]>ie<![endif]--></p>')
+
+class TestMinifyCss(unittest.TestCase):
+    def test_minify(self):
+        self.assertEqual(minify.minify_css('\n'.join([
+                '/* comment */',
+                'a :hover , b > i {',
+                '  color : red ;',
+                '  margin: 0 auto;',
+                '}',
+                '/*! license */',
+                '.c{content: " ; } "; width: calc(1px + 2px)}',
+            ])),
+            'a :hover,b>i{color :red;margin:0 auto}/*! license */ '
+            '.c{content:" ; } ";width:calc(1px + 2px)}')
+
+class TestMinifyJs(unittest.TestCase):
+    def test_minify(self):
+        self.assertEqual(minify.minify_js('\n'.join([
+                'var a = 1 ; // comment',
+                '/* block',
+                '   comment */',
+                'function f ( x ) {',
+                '    return x / 2 ;',
+                '}',
+                'var s = "a  // b" + \'c  d\';',
+            ])),
+            'var a=1;function f(x){return x/2;}\n'
+            'var s="a  // b"+\'c  d\';')
+
+    def test_regex(self):
+        self.assertEqual(minify.minify_js('r = /a [/] b\\/ /g ;'),
+            'r=/a [/] b\\/ /g;')
+
+    def test_operators(self):
+        self.assertEqual(minify.minify_js('a = b + +c - -d;\ne = f\n++g'),
+            'a=b+ +c- -d;e=f\n++g')
+
+    def test_unterminated(self):
+        self.assertRaises(minify.UnterminatedError, minify.minify_js, 'a = "b')
+
+class Engine(object):
+    def __init__(self, cache):
+        self.cache = cache
+    def get_cache(self, name):
+        return self.cache
+
+class TestMinifierPlugins(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.cache = cache.open_cache(self.tempdir, 'minify')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_enabled(self):
+        engine = Engine(self.cache)
+        self.assertFalse(minify.CssMinifier(engine, {}, {}).enabled)
+        self.assertTrue(
+            minify.CssMinifier(engine, {}, {'minify': True}).enabled)
+        self.assertTrue(
+            minify.JavaScriptMinifier(engine, {}, {'minify': ['js']}).enabled)
+        self.assertFalse(
+            minify.HtmlMinifier(engine, {}, {'minify': ['js']}).enabled)
+
+    def test_cached(self):
+        plugin = minify.CssMinifier(Engine(self.cache), {}, {'minify': True})
+        self.assertEqual(plugin.process_data('a { b: c; }'), 'a{b:c}')
+        self.assertEqual(plugin.process_data('a { b: c; }'), 'a{b:c}')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
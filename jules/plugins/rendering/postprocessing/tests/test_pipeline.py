@@ -0,0 +1,74 @@
+import unittest
+
+import jules
+from jules import utils
+
+from jules.plugins.rendering import Renderer
+from jules.plugins.rendering.postprocessing import (
+    MutatingPostProcessingPlugin, MutatingPostProcessingStreamPlugin)
+
+class CountingStreamPlugin(MutatingPostProcessingStreamPlugin):
+    abstract = True
+    input_extension = '.html'
+    markup = 'words'
+    parses = serializes = 0
+    
+    def __init__(self, word):
+        self.word = word
+    
+    def parse(self, data):
+        CountingStreamPlugin.parses += 1
+        return data.split()
+    
+    def serialize(self, stream):
+        CountingStreamPlugin.serializes += 1
+        return ' '.join(stream)
+    
+    def process_stream(self, stream):
+        for word in stream:
+            yield word
+        yield self.word
+
+class UpperPlugin(MutatingPostProcessingPlugin):
+    abstract = True
+    input_extension = '.html'
+    
+    def __init__(self):
+        pass
+    
+    def process_data(self, data):
+        return data.upper()
+
+class TestPostprocessPipeline(unittest.TestCase):
+    def setUp(self):
+        CountingStreamPlugin.parses = CountingStreamPlugin.serializes = 0
+        self.renderer = Renderer.__new__(Renderer)
+        self.renderer.engine = jules.JulesEngine.__new__(jules.JulesEngine)
+    
+    def postprocess(self, *postprocessors):
+        self.renderer.postprocessors = postprocessors
+        return utils.join_chunks(
+            self.renderer.postprocess_data('/index.html', 'a'))
+    
+    def test_single_parse(self):
+        self.assertEqual(
+            self.postprocess(
+                CountingStreamPlugin('b'),
+                CountingStreamPlugin('c'),
+                CountingStreamPlugin('d')),
+            'a b c d')
+        self.assertEqual(CountingStreamPlugin.parses, 1)
+        self.assertEqual(CountingStreamPlugin.serializes, 1)
+    
+    def test_data_plugin_in_between(self):
+        self.assertEqual(
+            self.postprocess(
+                CountingStreamPlugin('b'),
+                UpperPlugin(),
+                CountingStreamPlugin('c')),
+            'A B c')
+        self.assertEqual(CountingStreamPlugin.parses, 2)
+        self.assertEqual(CountingStreamPlugin.serializes, 2)
+    
+    def test_process_data(self):
+        self.assertEqual(CountingStreamPlugin('b').process_data('a'), 'a b')
@@ -0,0 +1,89 @@
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from jules import cache
+from jules.writer import SourceFile
+from jules.plugins.rendering.postprocessing import sass
+
+class StaticPlugin(object):
+    def __init__(self, path):
+        self.path = path
+    def get_source_paths(self):
+        return [self.path]
+
+class Plugins(object):
+    def __init__(self, static):
+        self.static = static
+    def produce_instances(self, base_cls):
+        return [StaticPlugin(self.static)]
+
+class Engine(object):
+    def __init__(self, cache, static, jobs=1):
+        self.cache = cache
+        self.plugins = Plugins(static)
+        self.jobs = jobs
+    def get_cache(self, name):
+        return self.cache
+
+class TestScssCompiler(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.static = os.path.join(self.tempdir, 'static')
+        self.cache = cache.open_cache(self.tempdir, 'scss')
+        self.write('_colors.scss', '$c: red;\n')
+        self.write('_vars.scss', '@import "colors";\n$w: 1px;\n')
+        self.write('sub/a.scss', '@import "vars";\n.a { color: $c; }\n')
+        self.write('b.scss', '@import "vars";\n.b { width: $w; }\n')
+        self.write('c.scss', '.c { color: blue; }\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, relpath, data):
+        path = os.path.join(self.static, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def compiler(self, jobs=1):
+        return sass.ScssCompiler(Engine(self.cache, self.static, jobs), {}, {})
+
+    def build(self, jobs=1):
+        """Prepare and process the stylesheets like a build would"""
+        compiler = self.compiler(jobs)
+        items = [('/' + name, SourceFile(os.path.join(self.static, name)))
+            for name in ['sub/a.scss', 'b.scss', 'c.scss']]
+        compiler.prepare(items)
+        return [compiler.process_data(data.read()) for url, data in items]
+
+    def test_import_graph(self):
+        compiler = self.compiler()
+        graph = compiler.import_graph('@import "sub/a";\n@import "missing";\n')
+        paths = [os.path.relpath(path, self.static) if digest else path
+            for path, digest in graph]
+        self.assertEqual(sorted(paths),
+            ['_colors.scss', '_vars.scss', 'missing', 'sub/a.scss'])
+
+    def test_compile(self):
+        self.assertEqual(self.build(),
+            ['.a{color:red}', '.b{width:1px}', '.c{color:#00f}'])
+
+    def test_cached(self):
+        css = self.build()
+        self.assertEqual(self.cache.misses, 3)
+        self.assertEqual(self.build(), css)
+        self.assertEqual(self.cache.hits, 3)
+
+        # changing a partial only recompiles what imports it, directly or not.
+        self.write('_colors.scss', '$c: green;\n')
+        self.assertEqual(self.build(),
+            ['.a{color:green}', '.b{width:1px}', '.c{color:#00f}'])
+        self.assertEqual(self.cache.misses, 5)
+        self.assertEqual(self.cache.hits, 4)
+
+    def test_parallel(self):
+        self.assertEqual(self.build(jobs=2), self.build())
@@ -1,38 +1,45 @@
 import re
 
-import genshi
-from genshi.output import TEXT
-from genshi.filters.transform import Transformer, StreamBuffer
-
+# genshi is imported by the methods that use it, so that it's only imported
+# when there is markup to postprocess.
 
 from .. import Renderer
-from . import MutatingPostProcessingPlugin
+from . import MutatingPostProcessingStreamPlugin
 
-#FIXME: make more efficient by having only one MutatingPostProcessingPlugin
-#       which converts to genshi and does all the rest of the work, instead of
-#       parsing and unparsing for each plugin.
+class MutatingPostProcessingGenshiPlugin(MutatingPostProcessingStreamPlugin):
+    abstract = True
+    def serialize(self, stream):
+        import genshi
+        return genshi.Stream(stream).render()
+    
+    def serialize_chunks(self, stream):
+        import genshi
+        return genshi.Stream(stream).serialize()
 
-class MutatingPostProcessingHTMLPlugin(MutatingPostProcessingPlugin):
+class MutatingPostProcessingHTMLPlugin(MutatingPostProcessingGenshiPlugin):
     abstract = True
     input_extension = '.html'
-    def process_data(self, data):
-        # FIXME: efficiency issue as above.
-        stream = genshi.HTML(data)
-        stream |= self.process_stream
-        
-        return stream.render()
+    markup = 'html'
+    def parse(self, data):
+        import genshi
+        from genshi.input import HTMLParser
+        if isinstance(data, basestring):
+            return genshi.HTML(data)
+        return HTMLParser(data)
 
-class MutatingPostProcessingXMLPlugin(MutatingPostProcessingPlugin):
+class MutatingPostProcessingXMLPlugin(MutatingPostProcessingGenshiPlugin):
     abstract = True
     input_extension = '.xml'
-    def process_data(self, data):
-        # FIXME: efficiency issue as above.
-        stream = genshi.XML(data)
-        stream |= self.process_stream
-        
-        return stream.render()
+    markup = 'xml'
+    def parse(self, data):
+        import genshi
+        from genshi.input import XMLParser
+        if isinstance(data, basestring):
+            return genshi.XML(data)
+        return XMLParser(data)
 
 def rewrite_canonical_urls(canon, stream):
+    from genshi.output import TEXT
     state = "NORMAL"
     for kind, data, pos in stream:
         if kind == 'START':
@@ -2,45 +2,129 @@ import os
 import tempfile
 import shutil
 
-import jinja2
-
 import jules
 from jules.query import cache, unwrapping_kwargs, method_registrar
-from jules import writer, utils
+from jules import writer, utils, incremental
+from jules.cache import cache_key
 
 
 class CanonConflictError(Exception): pass
 
 class QueryRenderer(jules.plugins.QueryPlugin, jules.plugins.rendering.RenderingPlugin):
     
-    config = utils.named_keywords('templates')
+    config = utils.named_keywords('templates', 'stream_templates',
+        'persist_fragments')
     
     methods = []
     register = method_registrar(methods)
+    materializing_methods = ('render_all',)
     
     def init(self):
         self.config.setdefault('templates',
             [os.path.join(self.engine.src_path, 'templates')])
+        # If set, templates are only rendered (chunk by chunk) as the output
+        # is written, instead of being kept in memory until then.
+        self.config.setdefault('stream_templates', False)
+        # If set, the blocks of `{% cache %}` tags are kept for later builds
+        # (see jules.templating.FragmentCache).
+        self.config.setdefault('persist_fragments', False)
         
         self.render_actions = [] # [(url, canon, renderer, (item,))]
-        
-        self.env = jinja2.Environment(
-            extensions=['jinja2.ext.do'],
-            loader=jinja2.loaders.FileSystemLoader(
-                self.config.templates),
-            undefined=jinja2.StrictUndefined
-        )
-
-        self.env.filters.update(
-            (filter_name, func)
-            for filter_name, func in vars(jules.filters).iteritems()
-            if not filter_name.startswith('_'))
+        self.inline_templates = {} # source -> compiled template
+        self._env = None
+        self._new_build = True # see env
+
+    @property
+    def env(self):
+        """The jinja2 Environment, created (and jinja2 imported) on first use,
+        so that commands that don't render don't pay for it.
+
+        Compiled templates are kept in the `jinja2` cache (see jules.cache).
+        It's kept for the engine's later builds too (see JulesEngine.rebuild),
+        which get new fragment caches.
+        """
+        if self._env is None:
+            import jinja2
+            from jules.templating import (DiskBytecodeCache,
+                FragmentCacheExtension, fingerprint_filter)
+            self._env = jinja2.Environment(
+                extensions=['jinja2.ext.do', FragmentCacheExtension],
+                loader=jinja2.loaders.FileSystemLoader(
+                    self.config.templates),
+                undefined=jinja2.StrictUndefined,
+                bytecode_cache=DiskBytecodeCache(
+                    self.engine.get_cache('jinja2')),
+            )
+
+            self._env.filters.update(
+                (filter_name, func)
+                for filter_name, func in vars(jules.filters).iteritems()
+                if not filter_name.startswith('_'))
+            self._env.filters['fingerprint'] = fingerprint_filter(
+                self.renderer().fingerprint_url)
+        if self._new_build:
+            self._env.fragment_cache = self.fragment_cache()
+            self._new_build = False
+        return self._env
+
+    def reset(self):
+        self.render_actions = []
+        self._new_build = True
+
+    def fragment_cache(self):
+        """Return a new jules.templating.FragmentCache, for a build"""
+        from jules.templating import FragmentCache
+        if self.config.persist_fragments:
+            return FragmentCache(self.engine.get_cache('fragments'),
+                self.fragments_version(), self.bundles_version)
+        return FragmentCache()
+
+    def renderer(self):
+        # not a dependency, since that would make a Renderer for every engine
+        # that runs queries.
+        return self.engine.plugins.produce_instance(
+            jules.plugins.rendering.Renderer)
+
+    def fragments_version(self):
+        """Identify the templates, site.yaml and the fingerprinted URLs of
+        static files, for persisted fragments"""
+        manifest = self.engine.manifest
+        if manifest is not None:
+            fingerprints = manifest.fingerprints
+        else:
+            fingerprints = incremental.Fingerprints()
+        return (fingerprints.tree(
+            list(self.config.templates) + [jules.config_path(self.engine.src_path)]),
+            sorted(self.renderer().fingerprints.iteritems()))
+
+    def bundles_version(self):
+        """Identify the files of every bundle, for persisted fragments that
+        read `bundles`"""
+        manifest = self.engine.manifest
+        if manifest is not None:
+            files = {}
+            for record in manifest.new_bundles.itervalues():
+                files.update(record['files'])
+        else:
+            files = incremental.Fingerprints().tree(
+                [bundle.path for bundle in self.engine.bundles.itervalues()])
+        return cache_key(sorted(files.iteritems()))
+
+    def fragment_stats(self):
+        """Return the hits and misses of `{% cache %}` tags, or None if no
+        templates were rendered"""
+        if self._env is None or self._new_build:
+            return None
+        return self._env.fragment_cache.stats()
         
     
-    def item_withbundles(self, item):
-        d = dict(
-            bundles=self.engine.query_engine.resultset(
-                self.engine.bundles.values()))
+    def template_bundles(self):
+        """Return the `bundles` for the templates of the current entry"""
+        return RecordingResultSet(self.engine.query_engine.bundles_view(),
+            self.engine.manifest, self.env.fragment_cache)
+
+    def item_withbundles(self, item, bundles):
+        d = dict(bundles=bundles)
         d.update(item)
         return d
 
@@ -48,24 +132,23 @@ class QueryRenderer(jules.plugins.QueryPlugin, jules.plugins.rendering.Rendering
     @unwrapping_kwargs
     def render_each(self, results, template, url, canonical_for=None, canonical_title=None):
         # FIXME: fail if canonical_title passed but not canonical_for
-        url = self.env.from_string(url)
+        url = self.inline_template(url)
         canonical_for = self.maybe_template(canonical_for)
         canonical_title = self.maybe_template(canonical_title)
         # only called `template` in args for API reasons
         template_name = template
         template = self.env.get_template(template_name)
+        bundles = self.template_bundles()
         for item in results:
-            item = self.item_withbundles(item)
+            item = self.item_withbundles(item, bundles)
             final_url = url.render(item)
             canonical = None
             if canonical_for is not None:
                 canonical = (
                     canonical_for.render(item),
                     self.maybe_render(canonical_title, item))
-            self.render_actions.append((
-                final_url,
-                canonical,
-                template.render(item)))
+            self.add_render_action(
+                final_url, canonical, self.render_template(template, item))
 
             yield item
 
@@ -76,31 +159,78 @@ class QueryRenderer(jules.plugins.QueryPlugin, jules.plugins.rendering.Rendering
         # only called `template` in args for API reasons
         template_name = template
         template = self.env.get_template(template_name)
-        item = self.item_withbundles({kw: results})
-        final_url = self.env.from_string(url).render(item)
+        item = self.item_withbundles({kw: results}, self.template_bundles())
+        final_url = self.inline_template(url).render(item)
         canonical = None
         if canonical_for is not None:
-            canonical_for = self.env.from_string(canonical_for).render(item)
+            canonical_for = self.inline_template(canonical_for).render(item)
             canonical_title = self.maybe_render(self.maybe_template(canonical_title), item)
             canonical = (canonical_for, canonical_title)
 
-        self.render_actions.append((
-            final_url,
-            canonical,
-            template.render(item)))
+        self.add_render_action(
+            final_url, canonical, self.render_template(template, item))
 
         return results
+
+    def render_template(self, template, item):
+        profiler = self.engine.profiler
+        if self.config.stream_templates:
+            return profiler.iterate(
+                'template', template.name, template.generate(item))
+        with profiler.section('template', template.name):
+            return template.render(item)
+
+    def add_render_action(self, url, canonical, data):
+        if self.engine.manifest is not None:
+            self.engine.manifest.record_output(url, canonical)
+        self.render_actions.append((url, canonical, data))
     
     def get_render_actions(self):
         rv = self.render_actions
         self.render_actions = []
         return rv
+
+    def get_template_paths(self):
+        return self.config.templates
     
+    def inline_template(self, source):
+        """Compile a template given in site.yaml (e.g. an url), once"""
+        try:
+            return self.inline_templates[source]
+        except KeyError:
+            template = self.inline_templates[source] = self.env.from_string(source)
+            return template
+
     def maybe_template(self, t):
         if t is not None:
-            return self.env.from_string(t)
+            return self.inline_template(t)
 
     @staticmethod
     def maybe_render(t, *args, **kwargs):
         if t is not None:
             return t.render(*args, **kwargs)
+
+class RecordingResultSet(jules.query.ResultSet):
+    """The bundles view, for one entry's templates, which tells the incremental
+    build manifest (if any) and the fragment cache when a template actually
+    uses it."""
+    def __init__(self, view, manifest, fragment_cache):
+        super(RecordingResultSet, self).__init__(view._engine, view)
+        self._manifest = manifest
+        self._fragment_cache = fragment_cache
+        # remember the entry, since streamed templates are only rendered
+        # after every entry ran.
+        self._entry = manifest.current_entry if manifest is not None else None
+
+    def record_use(self):
+        if self._manifest is not None:
+            self._manifest.record_all_bundles(self._entry)
+        self._fragment_cache.used_bundles()
+
+    def __iter__(self):
+        self.record_use()
+        return iter(self._seq)
+
+    def get_method(self, name):
+        self.record_use()
+        return self._seq.get_method(name)
@@ -1,6 +1,7 @@
 import os
 import posixpath
 import shutil
+import collections
 
 from jules.plugins import ComponentPlugin
 from jules.plugins.rendering import RenderingPlugin
@@ -11,22 +12,35 @@ from jules import writer, utils
 class StaticComponent(ComponentPlugin, RenderingPlugin):
     name = None # only loaded for side-effects (for now)
     basenames = ['static']
-    config = utils.named_keywords('static_directories')
+    config = utils.named_keywords('static_directories', 'static_links')
     
     def init(self):
-        self.render_actions = []
         self.config.static_directories = [
             os.path.join(self.engine.src_path, d)
             for d in getattr(self.config, 'static_directories', ['static'])]
-        
+        # hard-link static files into the output, where possible, instead of
+        # copying them. (Careful: editing one edits the other!)
+        self.config.setdefault('static_links', False)
+        # static directory -> its render actions, in the order found. Those of
+        # bundles are kept until the bundles are unloaded.
+        self.loaded = collections.OrderedDict()
+        self.reset()
+
+    def reset(self):
         for d in self.config.static_directories:
             self.maybe_load(('', d))
+
+    def unload(self, bundle):
+        for path in list(self.loaded):
+            if path.startswith(bundle.path + os.sep):
+                del self.loaded[path]
     
     def maybe_load(self, static=None):
         if static is None: return
         ext, path = static
         # ignore ext, we don't really care (bleh.)
         
+        render_actions = self.loaded[path] = []
         for root, dirs, files in os.walk(path):
             # subpath is the path to it if root was /
             subpath = os.path.normpath(os.path.join(
@@ -36,11 +50,21 @@ class StaticComponent(ComponentPlugin, RenderingPlugin):
                 filepath = os.path.join(root, filename)
                 filesubpath = os.path.join(subpath, filename)
                 url = posixpath.join('/', *writer.split_path(filesubpath))
-                with open(filepath) as f:
-                    self.render_actions.append((
-                        url,
-                        None,
-                        f.read()))
+                render_actions.append((
+                    url,
+                    None,
+                    writer.SourceFile(filepath, self.config.static_links)))
     
+    @property
+    def render_actions(self):
+        return [action for render_actions in self.loaded.itervalues()
+            for action in render_actions]
+
     def get_render_actions(self):
         return self.render_actions
+
+    def get_static_render_actions(self):
+        return self.render_actions
+
+    def get_source_paths(self):
+        return self.config.static_directories
@@ -0,0 +1,216 @@
+"""Timing of the phases and plugins of a build, for `jules build --profile`.
+
+Time is recorded in sections, identified by a category and a name:
+
+ - phase: discover, prepare, query, finalize, and render/move inside it.
+ - plugin: component loaders, postprocessors and engine plugins.
+ - operator: query operators, e.g. select or render_each.
+ - bundle, template, url: individual bundles prepared, templates rendered
+   and URLs written.
+
+Sections nest. Each one records its number of calls, its total time, and its
+self time, which excludes the time spent in sections nested inside it. Lazy
+work (query operators, streamed templates, stream postprocessors) is timed
+with iterate(), which counts the time spent producing each item as a section.
+"""
+
+from __future__ import division
+
+import time
+import json
+import resource
+import threading
+import contextlib
+
+CATEGORIES = ['phase', 'plugin', 'operator', 'bundle', 'template', 'url']
+# categories with one entry per input, of which only the slowest are reported.
+SLOWEST_CATEGORIES = ['bundle', 'template', 'url']
+
+class NullProfiler(object):
+    """A profiler that doesn't record anything, used when not profiling"""
+    enabled = False
+
+    @contextlib.contextmanager
+    def section(self, category, name):
+        yield
+
+    def iterate(self, category, name, iterable, calls=1):
+        return iterable
+
+    def reset(self):
+        pass
+
+    def pop_records(self):
+        return None
+
+    def merge(self, records):
+        pass
+
+class Profiler(object):
+    enabled = True
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+        self.records = {} # (category, name) -> [calls, total, self time]
+        self.order = [] # keys of self.records, in first-seen order
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def _record(self, key, calls, total, self_time):
+        with self._lock:
+            try:
+                record = self.records[key]
+            except KeyError:
+                record = self.records[key] = [0, 0.0, 0.0]
+                self.order.append(key)
+            record[0] += calls
+            record[1] += total
+            record[2] += self_time
+
+    def _time(self, key, calls, f, *args):
+        """Call f(*args) as a section, and return its result"""
+        stack = self._stack()
+        frame = [0.0] # time spent in nested sections
+        stack.append(frame)
+        start = time.time()
+        try:
+            return f(*args)
+        finally:
+            elapsed = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            self._record(key, calls, elapsed, elapsed - frame[0])
+
+    @contextlib.contextmanager
+    def section(self, category, name):
+        stack = self._stack()
+        frame = [0.0]
+        stack.append(frame)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            self._record((category, name), 1, elapsed, elapsed - frame[0])
+
+    def iterate(self, category, name, iterable, calls=1):
+        """Time each step of a lazy iterable as part of one section.
+
+        Returns a wrapped iterator, or `iterable` itself if it's not an
+        iterator (e.g. a list), since then there's nothing left to time.
+        """
+        if iter(iterable) is not iterable:
+            return iterable
+        return self._iterate((category, name), iterable, calls)
+
+    def _iterate(self, key, iterator, calls):
+        while True:
+            try:
+                item = self._time(key, calls, next, iterator)
+            except StopIteration:
+                return
+            calls = 0
+            yield item
+
+    def reset(self):
+        """Forget the records so far.
+
+        Pool workers call this when they start, so that they only send back
+        the records of their own work, not the ones they inherited.
+        """
+        self.pop_records()
+
+    def pop_records(self):
+        """Return and forget the records so far, for merge()ing elsewhere.
+
+        Used to send the records of pool workers back to the main process.
+        """
+        with self._lock:
+            records = [(key, self.records[key]) for key in self.order]
+            self.records = {}
+            self.order = []
+        return records
+
+    def merge(self, records):
+        for key, (calls, total, self_time) in records or ():
+            self._record(key, calls, total, self_time)
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def peak_memory(self):
+        """Return the peak resident set size of this process and of its
+        largest child process, in bytes"""
+        # ru_maxrss is in kilobytes on Linux.
+        return {
+            'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'children':
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        }
+
+    def report_data(self, slowest=10):
+        """Return the report as a JSON-serializable dict"""
+        categories = {}
+        for key in self.order:
+            category, name = key
+            calls, total, self_time = self.records[key]
+            categories.setdefault(category, []).append({
+                'name': name,
+                'calls': calls,
+                'time': total,
+                'self_time': self_time,
+            })
+        for category in SLOWEST_CATEGORIES:
+            if category in categories:
+                rows = categories[category]
+                rows.sort(key=lambda row: row['time'], reverse=True)
+                del rows[slowest:]
+        for category in ['plugin', 'operator']:
+            if category in categories:
+                categories[category].sort(
+                    key=lambda row: row['self_time'], reverse=True)
+        end_time = self.end_time or time.time()
+        return {
+            'wall_time': end_time - self.start_time,
+            'peak_memory': self.peak_memory(),
+            'categories': categories,
+        }
+
+    def report(self, slowest=10):
+        """Return the report as text"""
+        data = self.report_data(slowest)
+        lines = ['Build profile: %.3fs, peak memory %.1f MB (%.1f MB in workers)'
+            % (data['wall_time'],
+               data['peak_memory']['self'] / 1024 / 1024,
+               data['peak_memory']['children'] / 1024 / 1024)]
+        for category in CATEGORIES:
+            rows = data['categories'].get(category)
+            if not rows:
+                continue
+            if category in SLOWEST_CATEGORIES:
+                title = 'slowest %ss' % category
+            else:
+                title = '%ss' % category
+            lines.append('')
+            lines.append('%-50s %8s %10s %10s' % (title, 'calls', 'time', 'self'))
+            for row in rows:
+                lines.append('  %-48s %8d %9.3fs %9.3fs' % (
+                    row['name'][:48], row['calls'],
+                    row['time'], row['self_time']))
+        return '\n'.join(lines)
+
+    def write_json(self, path, slowest=10):
+        with open(path, 'w') as f:
+            json.dump(self.report_data(slowest), f, indent=2, sort_keys=True)
@@ -0,0 +1,129 @@
+"""Putting a build's outputs into the output directory.
+
+A full build renders into a staging directory, which publish() then merges
+into the output directory: files whose contents are unchanged are left alone
+(mtime and all), new and changed files are renamed into place, so that each
+file is replaced atomically, and files that the build didn't produce are
+removed. An incremental build writes into the output directory itself, using
+replace_file() for the same per-file atomicity.
+
+Either way, the build writes a change manifest (`changes.json` in the cache
+directory, or wherever the `change_manifest` config says) listing the paths,
+relative to the output directory, that were added, changed or removed, for
+the benefit of rsync/CDN sync tooling:
+
+    {"added": ["new/index.html"],
+     "changed": ["index.html"],
+     "removed": ["old/index.html"]}
+"""
+
+import os
+import errno
+import json
+import shutil
+
+from jules.incremental import file_digest, walk_files
+
+class Changes(object):
+    """The paths that a build added, changed and removed"""
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def as_dict(self):
+        return {
+            'added': sorted(self.added),
+            'changed': sorted(self.changed),
+            'removed': sorted(self.removed),
+        }
+
+    def write(self, path):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
+        os.rename(tmp_path, path)
+
+def relative_url(path, root):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+def same_contents(a, b):
+    if os.path.samefile(a, b):
+        return True
+    if os.path.getsize(a) != os.path.getsize(b):
+        return False
+    return file_digest(a) == file_digest(b)
+
+def replace_file(src, dst):
+    """Move src to dst, replacing whatever was at dst in one step.
+
+    If they're on different filesystems, src is copied next to dst first.
+    """
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        tmp_path = dst + '.jules-tmp'
+        shutil.copy2(src, tmp_path)
+        os.rename(tmp_path, dst)
+        os.remove(src)
+
+def publish(staging, out):
+    """Merge the files under `staging` into `out`, returning the Changes.
+
+    `staging` is removed afterwards.
+    """
+    changes = Changes()
+    if not os.path.isdir(out):
+        if os.path.lexists(out):
+            os.remove(out)
+        parent = os.path.dirname(os.path.abspath(out))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        changes.added.extend(
+            relative_url(path, staging) for path in walk_files(staging))
+        replace_file_tree(staging, out)
+        return changes
+
+    new = set(relative_url(path, staging) for path in walk_files(staging))
+
+    # Remove stale files first, so that nothing is in the way of new
+    # directories (or of new files where there used to be directories).
+    for path in list(walk_files(out)):
+        url = relative_url(path, out)
+        if url not in new:
+            os.remove(path)
+            changes.removed.append(url)
+    for root, dirs, files in os.walk(out, topdown=False):
+        if root != out and not os.listdir(root):
+            os.rmdir(root)
+
+    for url in sorted(new):
+        src = os.path.join(staging, *url.split('/'))
+        dst = os.path.join(out, *url.split('/'))
+        if os.path.isfile(dst):
+            if same_contents(src, dst):
+                continue
+            changes.changed.append(url)
+        else:
+            changes.added.append(url)
+            dirname = os.path.dirname(dst)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        replace_file(src, dst)
+
+    shutil.rmtree(staging)
+    return changes
+
+def replace_file_tree(src, dst):
+    """Move the directory src to dst, which doesn't exist"""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
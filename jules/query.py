@@ -1,7 +1,14 @@
 import functools
+import collections
 import ast
 
 import jules
+from jules.index import BundleIndex, IndexedResults
+from jules.cache import freeze
+
+# A step of a planned pipeline: dispatch `method` with `arg`. `label` names
+# it in profiles and plans, since it may stand for several statements.
+Stage = collections.namedtuple('Stage', 'method arg label')
 
 def result(f):
     return lambda *args, **kwargs: ResultSet(f(*args, **kwargs))
@@ -11,7 +18,11 @@ class QueryEngine(object):
         self.plugins = list(engine.plugins.produce_instances(
             jules.plugins.QueryPlugin))
         self.dispatch_map = {}
+        self.pure_methods = set()
+        self.materializing_methods = set()
         for plugin in self.plugins:
+            self.pure_methods.update(plugin.pure_methods)
+            self.materializing_methods.update(plugin.materializing_methods)
             for method_name in plugin.methods:
                 if method_name in self.dispatch_map:
                     raise jules.plugins.PluginConflictError(
@@ -20,14 +31,86 @@ class QueryEngine(object):
                            plugin.__class__,
                            method_name))
                 self.dispatch_map[method_name] = getattr(plugin, method_name)
+        # built once the bundles are prepared, which they are by now.
+        self.index = BundleIndex(engine.bundles.values())
+        self._bundles_view = None
     
+    def reset(self, bundles, reindex):
+        """Forget what the last build of the engine memoized, and if
+        `reindex`, index `bundles` again (see JulesEngine.rebuild)."""
+        if reindex:
+            self.index = BundleIndex(bundles)
+        self._bundles_view = None
+
     def dispatch(self, method_name, *args, **kwargs):
         return self.dispatch_map[method_name](*args, **kwargs)
     
     def finalize(self):
         for result in self.plugins.call("finalize"):
             pass
+
+    def plan(self, pipeline):
+        """Return the Stages to run for a pipeline (an entry's statements).
+
+        Running them gives the same results as running the statements in
+        order, but:
+
+         - `where` filters right after an `order_by` are moved ahead of it,
+           so that only what passes them gets sorted, and
+         - an `order_by` followed by a `limit` becomes a `top`, which only
+           keeps the first n results, instead of sorting all of them.
+        """
+        stages = []
+        for stmt in pipeline:
+            (dispatch_key, arg), = stmt.iteritems()
+            stages.append(Stage(dispatch_key, arg, dispatch_key))
+
+        # sorting is stable, so filtering before or after gives the same order.
+        moved = True
+        while moved:
+            moved = False
+            for i in xrange(len(stages) - 1):
+                if (stages[i].method == 'order_by'
+                and stages[i + 1].method == 'where'):
+                    stages[i], stages[i + 1] = stages[i + 1], stages[i]
+                    moved = True
+
+        planned = []
+        for stage in stages:
+            previous = planned[-1] if planned else None
+            if (stage.method == 'limit' and 'top' in self.dispatch_map
+            and previous is not None and previous.method == 'order_by'
+            and isinstance(previous.arg, dict)
+            and isinstance(stage.arg, (int, long))):
+                arg = dict(previous.arg, n=stage.arg)
+                planned[-1] = Stage('top', arg, 'order_by+limit')
+            else:
+                planned.append(stage)
+        return planned
+
+    def explain(self, pipeline):
+        """Return [(label, materializes)] for the planned stages of a
+        pipeline, where `materializes` is True for stages that read all of
+        their input before producing anything."""
+        return [(stage.label, stage.method in self.materializing_methods)
+            for stage in self.plan(pipeline)]
     
+    def all_bundles(self):
+        """Return every bundle, as results that the query operators can
+        answer from the index."""
+        return self.index.all()
+
+    def bundles_view(self):
+        """Return every bundle, as the `bundles` that templates query.
+
+        This is the same MemoResultSet for the whole build, so queries that
+        every page runs (say, the recent posts in a sidebar) are only
+        computed once.
+        """
+        if self._bundles_view is None:
+            self._bundles_view = MemoResultSet(self, self.all_bundles, {}, ())
+        return self._bundles_view
+
     def resultset(self, seq):
         return ResultSet(self, seq)
 
@@ -52,6 +135,48 @@ class ResultSet(object):
             return ResultSet(self._engine, new_seq)
         return method_wrapper
 
+class MemoResultSet(ResultSet):
+    """A ResultSet whose queries are memoized.
+
+    Calling one of the engine's pure_methods on it again, with equal
+    arguments, returns the same MemoResultSet as the first time. Results are
+    computed when first used, and then kept.
+
+    `memo` is shared by every MemoResultSet derived from the same one, and is
+    keyed by the chain of (method name, arguments) that produced each.
+    """
+    def __init__(self, engine, compute, memo, key):
+        super(MemoResultSet, self).__init__(engine, None)
+        self._compute = compute
+        self._memo = memo
+        self._key = key
+
+    def results(self):
+        if self._compute is not None:
+            self._seq = repeatable(self._compute())
+            self._compute = None
+        return self._seq
+
+    def __iter__(self):
+        return iter(self.results())
+
+    def get_method(self, name):
+        method = self._engine.dispatch_map[name]
+        def method_wrapper(*args, **kwargs):
+            compute = lambda: method(self.results(), *args, **kwargs)
+            if name not in self._engine.pure_methods:
+                return ResultSet(self._engine, compute())
+            key = self._key + ((name, freeze(args), freeze(kwargs)),)
+            try:
+                return self._memo[key]
+            except TypeError: # unhashable arguments
+                return ResultSet(self._engine, compute())
+            except KeyError:
+                results = self._memo[key] = MemoResultSet(
+                    self._engine, compute, self._memo, key)
+                return results
+        return method_wrapper
+
 # some utility functions for plugins
 def method_registrar(methods):
     def register(f):
@@ -69,6 +194,13 @@ def cache(iterable):
         return iterable
     return list(iterable)
 
+def repeatable(iterable):
+    """Like cache(), but keeps IndexedResults as they are, so that they can
+    still be queried through the index."""
+    if isinstance(iterable, IndexedResults):
+        return iterable
+    return cache(iterable)
+
 def unwrapping_kwargs(f):
     @functools.wraps(f)
     def unwrapped_f(self, results, *args, **kwargs):
@@ -0,0 +1,163 @@
+"""The plugin classes in each plugin namespace, found once per process.
+
+straight.plugin walks sys.path and imports every module of a namespace each
+time it's asked for plugins. PluginRegistry asks it once per namespace, and
+keeps the classes indexed by the base classes they're requested by.
+
+The list of classes can also be persisted between runs. It is keyed by the
+modification times of the namespace packages and their modules, and lets a
+later run import only the modules that have classes of the plugin types it
+actually asks for.
+"""
+
+import os
+import sys
+import importlib
+import cPickle as pickle
+
+from straight.plugin import load
+
+PERSIST_VERSION = 1
+
+def class_id(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+def namespace_key(namespace):
+    """Return something that changes whenever the modules of a namespace are
+    added, removed or modified."""
+    key = []
+    for path in sys.path:
+        ns_path = os.path.join(path, namespace.replace('.', os.path.sep))
+        if not os.path.isdir(ns_path):
+            continue
+        modules = []
+        for name in sorted(os.listdir(ns_path)):
+            module_path = os.path.join(ns_path, name)
+            if os.path.isdir(module_path):
+                module_path = os.path.join(module_path, '__init__.py')
+            elif not name.endswith('.py'):
+                continue
+            try:
+                modules.append((name, os.stat(module_path).st_mtime))
+            except OSError:
+                continue
+        key.append((ns_path, os.stat(ns_path).st_mtime, tuple(modules)))
+    return tuple(key)
+
+class PluginRegistry(object):
+    def __init__(self):
+        self.namespaces = {} # namespace -> [class]
+        self.by_base = {} # (namespace, base class) -> [class]
+        # namespace -> (namespace_key, [(module name, attribute, base ids)])
+        self.persisted = {}
+        self.dirty = False
+
+    def classes(self, namespace, base_cls):
+        """Return the plugin classes of a namespace that subclass base_cls,
+        in the order straight.plugin.load() would return them."""
+        try:
+            return self.by_base[namespace, base_cls]
+        except KeyError:
+            pass
+
+        if namespace in self.namespaces:
+            classes = [cls for cls in self.namespaces[namespace]
+                if issubclass(cls, base_cls) and cls is not base_cls]
+        else:
+            classes = self._persisted_classes(namespace, base_cls)
+            if classes is None:
+                self.scan(namespace)
+                return self.classes(namespace, base_cls)
+        return self.by_base.setdefault((namespace, base_cls), classes)
+
+    def scan(self, namespace):
+        """Import every module of a namespace, and remember its classes"""
+        classes = list(load(namespace, subclasses=object))
+        self.namespaces[namespace] = classes
+        self.persisted[namespace] = (
+            namespace_key(namespace), self._entries(namespace, classes))
+        self.dirty = True
+
+    def _entries(self, namespace, classes):
+        """Return (module name, attribute, base ids) for each class, where
+        module.attribute is where straight.plugin found the class."""
+        entries = []
+        remaining = list(classes)
+        prefix = namespace + '.'
+        for module_name, module in sorted(sys.modules.items()):
+            if (module is None or not module_name.startswith(prefix)
+            or '.' in module_name[len(prefix):]):
+                continue
+            for attr_name in dir(module):
+                if attr_name.startswith('_'):
+                    continue
+                value = getattr(module, attr_name)
+                if value in remaining:
+                    entries.append((remaining.index(value), module_name,
+                        attr_name, frozenset(
+                            class_id(base) for base in value.__mro__)))
+        entries.sort()
+        return [entry[1:] for entry in entries]
+
+    def _persisted_classes(self, namespace, base_cls):
+        """Return the classes from the persisted list, or None if it's missing
+        or out of date."""
+        try:
+            key, entries = self.persisted[namespace]
+        except KeyError:
+            return None
+        if key != namespace_key(namespace):
+            del self.persisted[namespace]
+            return None
+        base_id = class_id(base_cls)
+        classes = []
+        seen = set()
+        for module_name, attr_name, base_ids in entries:
+            if base_id not in base_ids:
+                continue
+            module = importlib.import_module(module_name)
+            cls = getattr(module, attr_name, None)
+            if not isinstance(cls, type):
+                # the persisted list lies; be safe and scan after all.
+                del self.persisted[namespace]
+                return None
+            if cls is base_cls or cls in seen:
+                continue
+            seen.add(cls)
+            classes.append(cls)
+        return classes
+
+    def load(self, path):
+        """Load a persisted class list, if there is a usable one at path.
+
+        Returns the list of namespaces that was saved with it, which is empty
+        if nothing was loaded.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return []
+        if data.get('version') != PERSIST_VERSION:
+            return []
+        for namespace, value in data['namespaces'].iteritems():
+            self.persisted.setdefault(namespace, value)
+        return data['namespace_order']
+
+    def save(self, path, namespace_order):
+        if not self.dirty:
+            return
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'version': PERSIST_VERSION,
+                'namespaces': self.persisted,
+                'namespace_order': list(namespace_order),
+            }, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+        self.dirty = False
+
+plugin_registry = PluginRegistry()
@@ -0,0 +1,186 @@
+"""The docutils side of the reStructuredText post parser.
+
+This is imported by RstContentParser when it first parses a post, rather than
+when plugins are loaded, so that only builds with reStructuredText posts
+import docutils.
+"""
+
+import re
+import sys
+import copy
+import inspect
+import hashlib
+import threading
+
+import docutils
+from docutils import core, io, frontend, nodes, utils
+from docutils.parsers.rst import roles, directives, Directive
+
+import yaml
+
+from jules.plugins.post.rst import update_meta
+
+class Publisher(object):
+    """Parses reStructuredText to HTML, like docutils' publish_parts(), but
+    reusing the docutils components and default settings from one post to the
+    next.
+
+    Setting those up is a good part of the cost of parsing a short post. The
+    default settings are worked out once, and each post gets a copy with its
+    own meta data. The reader, parser and writer keep the state of the post
+    they're working on, so each thread gets its own.
+
+    `settings` are added to the default settings (see
+    RstExtensionPlugin.settings).
+    """
+    reader_name = 'standalone'
+    parser_name = 'restructuredtext'
+    writer_name = 'html'
+
+    def __init__(self, settings=None):
+        self.local = threading.local()
+        defaults = self.new_publisher().get_settings()
+        self.defaults = dict(vars(defaults))
+        # each post records its own dependencies (see frontend.Values)
+        del self.defaults['record_dependencies']
+        self.defaults.update(settings or {})
+
+    def new_publisher(self, components=None, settings=None):
+        if components is None:
+            publisher = core.Publisher(settings=settings,
+                source_class=io.StringInput, destination_class=io.StringOutput)
+            publisher.set_components(
+                self.reader_name, self.parser_name, self.writer_name)
+        else:
+            reader, parser, writer = components
+            publisher = core.Publisher(reader, parser, writer,
+                settings=settings, source_class=io.StringInput,
+                destination_class=io.StringOutput)
+        return publisher
+
+    def components(self):
+        """The (reader, parser, writer) of this thread"""
+        try:
+            return self.local.components
+        except AttributeError:
+            publisher = self.new_publisher()
+            self.local.components = (
+                publisher.reader, publisher.parser, publisher.writer)
+            return self.local.components
+
+    def settings(self, meta):
+        settings = frontend.Values(self.defaults)
+        settings.meta = meta
+        settings.jules_meta_updates = []
+        return settings
+
+    def parse(self, meta, src):
+        """Parse src to HTML, returning a dict of the parts that parse_post
+        needs, and the updates to the meta data made by `jules` directives."""
+        settings = self.settings(meta)
+        publisher = self.new_publisher(self.components(), settings)
+        publisher.set_source(src)
+        publisher.set_destination()
+        publisher.publish()
+        parts = publisher.writer.parts
+        return {
+            'html_body': parts['html_body'],
+            'title': parts['title'],
+            'subtitle': parts['subtitle'],
+            'meta_updates': settings.jules_meta_updates,
+        }
+
+_parser_version = None
+
+def parser_version():
+    """Identify the docutils version and the registered roles/directives.
+
+    docutils' own roles and directives are covered by its version. The others
+    are identified by their source code, so that changing them invalidates
+    cached parses.
+    """
+    global _parser_version
+    if _parser_version is not None:
+        return _parser_version
+
+    registered = set()
+    for kind, registry in [
+            ('role', roles._role_registry),
+            ('role', roles._roles),
+            ('directive', directives._directives)]:
+        for name, impl in registry.iteritems():
+            module = getattr(impl, '__module__', None) or ''
+            if module.startswith('docutils.'):
+                continue
+            try:
+                source = hashlib.sha1(
+                    inspect.getsource(sys.modules[module])).hexdigest()
+            except (IOError, TypeError, KeyError):
+                source = None
+            registered.add((kind, name, module, source))
+
+    pygments = sys.modules.get('pygments')
+    _parser_version = (
+        docutils.__version__,
+        getattr(pygments, '__version__', None),
+        sorted(registered))
+    return _parser_version
+
+
+def doclink(name, rawtext, text, lineno, inliner, options={}, content=[]):
+    """Link to another document.
+
+    Returns 2 part tuple containing list of nodes to insert into the
+    document and a list of system messages. Both are allowed to be
+    empty.
+
+    :param name: The role name used in the document.
+    :param rawtext: The entire markup snippet, with role.
+    :param text: The text marked with the role.
+    :param lineno: The line number where rawtext appears in the input.
+    :param inliner: The inliner instance that called us.
+    :param options: Directive options for customization.
+    :param content: The directive content for customization.
+    """
+
+    try:
+        m = re.match(r'(.*)<([-\w]+)(#[-\w]+)?>', text)
+        label, key, anchor = m.groups()
+    except (AttributeError, re.error):
+        label = None
+        anchor = None
+        key = text
+
+    # FIXME: this creates an external reference. Need to make internal (how?)
+    node = nodes.reference(
+        rawtext,
+        utils.unescape(label or ''),
+        refuri="jules:canon/" + key + ("#" + anchor if anchor else ''),
+        **options)
+
+    return [node], []
+
+roles.register_canonical_role('doclink', doclink)
+
+class JulesMeta(Directive):
+
+    required_arguments = 0
+    optional_arguments = 0
+    has_content = True
+
+    def run(self):
+        try:
+            d = yaml.load('\n'.join(self.content))
+        except yaml.parser.ParserError:
+            raise ValueError("Invalid YAML data")
+
+        # docutils is stupid.
+        settings = self.state_machine.document.settings
+        updates = getattr(settings, 'jules_meta_updates', None)
+        if updates is not None:
+            updates.append(copy.deepcopy(d))
+        update_meta(settings.meta, d)
+
+        return []
+
+directives.register_directive("jules", JulesMeta)
@@ -0,0 +1,242 @@
+"""The preview server behind `jules serve`.
+
+It serves either an output directory (DirectoryOutput) or the outputs of a
+build kept in memory (MemoryOutput, see jules.writer.MemoryURLWriter), with a
+thread per connection, HTTP/1.1 keep-alive, conditional requests (ETag and
+Last-Modified) and gzip.
+"""
+
+import os
+import gzip
+import hashlib
+import mimetypes
+import posixpath
+import urllib
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from io import BytesIO
+
+# python 2
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+# python 3
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from jules.writer import SourceFile
+from jules.fingerprint import IMMUTABLE
+
+# Responses smaller than this aren't worth compressing.
+GZIP_MIN_SIZE = 256
+
+# How many ETags and compressed responses to remember.
+CACHE_SIZE = 1024
+
+COMPRESSIBLE_TYPES = set([
+    'application/javascript', 'application/json', 'application/xml',
+    'application/atom+xml', 'application/rss+xml', 'image/svg+xml',
+])
+
+def content_type(url):
+    if url.endswith('/'):
+        return 'text/html'
+    mimetype, encoding = mimetypes.guess_type(url)
+    if mimetype is None:
+        if posixpath.splitext(url)[1] == '':
+            return 'text/html'
+        return 'application/octet-stream'
+    return mimetype
+
+def compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+class DirectoryOutput(object):
+    """Serves the files in a directory"""
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, url):
+        parts = [part for part in url.split('/') if part not in ('', '.', '..')]
+        return os.path.join(self.root, *parts)
+
+    def get(self, url):
+        """Return (data, mtime) of the output at url, or None"""
+        path = self.path(url)
+        if url.endswith('/'):
+            path = os.path.join(path, 'index.html')
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return f.read(), os.fstat(f.fileno()).st_mtime
+
+    def is_directory(self, url):
+        return os.path.isdir(self.path(url))
+
+class MemoryOutput(object):
+    """Serves the outputs of a build kept in memory"""
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def get(self, url):
+        """Return (data, mtime) of the output at url, or None"""
+        if url.endswith('/'):
+            url += 'index.html'
+        try:
+            data, mtime = self.outputs[url]
+        except KeyError:
+            return None
+        if isinstance(data, SourceFile):
+            try:
+                with open(data.path, 'rb') as f:
+                    return f.read(), os.fstat(f.fileno()).st_mtime
+            except IOError:
+                return None
+        return data, mtime
+
+    def is_directory(self, url):
+        return url + '/index.html' in self.outputs
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        url = urllib.unquote(self.path.split('?', 1)[0].split('#', 1)[0])
+        if not url.startswith('/'):
+            url = '/' + url
+        output = self.server.output
+        found = output.get(url)
+        if found is None:
+            if not url.endswith('/') and output.is_directory(url):
+                location = url + '/'
+                if '?' in self.path:
+                    location += '?' + self.path.split('?', 1)[1]
+                self.send_empty(301, [('Location', location)])
+            else:
+                self.send_error(404, "File not found")
+            return
+        data, mtime = found
+        etag = self.server.etag(url, data, mtime)
+        mtime = int(mtime)
+        mimetype = content_type(url)
+        use_gzip = (compressible(mimetype) and len(data) >= GZIP_MIN_SIZE
+            and self.accepts_gzip())
+        cache_control = IMMUTABLE if url in self.server.immutable else 'no-cache'
+        headers = [
+            # the gzipped representation isn't byte-identical, so it has its
+            # own (strong) ETag.
+            ('ETag', gzip_etag(etag) if use_gzip else etag),
+            ('Last-Modified', formatdate(mtime, usegmt=True)),
+            ('Cache-Control', cache_control),
+        ]
+        if compressible(mimetype):
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if self.not_modified([etag, gzip_etag(etag)], mtime):
+            self.send_empty(304, headers)
+            return
+
+        headers.append(('Content-Type', mimetype))
+        if use_gzip:
+            data = self.server.gzipped(etag, data)
+            headers.append(('Content-Encoding', 'gzip'))
+
+        self.send_response(200)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def send_empty(self, code, headers):
+        self.send_response(code)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def not_modified(self, etags, mtime):
+        """Whether the request's validators match `etags` (those of every
+        representation of the data) or `mtime`"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or any(etag in tags for etag in etags)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            since = parsedate_tz(if_modified_since)
+            if since is not None:
+                return mtime <= mktime_tz(since)
+        return False
+
+    def accepts_gzip(self):
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            coding = coding.split(';')
+            if coding[0].strip() != 'gzip':
+                continue
+            for param in coding[1:]:
+                name, _, value = param.partition('=')
+                if name.strip() == 'q' and value.strip() in ('0', '0.0', '0.00', '0.000'):
+                    return False
+            return True
+        return False
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    """Serves `output` (a DirectoryOutput or MemoryOutput) over HTTP.
+
+    `immutable` is the URLs whose contents never change, the fingerprinted
+    URLs of the build (see jules.fingerprint), which can be cached forever.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, output, verbose=True, immutable=()):
+        HTTPServer.__init__(self, address, RequestHandler)
+        self.output = output
+        self.verbose = verbose
+        self.immutable = immutable
+        self.etags = {} # (url, mtime, size) -> etag
+        self.compressed = {} # etag -> gzipped data
+
+    def etag(self, url, data, mtime):
+        key = (url, mtime, len(data))
+        try:
+            return self.etags[key]
+        except KeyError:
+            pass
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        remember(self.etags, key, etag)
+        return etag
+
+    def gzipped(self, etag, data):
+        try:
+            return self.compressed[etag]
+        except KeyError:
+            pass
+        buf = BytesIO()
+        # mtime=0, so that the same data is always compressed the same way.
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(data)
+        compressed = buf.getvalue()
+        remember(self.compressed, etag, compressed)
+        return compressed
+
+def gzip_etag(etag):
+    """Return the ETag of the gzipped representation of data with `etag`"""
+    return '"%s-gzip"' % etag.strip('"')
+
+def remember(cache, key, value):
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+    The Pygments reStructuredText directive
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This fragment is a Docutils_ 0.5 directive that renders source code
+    (to HTML only, currently) via Pygments.
+
+    To use it, adjust the options below and copy the code into a module
+    that you import on initialization.  The code then automatically
+    registers a ``sourcecode`` directive that you can use instead of
+    normal code blocks like this::
+
+        .. sourcecode:: python
+
+            My code goes here.
+
+    If you want to have different code styles, e.g. one with line numbers
+    and one without, add their formatters' options with their names to the
+    VARIANTS dict below.  You can invoke them instead of the DEFAULT one by
+    using a directive option::
+
+        .. sourcecode:: python
+            :linenos:
+
+            My code goes here.
+
+    Look at the `directive documentation`_ to get all the gory details.
+
+    .. _Docutils: http://docutils.sf.net/
+    .. _directive documentation:
+       http://docutils.sourceforge.net/docs/howto/rst-directives.html
+
+    :copyright: Copyright 2006-2009 by the Pygments team, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+"""
+
+# From http://stefan.sofa-rockers.org/2010/01/13/django-highlighting-rest-using-pygments/
+#
+# Lexers and formatters are made once, when first needed, and highlighted
+# code is remembered by a Highlighter (see below).
+
+from __future__ import absolute_import
+
+# Options
+# ~~~~~~~
+
+# Set to True if you want inline CSS styles instead of classes
+INLINESTYLES = False
+
+# The options of the default formatter
+DEFAULT = dict(noclasses=INLINESTYLES)
+
+# Add name -> formatter options pairs for every variant you want to use
+VARIANTS = {
+    # 'linenos': dict(noclasses=INLINESTYLES, linenos=True),
+}
+
+
+from docutils import nodes
+from docutils.parsers.rst import directives, Directive
+
+import pygments
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_lexer_by_name, TextLexer
+
+from jules.cache import cache_key
+
+_lexers = {} # name -> lexer
+_formatters = {} # variant -> formatter
+
+def get_lexer(name):
+    try:
+        return _lexers[name]
+    except KeyError:
+        pass
+    try:
+        lexer = get_lexer_by_name(name)
+    except ValueError:
+        # no lexer found - use the text one instead of an exception
+        lexer = TextLexer()
+    return _lexers.setdefault(name, lexer)
+
+def formatter_options(variant):
+    if variant is None:
+        return DEFAULT
+    return VARIANTS[variant]
+
+def get_formatter(variant):
+    try:
+        return _formatters[variant]
+    except KeyError:
+        pass
+    return _formatters.setdefault(variant,
+        HtmlFormatter(**formatter_options(variant)))
+
+class Highlighter(object):
+    """Highlights code, remembering the results for the rest of the build and,
+    if it has a cache (a jules.cache.DiskCache), for later builds too.
+
+    Results are keyed by the lexer name, the formatter variant and the code,
+    along with the Pygments version and the variant's formatter options.
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.memo = {}
+
+    def highlight(self, lexer_name, variant, code):
+        key = cache_key(lexer_name, variant, code,
+            pygments.__version__, formatter_options(variant))
+        try:
+            return self.memo[key]
+        except KeyError:
+            pass
+        parsed = None
+        if self.cache is not None:
+            parsed = self.cache.get(key)
+        if parsed is None:
+            parsed = highlight(
+                code, get_lexer(lexer_name), get_formatter(variant))
+            if self.cache is not None:
+                self.cache.set(key, parsed)
+        return self.memo.setdefault(key, parsed)
+
+# for posts parsed without a jules_highlighter setting.
+_default_highlighter = Highlighter()
+
+class Pygments(Directive):
+    """ Source code syntax hightlighting.
+
+    Uses the Highlighter in the `jules_highlighter` docutils setting, if
+    there is one (see jules.plugins.pygments).
+    """
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = True
+    option_spec = dict([(key, directives.flag) for key in VARIANTS])
+    has_content = True
+
+    def run(self):
+        self.assert_has_content()
+        highlighter = getattr(self.state.document.settings,
+            'jules_highlighter', None) or _default_highlighter
+        # take an arbitrary option if more than one is given
+        variant = self.options and self.options.keys()[0] or None
+        parsed = highlighter.highlight(
+            self.arguments[0], variant, '\n'.join(self.content))
+        return [nodes.raw('', parsed, format='html')]
+
+directives.register_directive('sourcecode', Pygments)
@@ -0,0 +1,165 @@
+"""Jinja2 support that QueryRenderer only imports along with jinja2."""
+
+import cPickle as pickle
+
+import jinja2
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from jules.cache import cache_key, freeze
+
+class DiskBytecodeCache(jinja2.BytecodeCache):
+    """Keeps compiled templates in a jules.cache.DiskCache.
+
+    jinja2 checks the bytecode against the template's source before using it,
+    so entries never need invalidating.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+
+    def load_bytecode(self, bucket):
+        code = self.cache.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        self.cache.set(bucket.key, bucket.bytecode_to_string())
+
+def fingerprint_filter(fingerprint_url):
+    """Return the `fingerprint` filter, given Renderer.fingerprint_url.
+
+    It's a context filter only so that jinja2 doesn't call it on constants
+    when compiling, since compiled templates outlive the fingerprints.
+    """
+    @jinja2.contextfilter
+    def fingerprint(context, url):
+        return fingerprint_url(url)
+    return fingerprint
+
+class FragmentCache(object):
+    """The rendered blocks of `{% cache %}` tags.
+
+    They're kept for the rest of the build and, if there's a `disk_cache`,
+    for later builds too. `version` should identify everything other than
+    the keys that the blocks depend on (the templates and site.yaml, say),
+    and is part of the keys of persisted blocks.
+
+    Blocks that read the templates' `bundles` (see used_bundles()) depend on
+    every bundle, which a key can't identify. `bundles_version` is called,
+    at most once, to identify the bundles when a persisted one is stored or
+    looked up.
+    """
+    def __init__(self, disk_cache=None, version=None, bundles_version=None):
+        self.fragments = {} # key -> (fragment, whether it read bundles)
+        self.disk_cache = disk_cache
+        self.version = version
+        self.bundles_version = bundles_version
+        self._bundles_version = None
+        self.rendering = [] # whether each block being rendered read bundles
+        self.hits = 0
+        self.misses = 0
+
+    def used_bundles(self):
+        """Note that the blocks being rendered read `bundles`"""
+        self.rendering[:] = [True] * len(self.rendering)
+
+    def current_bundles_version(self):
+        if self._bundles_version is None:
+            self._bundles_version = (self.bundles_version()
+                if self.bundles_version is not None else ())
+        return self._bundles_version
+
+    def get_or_render(self, key, render, record_bundles=None):
+        """Return the block with `key`, rendering it with render() if it
+        isn't cached.
+
+        A cached block that read `bundles` when it was rendered doesn't read
+        them now, so record_bundles() is called instead, to record that the
+        page depends on every bundle all the same.
+        """
+        try:
+            fragment, uses_bundles = self.fragments[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable key, so it can't be cached at all.
+            self.misses += 1
+            return render()
+        else:
+            self.hit(uses_bundles, record_bundles)
+            return fragment
+
+        disk_key = None
+        if self.disk_cache is not None:
+            try:
+                disk_key = cache_key(self.version, key)
+            except (TypeError, pickle.PicklingError):
+                pass
+            else:
+                found = self.disk_cache.get(disk_key)
+                if found is not None:
+                    fragment, bundles_version = found
+                    if (bundles_version is None or
+                            bundles_version == self.current_bundles_version()):
+                        uses_bundles = bundles_version is not None
+                        self.fragments[key] = fragment, uses_bundles
+                        self.hit(uses_bundles, record_bundles)
+                        return fragment
+
+        self.misses += 1
+        self.rendering.append(False)
+        try:
+            fragment = render()
+        finally:
+            uses_bundles = self.rendering.pop()
+        self.fragments[key] = fragment, uses_bundles
+        if disk_key is not None:
+            self.disk_cache.set(disk_key, (fragment,
+                self.current_bundles_version() if uses_bundles else None))
+        return fragment
+
+    def hit(self, uses_bundles, record_bundles):
+        self.hits += 1
+        if uses_bundles:
+            self.used_bundles()
+            if record_bundles is not None:
+                record_bundles()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+class FragmentCacheExtension(Extension):
+    """Adds the `cache` tag, which renders its body once per key:
+
+        {% cache "sidebar" %}
+          ... recent posts ...
+        {% endcache %}
+
+    The key is any number of (picklable) expressions, and must identify
+    everything the body depends on that can differ from page to page. A
+    body that reads `bundles` doesn't need them in its key: it depends on
+    every bundle (see FragmentCache). Blocks are cached in the environment's
+    `fragment_cache`.
+    """
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        args = [nodes.Const(parser.name), nodes.Const(lineno), nodes.List(keys),
+            nodes.ContextReference()]
+        return nodes.CallBlock(self.call_method('_cache', args), [], [], body
+            ).set_lineno(lineno)
+
+    def _cache(self, name, lineno, keys, context, caller):
+        # the page's `bundles`, if it's QueryRenderer's, records what uses it.
+        return self.environment.fragment_cache.get_or_render(
+            (name, lineno, freeze(keys)), caller,
+            getattr(context.get('bundles'), 'record_use', None))
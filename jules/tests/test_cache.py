@@ -0,0 +1,71 @@
+import unittest
+
+import os
+import time
+import tempfile
+import shutil
+
+from jules import cache
+
+class TestCacheKey(unittest.TestCase):
+    def test_dict_order(self):
+        d1 = {}
+        d2 = {}
+        for i in range(100):
+            d1[i] = i
+        for i in reversed(range(100)):
+            d2[i] = i
+        self.assertEqual(cache.cache_key(d1), cache.cache_key(d2))
+
+    def test_list_tuple(self):
+        self.assertNotEqual(cache.cache_key([1]), cache.cache_key((1,)))
+
+    def test_different(self):
+        self.assertNotEqual(
+            cache.cache_key('src', {'title': 'a'}),
+            cache.cache_key('src', {'title': 'b'}))
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.cache = cache.open_cache(self.tempdir, 'test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get(cache.cache_key('a')), None)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_hit(self):
+        key = cache.cache_key('a')
+        self.cache.set(key, {'html_body': u'<p>a</p>'})
+        self.assertEqual(self.cache.get(key), {'html_body': u'<p>a</p>'})
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_names(self):
+        self.cache.set(cache.cache_key('a'), 'a')
+        self.assertEqual(cache.cache_names(self.tempdir), ['test'])
+
+    def test_clear(self):
+        key = cache.cache_key('a')
+        self.cache.set(key, 'a')
+        self.cache.clear()
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_prune(self):
+        keys = [cache.cache_key(i) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.cache.set(key, 'x' * 1000)
+            path = self.cache._path(key)
+            os.utime(path, (time.time() - 10 + i, time.time() - 10 + i))
+        # use the oldest one, so that the second oldest gets evicted.
+        self.cache.get(keys[0])
+
+        self.cache.max_size = self.cache.stats()['size'] * 2 // 3
+        self.cache.prune()
+
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.assertEqual(self.cache.get(keys[1]), None)
+        self.assertEqual(self.cache.get(keys[0]), 'x' * 1000)
@@ -0,0 +1,46 @@
+import unittest
+
+from jules import fingerprint
+
+FINGERPRINTS = {
+    '/style.css': '/style.0123456789.css',
+    '/img/logo.png': '/img/logo.abcdef0123.png',
+}
+
+class TestFingerprint(unittest.TestCase):
+    def test_extensions(self):
+        self.assertEqual(fingerprint.extensions(True),
+            fingerprint.DEFAULT_EXTENSIONS)
+        self.assertEqual(fingerprint.extensions(['.css']), ['.css'])
+        self.assertEqual(fingerprint.extensions(False), [])
+        self.assertEqual(fingerprint.extensions(None), [])
+
+    def test_fingerprinted_url(self):
+        url = fingerprint.fingerprinted_url('/a/style.css', 'f' * 40)
+        self.assertEqual(url, '/a/style.ffffffffff.css')
+
+    def test_rewrite_reference(self):
+        def rewrite(ref, base_url='/posts/1/'):
+            return fingerprint.rewrite_reference(ref, base_url, FINGERPRINTS)
+        self.assertEqual(rewrite('/style.css'), '/style.0123456789.css')
+        self.assertEqual(rewrite('../../img/logo.png?v=1#top'),
+            '../../img/logo.abcdef0123.png?v=1#top')
+        self.assertEqual(rewrite('logo.png', '/img/'), 'logo.abcdef0123.png')
+        self.assertEqual(rewrite('logo.png'), 'logo.png')
+        self.assertEqual(rewrite('http://example.com/style.css'),
+            'http://example.com/style.css')
+        self.assertEqual(rewrite('//example.com/style.css'),
+            '//example.com/style.css')
+        self.assertEqual(rewrite('#style.css'), '#style.css')
+
+    def test_rewrite_css(self):
+        css = ('@import "style.css";\n'
+            'a { background: url(img/logo.png) }\n'
+            "b { background: url( 'img/logo.png#x' ) }\n"
+            'i { background: url(data:image/png;base64,AAAA) }\n')
+        self.assertEqual(
+            fingerprint.rewrite_css(css, '/other.css', FINGERPRINTS),
+            '@import "style.0123456789.css";\n'
+            'a { background: url(img/logo.abcdef0123.png) }\n'
+            "b { background: url( 'img/logo.abcdef0123.png#x' ) }\n"
+            'i { background: url(data:image/png;base64,AAAA) }\n')
@@ -0,0 +1,207 @@
+import unittest
+
+import os
+import tempfile
+import shutil
+
+from jules import incremental
+from jules.tests.test_jules import run_jules
+
+class Bundle(object):
+    def __init__(self, key, path):
+        self.key = key
+        self.path = path
+        self.components = {'meta': {'key': key}, 'post': u'post ' + key}
+
+class TestBuildManifest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.path = os.path.join(self.tempdir, 'manifest')
+        self.bundles = []
+        for key in ['a', 'b']:
+            path = os.path.join(self.tempdir, key)
+            os.mkdir(path)
+            self.write(key, 'post.rst', key)
+            self.bundles.append(Bundle(key, path))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, key, filename, data):
+        with open(os.path.join(self.tempdir, key, filename), 'w') as f:
+            f.write(data)
+
+    def build(self, select):
+        """Do a fake build, where entry `e_<key>` selects bundle `key`"""
+        manifest = incremental.BuildManifest.load(self.path)
+        for bundle in self.bundles:
+            if manifest.restore_components(bundle) is None:
+                manifest.record_bundle(bundle)
+        manifest.finish_bundles()
+
+        rerun = []
+        for key in select:
+            name = 'e_' + key
+            if manifest.entry_is_stale(name):
+                rerun.append(name)
+                manifest.begin_entry(name)
+                manifest.record_selected(Bundle(key, None))
+                manifest.record_output('/' + key, None)
+                manifest.end_entry()
+            else:
+                manifest.keep_entry(name)
+        manifest.save()
+        return rerun
+
+    def test_first_build(self):
+        self.assertEqual(self.build(['a', 'b']), ['e_a', 'e_b'])
+
+    def test_unchanged(self):
+        self.build(['a', 'b'])
+        self.assertEqual(self.build(['a', 'b']), [])
+
+    def test_content_change(self):
+        self.build(['a', 'b'])
+        self.write('b', 'post.rst', 'changed')
+        self.assertEqual(self.build(['a', 'b']), ['e_b'])
+
+    def test_meta_change(self):
+        self.build(['a', 'b'])
+        self.write('b', 'post.rst', 'changed')
+        self.bundles[1].components['meta']['title'] = 'changed'
+        self.assertEqual(self.build(['a', 'b']), ['e_a', 'e_b'])
+
+    def test_all_bundles(self):
+        self.build(['a', 'b'])
+        manifest = incremental.BuildManifest.load(self.path)
+        manifest.new_entries = manifest.old['entries']
+        manifest.current_entry = manifest.new_entries['e_a']
+        manifest.record_all_bundles()
+        manifest.save()
+
+        self.write('b', 'post.rst', 'changed')
+        self.assertEqual(self.build(['a', 'b']), ['e_a', 'e_b'])
+
+    def test_unpicklable(self):
+        self.bundles[1].components['handle'] = lambda: None
+        self.build(['a', 'b'])
+        self.assertEqual(self.build(['a', 'b']), [])
+        self.write('b', 'post.rst', 'changed')
+        self.assertEqual(self.build(['a', 'b']), ['e_b'])
+        self.bundles[1].components['meta']['title'] = 'changed'
+        self.write('b', 'post.rst', 'changed again')
+        self.assertEqual(self.build(['a', 'b']), ['e_a', 'e_b'])
+
+    def test_new_bundle(self):
+        all_bundles = self.bundles
+        self.bundles = all_bundles[:1]
+        self.build(['a'])
+        self.bundles = all_bundles
+        self.assertEqual(self.build(['a', 'b']), ['e_a', 'e_b'])
+
+class TestIncrementalBuild(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        self.build_dir = os.path.join(self.projectdir, '_build')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def build(self):
+        run_jules(['build', '-i', '-L', self.projectdir])
+
+    def output(self, *path):
+        with open(os.path.join(self.build_dir, *path)) as f:
+            return f.read()
+
+    def mtime(self, *path):
+        return os.stat(os.path.join(self.build_dir, *path)).st_mtime
+
+    def test_unchanged_outputs_untouched(self):
+        self.build()
+        static_mtime = self.mtime('static1.txt')
+        content_mtime = self.mtime('content', '0', 'index.html')
+
+        post = os.path.join(self.projectdir, 'content', 'post2', 'post.rst')
+        with open(post) as f:
+            src = f.read()
+        with open(post, 'w') as f:
+            f.write(src.replace('Hello there!', 'Hello again!'))
+        self.build()
+
+        self.assertTrue('Hello again!' in self.output('content', '1', 'index.html'))
+        self.assertEqual(self.mtime('static1.txt'), static_mtime)
+        self.assertEqual(self.mtime('content', '0', 'index.html'), content_mtime)
+
+    def test_stale_outputs_removed(self):
+        self.build()
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_dir, 'content', '1', 'index.html')))
+
+        shutil.rmtree(os.path.join(self.projectdir, 'content', 'post2'))
+        self.build()
+
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir, 'content', '1', 'index.html')))
+        self.assertEqual(self.output('content', 'index.html'), '0 ')
+
+SIDEBAR_SITE = """title: "Test Site"
+bundle_dirs:
+ - "content"
+bundle_defaults: {}
+entries:
+ - all:
+    - select:
+        require_components: ['meta', 'post']
+    - render_all:
+        template: sidebar.j2
+        url: /all/
+ - none:
+    - select:
+        require_components: ['missing']
+    - render_all:
+        template: sidebar.j2
+        url: /none/
+"""
+
+SIDEBAR = (u'{% cache "sidebar" %}{% for bundle in bundles %}'
+    u'{{ bundle.key }}:{{ "again" in bundle.components.post|string }} '
+    u'{% endfor %}{% endcache %}')
+
+class TestCachedFragments(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'w') as f:
+            f.write(SIDEBAR_SITE)
+        with open(os.path.join(self.projectdir, 'templates', 'sidebar.j2'), 'w') as f:
+            f.write(SIDEBAR)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def build(self):
+        run_jules(['build', '-i', '-L', self.projectdir])
+
+    def output(self, *path):
+        with open(os.path.join(self.projectdir, '_build', *path)) as f:
+            return f.read()
+
+    def test_shared_block(self):
+        # `none` selects no bundles, and reuses the sidebar rendered by `all`,
+        # but it still depends on every bundle through the sidebar.
+        self.build()
+        self.assertEqual(self.output('none', 'index.html'),
+            'post2:False post1:False ')
+
+        post = os.path.join(self.projectdir, 'content', 'post1', 'post.rst')
+        with open(post) as f:
+            src = f.read()
+        with open(post, 'w') as f:
+            f.write(src.replace('Hello, world!', 'Hello, again!'))
+        self.build()
+        self.assertEqual(self.output('none', 'index.html'),
+            'post2:False post1:True ')
@@ -4,6 +4,7 @@ import sys
 import os
 import tempfile
 import shutil
+import json
 import subprocess
 import textwrap
 
@@ -20,6 +21,16 @@ def run_jules(args):
         """ %
         (os.path.dirname(os.path.abspath(jules.__file__)), ['jules'] + args))])
 
+def read_tree(path):
+    """Return {relpath: contents} for every file under path"""
+    tree = {}
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            with open(filepath) as f:
+                tree[os.path.relpath(filepath, path)] = f.read()
+    return tree
+
 class TestTemplate(unittest.TestCase):
     """Some basic smoke testing using the `test` template"""
     def test_site(self):
@@ -45,6 +56,70 @@ class TestTemplate(unittest.TestCase):
         finally:
             shutil.rmtree(tempdir)
     
+    def test_parallel_prepare(self):
+        """Building with a pool of workers gives identical output"""
+        tempdir = tempfile.mkdtemp(suffix='-jules')
+        try:
+            projectdir = os.path.join(tempdir, 'test_site')
+            run_jules(['init', projectdir, '-s', 'test'])
+            build = os.path.join(projectdir, '_build')
+
+            run_jules(['build', '-L', projectdir])
+            serial = read_tree(build)
+            run_jules(['build', '-j', '2', '-L', projectdir])
+            parallel = read_tree(build)
+            self.assertEqual(serial, parallel)
+
+            with open(os.path.join(projectdir, 'site.yaml'), 'a') as f:
+                f.write('\nrender_backend: thread\n')
+            run_jules(['build', '-j', '2', '-L', projectdir])
+            threaded = read_tree(build)
+            self.assertEqual(serial, threaded)
+        finally:
+            shutil.rmtree(tempdir)
+    
+    def test_stream_templates(self):
+        """Streaming templates to the output gives identical output"""
+        tempdir = tempfile.mkdtemp(suffix='-jules')
+        try:
+            projectdir = os.path.join(tempdir, 'test_site')
+            run_jules(['init', projectdir, '-s', 'test'])
+            build = os.path.join(projectdir, '_build')
+
+            run_jules(['build', '-L', projectdir])
+            rendered = read_tree(build)
+
+            with open(os.path.join(projectdir, 'site.yaml'), 'a') as f:
+                f.write('\nstream_templates: true\n')
+            run_jules(['build', '-L', projectdir])
+            self.assertEqual(rendered, read_tree(build))
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_profile(self):
+        tempdir = tempfile.mkdtemp(suffix='-jules')
+        try:
+            projectdir = os.path.join(tempdir, 'test_site')
+            report = os.path.join(tempdir, 'profile.json')
+            run_jules(['init', projectdir, '-s', 'test'])
+            run_jules(['build', '-L', projectdir,
+                '--profile', '--profile-json=' + report, '--profile-top=1'])
+            with open(report) as f:
+                data = json.load(f)
+        finally:
+            shutil.rmtree(tempdir)
+
+        categories = data['categories']
+        self.assertEqual(
+            [row['name'] for row in categories['phase']],
+            ['discover', 'prepare', 'query', 'render', 'move', 'finalize'])
+        self.assertTrue('select' in
+            [row['name'] for row in categories['operator']])
+        self.assertTrue('CanonicalUrlRewriter' in
+            [row['name'] for row in categories['plugin']])
+        self.assertEqual(len(categories['url']), 1)
+        self.assertTrue(data['peak_memory']['self'] > 0)
+    
     def do_test_content(self, build):
         p1 = os.path.join(build, 'content', '0', 'index.html')
         p2 = os.path.join(build, 'content', '1', 'index.html')
@@ -0,0 +1,74 @@
+import unittest
+
+import os
+import tempfile
+import shutil
+import cPickle as pickle
+
+import jules
+from jules.plugins import LazyComponent
+from jules.tests.test_jules import run_jules, read_tree
+
+class TestLazyPosts(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        # with a title and subtitle, parsing post1 can't change its meta data
+        with open(os.path.join(
+                self.projectdir, 'content', 'post1', 'meta.yaml'), 'a') as f:
+            f.write('\ntitle: Post 1\nsubtitle: Sub 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def post(self, engine, key):
+        return engine.bundles[key].components['post']
+
+    def test_lazy(self):
+        engine = jules.JulesEngine(self.projectdir)
+        post1 = self.post(engine, 'post1')
+        self.assertTrue(isinstance(post1, LazyComponent))
+        self.assertFalse(post1.loaded())
+        # post2 has a `jules` directive, so it's parsed right away.
+        self.assertFalse(isinstance(self.post(engine, 'post2'), LazyComponent))
+
+        engine.run()
+        self.assertTrue(post1.loaded())
+        self.assertTrue('Hello, world!' in post1)
+        with open(os.path.join(
+                self.projectdir, '_build', 'content', '0', 'index.html')) as f:
+            self.assertTrue('Hello, world!' in f.read())
+
+    def test_pickle(self):
+        engine = jules.JulesEngine(self.projectdir)
+        post1 = self.post(engine, 'post1')
+        unloaded = pickle.loads(pickle.dumps(post1, pickle.HIGHEST_PROTOCOL))
+        self.assertFalse(unloaded.loaded())
+        unloaded.bind(engine)
+        self.assertEqual(unloaded, post1)
+
+        loaded = pickle.loads(pickle.dumps(post1, pickle.HIGHEST_PROTOCOL))
+        self.assertTrue(loaded.loaded())
+        self.assertEqual(loaded, post1)
+
+    def test_builds(self):
+        """Lazy posts survive incremental builds and parallel prepares"""
+        build = os.path.join(self.projectdir, '_build')
+        run_jules(['build', '-L', self.projectdir])
+        expected = read_tree(build)
+        for args in [['-i'], ['-i', '-j', '2'], ['-j', '2']]:
+            run_jules(['build', '-L', self.projectdir] + args)
+            self.assertEqual(read_tree(build), expected)
+
+        # rerun the entries, with post1 restored (unloaded) from the manifest
+        post2 = os.path.join(self.projectdir, 'content', 'post2', 'post.rst')
+        with open(post2) as f:
+            src = f.read()
+        with open(post2, 'w') as f:
+            f.write(src.replace('Hello there!', 'Hello again!'))
+        run_jules(['build', '-i', '-L', self.projectdir])
+        tree = read_tree(build)
+        self.assertTrue('Hello again!' in tree[os.path.join('content', '1', 'index.html')])
+        self.assertEqual(tree[os.path.join('content', '0', 'index.html')],
+            expected[os.path.join('content', '0', 'index.html')])
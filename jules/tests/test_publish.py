@@ -0,0 +1,107 @@
+import unittest
+
+import os
+import json
+import tempfile
+import shutil
+
+from jules import publish
+from jules.tests.test_jules import run_jules, read_tree
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.staging = os.path.join(self.tempdir, 'staging')
+        self.out = os.path.join(self.tempdir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_tree(self, root, tree, mtime=None):
+        for relpath, data in tree.items():
+            path = os.path.join(root, relpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write(data)
+            if mtime is not None:
+                os.utime(path, (mtime, mtime))
+
+    def publish(self, tree):
+        self.write_tree(self.staging, tree)
+        changes = publish.publish(self.staging, self.out)
+        self.assertFalse(os.path.exists(self.staging))
+        self.assertEqual(read_tree(self.out), tree)
+        return changes.as_dict()
+
+    def test_new(self):
+        self.assertEqual(self.publish({'index.html': 'a', 'b/index.html': 'b'}),
+            {'added': ['b/index.html', 'index.html'], 'changed': [],
+             'removed': []})
+
+    def test_merge(self):
+        self.write_tree(self.out, {
+            'same.html': 'same',
+            'changed.html': 'old',
+            'stale/index.html': 'stale',
+            'file_to_dir': 'file',
+            'dir_to_file/index.html': 'dir',
+        }, mtime=1000000000)
+        changes = self.publish({
+            'same.html': 'same',
+            'changed.html': 'new',
+            'new.html': 'new',
+            'file_to_dir/index.html': 'dir',
+            'dir_to_file': 'file',
+        })
+        self.assertEqual(changes, {
+            'added': ['dir_to_file', 'file_to_dir/index.html', 'new.html'],
+            'changed': ['changed.html'],
+            'removed': ['dir_to_file/index.html', 'file_to_dir',
+                        'stale/index.html'],
+        })
+        self.assertEqual(
+            os.stat(os.path.join(self.out, 'same.html')).st_mtime, 1000000000)
+        self.assertFalse(os.path.exists(os.path.join(self.out, 'stale')))
+
+class TestChangeManifest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        self.build_dir = os.path.join(self.projectdir, '_build')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def build(self, *args):
+        run_jules(['build', '-L', self.projectdir] + list(args))
+        with open(os.path.join(self.projectdir, '.jules', 'changes.json')) as f:
+            return json.load(f)
+
+    def edit_post(self):
+        post = os.path.join(self.projectdir, 'content', 'post2', 'post.rst')
+        with open(post) as f:
+            src = f.read()
+        with open(post, 'w') as f:
+            f.write(src.replace('Hello there!', 'Hello again!'))
+
+    def check_rebuild(self, *args):
+        changes = self.build(*args)
+        self.assertTrue('content/1/index.html' in changes['added'])
+        mtime = os.stat(os.path.join(self.build_dir, 'static1.txt')).st_mtime
+
+        self.edit_post()
+        changes = self.build(*args)
+        self.assertEqual(changes['added'], [])
+        self.assertEqual(changes['removed'], [])
+        self.assertTrue('content/1/index.html' in changes['changed'])
+        self.assertFalse('content/0/index.html' in changes['changed'])
+        self.assertEqual(
+            os.stat(os.path.join(self.build_dir, 'static1.txt')).st_mtime, mtime)
+
+    def test_full_build(self):
+        self.check_rebuild()
+
+    def test_incremental_build(self):
+        self.check_rebuild('-i')
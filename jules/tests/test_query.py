@@ -3,6 +3,7 @@ import unittest
 import os
 
 import jules
+import jules.index
 from jules.query import *
 
 class Namespace(object):
@@ -148,3 +149,218 @@ class TestGroupBy(unittest.TestCase):
                 .group_by_in('val')),
             [dict(key=1, group=[val((1,)), val((1, 2)), val((1,))]),
              dict(key=2, group=[val((2,)), val((1, 2))])])
+
+    def test_group_by_in_duplicates(self):
+        rs = ResultSet(self.e, [Val((1, 1)), Val((1,))])
+        self.assertEqual(
+            list(rs
+                .select(require_components=['val'])
+                .group_by_in('val')),
+            [dict(key=1, group=[val((1, 1)), val((1,))])])
+
+class Key(object):
+    """A group key that counts how often it's hashed or compared"""
+    operations = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        Key.operations += 1
+        return hash(self.value)
+
+    def __eq__(self, other):
+        Key.operations += 1
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return not self == other
+
+class TestGroupByScaling(unittest.TestCase):
+    """Grouping is linear in the number of items, even when almost every item
+    has a distinct value (it used to be quadratic)."""
+    e = QueryEngine(MockJulesEngine())
+
+    def count_operations(self, n):
+        rs = ResultSet(self.e,
+            [Val((Key(i), Key(i // 2), Key('all'))) for i in xrange(n)])
+        Key.operations = 0
+        groups = list(rs
+            .select(require_components=['val'])
+            .group_by_in('val'))
+        self.assertEqual(len(groups), n + 1)
+        return Key.operations
+
+    def test_scaling(self):
+        small = self.count_operations(200)
+        large = self.count_operations(800)
+        # 4x the items: linear is ~4x the hashes and comparisons, quadratic
+        # ~16x.
+        self.assertTrue(large <= small * 5,
+            "200 items: %d operations, 800 items: %d" % (small, large))
+
+class Meta(object):
+    def __init__(self, **meta):
+        self.components = dict(meta=meta)
+
+class TestIndexedQuery(unittest.TestCase):
+    """Queries answered from the index give the same results as eval"""
+    bundles = [
+        Meta(directory='posts', tags=['a', 'b'], order=3),
+        Meta(directory='pages', tags=['b'], order=1),
+        Meta(directory='posts', tags=[], order=2),
+        Meta(directory='posts', tags=['a'], order=1),
+    ]
+    e = QueryEngine(MockJulesEngine())
+    e.index = jules.index.BundleIndex(bundles)
+
+    def assertSameResults(self, query):
+        indexed = query(ResultSet(self.e, self.e.all_bundles()))
+        plain = query(ResultSet(self.e, self.bundles))
+        self.assertEqual(list(indexed), list(plain))
+        return indexed
+
+    def assertIndexed(self, query):
+        results = self.assertSameResults(query)
+        self.assertTrue(isinstance(results._seq, jules.index.IndexedResults))
+
+    def test_select(self):
+        self.assertIndexed(lambda rs: rs.select(require_components=['meta']))
+        self.assertIndexed(lambda rs: rs.select(forbid_components=['meta']))
+
+    def test_where(self):
+        for clause in ['meta["directory"] == "posts"',
+                       '"posts" == meta["directory"]',
+                       'meta["directory"] in ("pages", "other")',
+                       '"a" in meta["tags"]',
+                       'meta["order"] >= 2',
+                       '1 < meta["order"]']:
+            self.assertIndexed(lambda rs: rs
+                .select(require_components=['meta'])
+                .where([clause]))
+
+    def test_order_by(self):
+        for descending in [False, True]:
+            self.assertIndexed(lambda rs: rs
+                .select(require_components=['meta'])
+                .where(['meta["directory"] == "posts"'])
+                .order_by(key='meta["order"]', descending=descending))
+
+    def test_fallback(self):
+        self.assertSameResults(lambda rs: rs
+            .select(require_components=['meta'])
+            .where(['meta["directory"] == "posts"', 'len(meta["tags"]) == 1'])
+            .order_by(key='meta["tags"]'))
+
+    def test_missing_key(self):
+        query = lambda rs: list(rs
+            .select(require_components=['meta'])
+            .where(['meta["missing"] == 1']))
+        self.assertRaises(KeyError, query, ResultSet(self.e, self.e.all_bundles()))
+
+class TestBundlesView(unittest.TestCase):
+    bundles = TestIndexedQuery.bundles
+
+    def setUp(self):
+        self.e = QueryEngine(MockJulesEngine())
+        self.e.index = jules.index.BundleIndex(self.bundles)
+        self.calls = []
+        where = self.e.dispatch_map['where']
+        def counting_where(results, clauses):
+            self.calls.append(clauses)
+            return where(results, clauses)
+        self.e.dispatch_map['where'] = counting_where
+
+    def sidebar(self):
+        return (self.e.bundles_view()
+            .select(require_components=['meta'])
+            .where(['meta["directory"] == "posts"'])
+            .order_by(key='meta["order"]', descending=True)
+            .limit(2))
+
+    def test_memoized(self):
+        self.assertTrue(self.e.bundles_view() is self.e.bundles_view())
+        first = self.sidebar()
+        self.assertTrue(self.sidebar() is first)
+        self.assertEqual(list(first), list(first))
+        self.assertEqual([item['meta']['order'] for item in first], [3, 2])
+        self.sidebar()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_different_arguments(self):
+        posts = self.e.bundles_view().select(require_components=['meta'])
+        self.assertEqual(len(list(posts.where(['meta["order"] == 1']))), 2)
+        self.assertEqual(len(list(posts.where(['meta["order"] == 2']))), 1)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_impure(self):
+        self.e.pure_methods.discard('where')
+        self.sidebar()
+        self.sidebar()
+        self.assertEqual(len(self.calls), 2)
+
+class TestPlan(unittest.TestCase):
+    e = QueryEngine(MockJulesEngine())
+    # ties in `order`, to check that stability is kept
+    items = [dict(meta=dict(order=i % 5, n=i)) for i in range(20)]
+
+    def run_pipeline(self, pipeline, stages):
+        results = ResultSet(self.e, self.items)
+        for stage in stages:
+            results = ResultSet(self.e,
+                self.e.dispatch(stage.method, results._seq, stage.arg))
+        return list(results)
+
+    def unplanned(self, pipeline):
+        return [Stage(method, arg, method)
+            for stmt in pipeline for method, arg in stmt.items()]
+
+    def assertSamePlanned(self, pipeline):
+        self.assertEqual(
+            self.run_pipeline(pipeline, self.e.plan(pipeline)),
+            self.run_pipeline(pipeline, self.unplanned(pipeline)))
+
+    def test_plan(self):
+        pipeline = [
+            {'order_by': {'key': 'meta["order"]'}},
+            {'where': ['meta["n"] > 3']},
+            {'limit': 5},
+            {'count': 'i'},
+        ]
+        self.assertEqual([stage.label for stage in self.e.plan(pipeline)],
+            ['where', 'order_by+limit', 'count'])
+        self.assertEqual(self.e.explain(pipeline),
+            [('where', False), ('order_by+limit', False), ('count', False)])
+        self.assertSamePlanned(pipeline)
+
+    def test_top(self):
+        for descending in [False, True]:
+            for n in [0, 3, 5, 30]:
+                self.assertSamePlanned([
+                    {'order_by': {'key': 'meta["order"]',
+                                  'descending': descending}},
+                    {'limit': n}])
+
+    def test_top_indexed(self):
+        e = TestIndexedQuery.e
+        for descending in [False, True]:
+            top = ResultSet(e, e.all_bundles()).select(
+                require_components=['meta']).top(
+                key='meta["order"]', n=2, descending=descending)
+            self.assertTrue(isinstance(top._seq, jules.index.IndexedResults))
+            plain = ResultSet(e, TestIndexedQuery.bundles).select(
+                require_components=['meta']).order_by(
+                key='meta["order"]', descending=descending).limit(2)
+            self.assertEqual(list(top), list(plain))
+
+    def test_unchanged(self):
+        # not adjacent, or not safe to reorder
+        pipeline = [
+            {'order_by': {'key': 'meta["order"]'}},
+            {'count': 'i'},
+            {'where': ['i > 3']},
+            {'limit': 5},
+        ]
+        self.assertEqual([stage.label for stage in self.e.plan(pipeline)],
+            ['order_by', 'count', 'where', 'limit'])
+        self.assertEqual(self.e.explain(pipeline)[0], ('order_by', True))
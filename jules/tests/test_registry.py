@@ -0,0 +1,86 @@
+import unittest
+
+import os
+import sys
+import tempfile
+import shutil
+
+from straight.plugin import load
+
+import jules
+from jules import registry
+
+PLUGIN_MODULE = '''\
+class Base(object): pass
+class A(Base): pass
+'''
+
+class TestPluginRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.namespace = 'jules_test_ns_%d' % id(self)
+        ns_dir = os.path.join(self.tempdir, self.namespace)
+        os.mkdir(ns_dir)
+        open(os.path.join(ns_dir, '__init__.py'), 'w').close()
+        self.module_path = os.path.join(ns_dir, 'plugins.py')
+        self.write(PLUGIN_MODULE)
+        sys.path.insert(0, self.tempdir)
+        self.persist_path = os.path.join(self.tempdir, 'plugins')
+
+    def tearDown(self):
+        sys.path.remove(self.tempdir)
+        for name in list(sys.modules):
+            if name.startswith(self.namespace):
+                del sys.modules[name]
+        shutil.rmtree(self.tempdir)
+
+    def write(self, src, mtime=None):
+        with open(self.module_path, 'w') as f:
+            f.write(src)
+        if mtime is not None:
+            os.utime(self.module_path, (mtime, mtime))
+
+    def base(self):
+        return sys.modules[self.namespace + '.plugins'].Base
+
+    def names(self, classes):
+        return [cls.__name__ for cls in classes]
+
+    def test_same_as_straight(self):
+        r = registry.PluginRegistry()
+        for base in [jules.plugins.ComponentPlugin, jules.plugins.QueryPlugin]:
+            self.assertEqual(
+                r.classes('jules.plugins', base),
+                list(load('jules.plugins', subclasses=base)))
+
+    def test_scans_once(self):
+        r = registry.PluginRegistry()
+        r.classes(self.namespace, object)
+        del sys.modules[self.namespace + '.plugins']
+        r.classes(self.namespace, object)
+        self.assertFalse(self.namespace + '.plugins' in sys.modules)
+
+    def test_persisted(self):
+        r = registry.PluginRegistry()
+        self.assertEqual(self.names(r.classes(self.namespace, object)),
+            ['A', 'Base'])
+        r.save(self.persist_path, [self.namespace])
+
+        r = registry.PluginRegistry()
+        self.assertEqual(r.load(self.persist_path), [self.namespace])
+        self.assertEqual(self.names(r.classes(self.namespace, self.base())),
+            ['A'])
+        self.assertFalse(self.namespace in r.namespaces) # not scanned
+
+    def test_persisted_out_of_date(self):
+        self.write(PLUGIN_MODULE, mtime=1000000000)
+        r = registry.PluginRegistry()
+        r.classes(self.namespace, object)
+        r.save(self.persist_path, [self.namespace])
+
+        self.write(PLUGIN_MODULE + 'class B(Base): pass\n')
+        del sys.modules[self.namespace + '.plugins']
+        r = registry.PluginRegistry()
+        r.load(self.persist_path)
+        self.assertEqual(self.names(r.classes(self.namespace, object)),
+            ['A', 'B', 'Base'])
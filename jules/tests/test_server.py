@@ -0,0 +1,135 @@
+import unittest
+
+import os
+import gzip
+import shutil
+import tempfile
+import threading
+import httplib
+from io import BytesIO
+
+import jules
+from jules import server
+from jules.writer import SourceFile
+from jules.tests.test_jules import run_jules
+
+PAGE = '<html>' + 'hello ' * 100 + '</html>'
+
+class TestPreviewServer(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        static = os.path.join(self.tempdir, 'static.txt')
+        with open(static, 'w') as f:
+            f.write('static')
+        self.outputs = {
+            '/index.html': (PAGE, 1000000000.0),
+            '/dir/index.html': ('dir', 1000000000.0),
+            '/static.txt': (SourceFile(static), 0),
+            '/style.0123456789.css': ('a{}', 0),
+            '/photo.2013052012.jpg': ('jpg', 0),
+        }
+        self.httpd = server.PreviewServer(('127.0.0.1', 0),
+            server.MemoryOutput(self.outputs), verbose=False,
+            immutable=set(['/style.0123456789.css']))
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+        self.conn = httplib.HTTPConnection('127.0.0.1',
+            self.httpd.server_address[1])
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def get(self, url, **headers):
+        self.conn.request('GET', url, headers=headers)
+        response = self.conn.getresponse()
+        return response, response.read()
+
+    def test_keep_alive(self):
+        sock = None
+        for url in ['/', '/dir/', '/static.txt']:
+            response, body = self.get(url)
+            self.assertEqual(response.status, 200)
+            if sock is not None:
+                self.assertTrue(self.conn.sock is sock)
+            sock = self.conn.sock
+        self.assertEqual(body, 'static')
+
+    def test_conditional(self):
+        response, body = self.get('/')
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+        self.assertEqual(self.get('/', **{'If-None-Match': etag})[0].status, 304)
+        self.assertEqual(
+            self.get('/', **{'If-Modified-Since': last_modified})[0].status, 304)
+
+        self.outputs['/index.html'] = ('changed', 1000000001.0)
+        response, body = self.get('/', **{'If-None-Match': etag})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, 'changed')
+
+    def test_cache_control(self):
+        self.assertEqual(self.get('/')[0].getheader('Cache-Control'),
+            'no-cache')
+        self.assertEqual(
+            self.get('/style.0123456789.css')[0].getheader('Cache-Control'),
+            'public, max-age=31536000, immutable')
+        # only looks fingerprinted.
+        self.assertEqual(
+            self.get('/photo.2013052012.jpg')[0].getheader('Cache-Control'),
+            'no-cache')
+
+    def test_gzip(self):
+        response, body = self.get('/', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(body)).read(), PAGE)
+
+        response, body = self.get('/', **{'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(response.getheader('Content-Encoding'), None)
+        self.assertEqual(body, PAGE)
+
+    def test_gzip_etag(self):
+        identity = self.get('/')[0].getheader('ETag')
+        response, body = self.get('/', **{'Accept-Encoding': 'gzip'})
+        gzipped = response.getheader('ETag')
+        self.assertNotEqual(gzipped, identity)
+
+        response, body = self.get('/',
+            **{'Accept-Encoding': 'gzip', 'If-None-Match': gzipped})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.getheader('ETag'), gzipped)
+        self.assertEqual(self.get('/', **{'If-None-Match': gzipped})[0].status,
+            304)
+
+    def test_not_found(self):
+        self.assertEqual(self.get('/missing')[0].status, 404)
+        response, body = self.get('/dir')
+        self.assertEqual(response.status, 301)
+        self.assertEqual(response.getheader('Location'), '/dir/')
+
+class TestMemoryBuild(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_outputs(self):
+        outputs = {}
+        engine = jules.JulesEngine(self.projectdir, outputs=outputs)
+        engine.run()
+        self.assertFalse(os.path.exists(os.path.join(self.projectdir, '_build')))
+        self.assertFalse(os.path.exists(
+            os.path.join(engine.cache_dir, 'manifest')))
+
+        output = server.MemoryOutput(outputs)
+        data, mtime = output.get('/content/1/')
+        self.assertTrue('Hello there!' in data)
+        self.assertEqual(output.get('/static1.txt')[0],
+            open(os.path.join(self.projectdir, 'static', 'static1.txt')).read())
+        self.assertTrue(output.is_directory('/content/1'))
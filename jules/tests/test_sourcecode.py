@@ -0,0 +1,61 @@
+import unittest
+
+import tempfile
+import shutil
+
+from jules import cache, rst, sourcecode
+
+SRC = '\n'.join([
+    'Code',
+    '',
+    '.. sourcecode:: python',
+    '',
+    '    def f(x):',
+    '        return x',
+    '',
+    '.. sourcecode:: nosuchlanguage',
+    '',
+    '    def f(x):',
+    '        return x',
+])
+
+class TestHighlighter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.cache = cache.open_cache(self.tempdir, 'pygments')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cached(self):
+        highlighter = sourcecode.Highlighter(self.cache)
+        html = highlighter.highlight('python', None, 'def f(x): pass')
+        self.assertTrue('<span class="k">def</span>' in html)
+        self.assertEqual(
+            highlighter.highlight('python', None, 'def f(x): pass'), html)
+        # the second time, it's remembered in memory.
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+
+        # ...and by the next build, on disk.
+        highlighter = sourcecode.Highlighter(self.cache)
+        self.assertEqual(
+            highlighter.highlight('python', None, 'def f(x): pass'), html)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        highlighter.highlight('text', None, 'def f(x): pass')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_lexers(self):
+        self.assertTrue(
+            sourcecode.get_lexer('python') is sourcecode.get_lexer('python'))
+        self.assertEqual(
+            type(sourcecode.get_lexer('nosuchlanguage')).__name__, 'TextLexer')
+
+    def test_directive(self):
+        highlighter = sourcecode.Highlighter(self.cache)
+        publisher = rst.Publisher({'jules_highlighter': highlighter})
+        parsed = publisher.parse({}, SRC)
+        self.assertTrue('<span class="k">def</span>' in parsed['html_body'])
+        self.assertEqual(len(highlighter.memo), 2)
+        self.assertEqual(publisher.parse({}, SRC), parsed)
+        self.assertEqual(self.cache.misses, 2)
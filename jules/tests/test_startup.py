@@ -0,0 +1,89 @@
+"""What each subcommand imports, and how long it takes to start.
+
+Run this module directly to print a table of startup times:
+
+    python -m jules.tests.test_startup
+"""
+
+from __future__ import print_function
+
+import unittest
+
+import sys
+import os
+import json
+import tempfile
+import shutil
+import subprocess
+import textwrap
+
+import jules
+from jules.tests.test_jules import run_jules
+
+# dependencies that only some plugins need, and that are slow to import.
+HEAVY_MODULES = ['genshi', 'jinja2', 'docutils', 'pygments', 'scss']
+
+def startup(args):
+    """Run jules with args in a new interpreter.
+
+    Returns (seconds taken, sorted list of the HEAVY_MODULES it imported).
+    """
+    output = subprocess.check_output([sys.executable, "-c", textwrap.dedent("""\
+        import sys
+        import time
+        import json
+        start = time.time()
+        sys.path.insert(0, %r)
+
+        from jules import __main__ as m
+        m.main(%r)
+        heavy = [name for name in %r if name in sys.modules]
+        print('\\n' + json.dumps([time.time() - start, heavy]))
+        """ %
+        (os.path.dirname(os.path.abspath(jules.__file__)),
+         ['jules'] + args,
+         HEAVY_MODULES))], stderr=open(os.devnull, 'w'))
+    seconds, heavy = json.loads(output.splitlines()[-1])
+    return seconds, sorted(heavy)
+
+def subcommands(projectdir):
+    return [
+        ['cache', '-L', projectdir, 'stats'],
+        ['tags', '-L', projectdir],
+        ['meta', '-L', projectdir, 'post1'],
+        ['build', '-L', projectdir],
+    ]
+
+class TestStartup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp(suffix='-jules')
+        cls.projectdir = os.path.join(cls.tempdir, 'test_site')
+        run_jules(['init', cls.projectdir, '-s', 'test'])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def test_cache(self):
+        seconds, heavy = startup(['cache', '-L', self.projectdir, 'stats'])
+        self.assertEqual(heavy, [])
+
+    def test_metadata(self):
+        # reading the metadata of reStructuredText posts needs docutils (and
+        # the sourcecode directive), but nothing for rendering.
+        for args in [['tags', '-L', self.projectdir],
+                     ['meta', '-L', self.projectdir, 'post1']]:
+            seconds, heavy = startup(args)
+            self.assertEqual(heavy, ['docutils', 'pygments'])
+
+if __name__ == '__main__':
+    tempdir = tempfile.mkdtemp(suffix='-jules')
+    try:
+        projectdir = os.path.join(tempdir, 'test_site')
+        run_jules(['init', projectdir, '-s', 'test'])
+        for args in subcommands(projectdir):
+            seconds, heavy = startup(args)
+            print("%-8s %6.3fs  %s" % (args[0], seconds, ' '.join(heavy)))
+    finally:
+        shutil.rmtree(tempdir)
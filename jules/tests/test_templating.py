@@ -0,0 +1,150 @@
+import unittest
+
+import os
+import tempfile
+import shutil
+
+import jinja2
+
+import jules
+from jules import cache
+from jules.templating import (DiskBytecodeCache, FragmentCache,
+    FragmentCacheExtension)
+from jules.plugins.rendering.query import QueryRenderer
+from jules.tests.test_jules import run_jules
+
+class TestDiskBytecodeCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.templates = {'page.j2': u'{{ 1 + 1 }}'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def render(self):
+        bcc = DiskBytecodeCache(cache.open_cache(self.tempdir, 'jinja2'))
+        env = jinja2.Environment(loader=jinja2.DictLoader(self.templates),
+            bytecode_cache=bcc)
+        return env.get_template('page.j2').render(), bcc.cache
+
+    def test_reused(self):
+        self.assertEqual(self.render()[0], u'2')
+        rendered, disk_cache = self.render()
+        self.assertEqual(rendered, u'2')
+        self.assertEqual(disk_cache.hits, 1)
+
+    def test_source_changed(self):
+        self.render()
+        self.templates['page.j2'] = u'{{ 2 + 2 }}'
+        self.assertEqual(self.render()[0], u'4')
+
+class TestFragmentCache(unittest.TestCase):
+    templates = {
+        'page.j2': u'{{ page }}:{% cache "sidebar" %}{{ sidebar() }}{% endcache %}',
+        'keyed.j2': u'{% cache "tag", tag %}{{ sidebar() }} {{ tag }}{% endcache %}',
+    }
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def sidebar(self):
+        self.calls += 1
+        return u'sidebar'
+
+    def env(self, fragment_cache=None):
+        env = jinja2.Environment(loader=jinja2.DictLoader(self.templates),
+            extensions=[FragmentCacheExtension])
+        if fragment_cache is not None:
+            env.fragment_cache = fragment_cache
+        return env
+
+    def render(self, env, name, **kwargs):
+        return env.get_template(name).render(sidebar=self.sidebar, **kwargs)
+
+    def test_cached(self):
+        env = self.env()
+        for page in range(3):
+            self.assertEqual(self.render(env, 'page.j2', page=page),
+                u'%d:sidebar' % page)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(env.fragment_cache.stats(), {'hits': 2, 'misses': 1})
+
+    def test_keys(self):
+        env = self.env()
+        for tag in ['a', 'b', 'a']:
+            self.assertEqual(self.render(env, 'keyed.j2', tag=tag),
+                u'sidebar ' + tag)
+        self.assertEqual(self.calls, 2)
+
+    def test_persisted(self):
+        disk_cache = cache.open_cache(self.tempdir, 'fragments')
+        self.render(self.env(FragmentCache(disk_cache, 'v1')), 'page.j2', page=0)
+        self.render(self.env(FragmentCache(disk_cache, 'v1')), 'page.j2', page=0)
+        self.assertEqual(self.calls, 1)
+        # e.g. the templates changed
+        self.render(self.env(FragmentCache(disk_cache, 'v2')), 'page.j2', page=0)
+        self.assertEqual(self.calls, 2)
+
+class TestPersistedFragments(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'a') as f:
+            f.write('\npersist_fragments: true\n')
+        with open(os.path.join(self.projectdir,
+                'templates', 'content', 'posts.j2'), 'w') as f:
+            f.write(u'{% cache "sidebar" %}{% for bundle in bundles %}'
+                u'{{ bundle.key }} {% endfor %}{% endcache %}')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def sidebar(self, *args):
+        run_jules(['build', '-L', self.projectdir] + list(args))
+        with open(os.path.join(self.projectdir,
+                '_build', 'content', 'index.html')) as f:
+            return sorted(f.read().split())
+
+    def check_bundle_added(self, *args):
+        self.assertEqual(self.sidebar(*args), ['post1', 'post2'])
+        shutil.copytree(os.path.join(self.projectdir, 'content', 'post2'),
+            os.path.join(self.projectdir, 'content', 'post3'))
+        self.assertEqual(self.sidebar(*args), ['post1', 'post2', 'post3'])
+
+    def test_bundle_added(self):
+        self.check_bundle_added()
+
+    def test_bundle_added_incremental(self):
+        self.check_bundle_added('-i')
+
+class TestInlineTemplates(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_compiled_once(self):
+        engine = jules.JulesEngine(self.projectdir)
+        renderer = engine.plugins.produce_instance(QueryRenderer)
+        compiled = []
+        from_string = renderer.env.from_string
+        def counting_from_string(source, *args, **kwargs):
+            compiled.append(source)
+            return from_string(source, *args, **kwargs)
+        renderer.env.from_string = counting_from_string
+
+        # rerun the entries, as if they were a second entry using the same
+        # URL patterns.
+        engine.initialize()
+        engine.render_all()
+        engine.render_all()
+        self.assertTrue('/content/{{post_num}}/' in compiled)
+        self.assertEqual(sorted(compiled), sorted(set(compiled)))
@@ -60,3 +60,21 @@ class TestTopSort(unittest.TestCase):
     def test_manycycle(self):
         with self.assertRaises(utils.CircularDependencyError):
             list(utils.topsort({0: [], 1: [0], 2: [3], 3: [2]}))
+
+class TestChunks(unittest.TestCase):
+    def test_read_all(self):
+        r = utils.ChunkReader([u'ab', u'c', u'', u'de'])
+        self.assertEqual(r.read(), u'abcde')
+        self.assertEqual(r.read(), '')
+
+    def test_read_sized(self):
+        r = utils.ChunkReader([u'ab', u'c', u'', u'de'])
+        self.assertEqual(r.read(1), u'a')
+        self.assertEqual(r.read(3), u'bcd')
+        self.assertEqual(r.read(3), u'e')
+        self.assertEqual(r.read(3), '')
+
+    def test_join(self):
+        self.assertEqual(utils.join_chunks('abc'), 'abc')
+        self.assertEqual(utils.join_chunks(iter([u'a', u'bc'])), u'abc')
+        self.assertEqual(utils.join_chunks([]), '')
@@ -0,0 +1,151 @@
+import unittest
+
+import os
+import tempfile
+import shutil
+import StringIO
+
+from jules import watch
+from jules.tests.test_jules import run_jules
+
+class TestPollingWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.ignored = os.path.join(self.tempdir, 'ignored')
+        os.mkdir(self.ignored)
+        self.write('a.txt', 'a')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, filename, data):
+        path = os.path.join(self.tempdir, filename)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_changes(self):
+        watcher = watch.PollingWatcher([self.tempdir], [self.ignored])
+        self.assertEqual(watcher.changes(), set())
+        changed = self.write('a.txt', 'changed')
+        added = self.write('b.txt', 'b')
+        self.write(os.path.join('ignored', 'c.txt'), 'c')
+        self.assertEqual(watcher.changes(), set([changed, added]))
+        self.assertEqual(watcher.changes(), set())
+
+class TestSiteWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.projectdir = os.path.join(self.tempdir, 'test_site')
+        self.build_dir = os.path.join(self.projectdir, '_build')
+        run_jules(['init', self.projectdir, '-s', 'test'])
+        self.watcher = watch.SiteWatcher(self.projectdir,
+            out=StringIO.StringIO())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def mtime(self, *path):
+        return os.stat(os.path.join(self.build_dir, *path)).st_mtime
+
+    def output_exists(self, *path):
+        return os.path.exists(os.path.join(self.build_dir, *path))
+
+    def edit_post(self):
+        post = os.path.join(self.projectdir, 'content', 'post2', 'post.rst')
+        with open(post) as f:
+            src = f.read()
+        with open(post, 'w') as f:
+            f.write(src.replace('Hello there!', 'Hello again!'))
+        return post
+
+    def test_rebuild(self):
+        self.assertTrue(self.watcher.build())
+        content_mtime = self.mtime('content', '0', 'index.html')
+        paths, ignore = self.watcher.watched_paths()
+        self.assertTrue(os.path.join(self.projectdir, 'content') in paths)
+
+        # the next build works from the state kept in memory
+        os.remove(os.path.join(self.watcher.engine.cache_dir, 'manifest'))
+        self.assertTrue(self.watcher.build([self.edit_post()]))
+
+        with open(os.path.join(self.build_dir, 'content', '1', 'index.html')) as f:
+            self.assertTrue('Hello again!' in f.read())
+        self.assertEqual(self.mtime('content', '0', 'index.html'), content_mtime)
+
+    def test_warm_rebuild(self):
+        self.assertTrue(self.watcher.build())
+        engine = self.watcher.engine
+        post1 = engine.bundles['post1']
+        self.assertTrue(self.watcher.build([self.edit_post()]))
+        self.assertTrue(self.watcher.engine is engine)
+        # only the changed bundle was prepared again.
+        self.assertTrue(engine.bundles['post1'] is post1)
+        self.assertEqual(engine.manifest.changed_bundles, set(['post2']))
+        with open(os.path.join(self.build_dir, 'content', '1', 'index.html')) as f:
+            self.assertTrue('Hello again!' in f.read())
+
+    def test_warm_rebuild_bundles_added_and_removed(self):
+        self.assertTrue(self.watcher.build())
+        engine = self.watcher.engine
+        content = os.path.join(self.projectdir, 'content')
+        shutil.copytree(os.path.join(content, 'post2'),
+            os.path.join(content, 'post3'))
+        self.assertTrue(self.watcher.build(
+            [os.path.join(content, 'post3', 'post.rst')]))
+        self.assertTrue(self.watcher.engine is engine)
+        self.assertTrue(self.output_exists('content', '2', 'index.html'))
+
+        # post1 has a static file, which goes with it.
+        self.assertTrue(self.output_exists('static2.txt'))
+        shutil.rmtree(os.path.join(content, 'post1'))
+        self.assertTrue(self.watcher.build([os.path.join(content, 'post1')]))
+        self.assertTrue(self.watcher.engine is engine)
+        self.assertFalse(self.output_exists('static2.txt'))
+        self.assertFalse(self.output_exists('content', '2', 'index.html'))
+
+    def test_config_change(self):
+        self.assertTrue(self.watcher.build())
+        engine = self.watcher.engine
+        config = os.path.join(self.projectdir, 'site.yaml')
+        with open(config, 'a') as f:
+            f.write('\n')
+        self.assertTrue(self.watcher.build([config]))
+        self.assertFalse(self.watcher.engine is engine)
+
+    def test_failed_build(self):
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'a') as f:
+            f.write('\n[not yaml')
+        self.assertFalse(self.watcher.build())
+        paths, ignore = self.watcher.watched_paths()
+        self.assertEqual(paths, [self.projectdir])
+
+    def test_rebuild_in_memory(self):
+        watcher = watch.SiteWatcher(self.projectdir, memory=True,
+            out=StringIO.StringIO())
+        self.assertTrue(watcher.build())
+        page = watcher.outputs['/content/0/index.html']
+        self.assertTrue(watcher.build([self.edit_post()]))
+
+        self.assertTrue('Hello again!' in
+            watcher.outputs['/content/1/index.html'][0])
+        self.assertTrue(watcher.outputs['/content/0/index.html'] is page)
+        self.assertFalse(os.path.exists(self.build_dir))
+
+    def test_fingerprinted(self):
+        with open(os.path.join(self.projectdir, 'site.yaml'), 'a') as f:
+            f.write('\nfingerprint: true\n')
+        fingerprinted = self.watcher.fingerprinted
+        self.assertTrue(self.watcher.build())
+        old, = fingerprinted
+        self.assertTrue(old.startswith('/testcss.'))
+
+        stylesheet = os.path.join(self.projectdir, 'static', 'testcss.scss')
+        with open(stylesheet, 'a') as f:
+            f.write('\ni { color: red; }\n')
+        self.assertTrue(self.watcher.build([stylesheet]))
+        # the same set, which the server has.
+        self.assertTrue(self.watcher.fingerprinted is fingerprinted)
+        new, = fingerprinted
+        self.assertNotEqual(new, old)
+        self.assertTrue(self.output_exists(new.lstrip('/')))
@@ -1,5 +1,9 @@
 import unittest
 
+import os
+import tempfile
+import shutil
+
 from jules import writer
 
 class TestNormalize(unittest.TestCase):
@@ -31,4 +35,75 @@ class TestSplit(unittest.TestCase):
         self.assertEqual(writer.URLWriter.split_url('/a/'), ('a', ''))
     
     def test_rel(self):
-        self.assertRaises(ValueError, writer.URLWriter.split_url, 'a/b')
\ No newline at end of file
+        self.assertRaises(ValueError, writer.URLWriter.split_url, 'a/b')
+
+class TestURLWriter(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.writer = writer.URLWriter(self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_urlpath(self):
+        self.assertEqual(
+            self.writer.urlpath('/a/b/'),
+            os.path.join(self.tempdir, 'a', 'b', 'index.html'))
+        self.assertTrue(os.path.isdir(os.path.join(self.tempdir, 'a', 'b')))
+
+    def test_conflict(self):
+        self.writer.urlpath('/a/', 'first')
+        with self.assertRaises(writer.URLWriteConflict) as cm:
+            self.writer.urlpath('/a/index.html', 'second')
+        self.assertEqual(cm.exception.old, 'first')
+        self.assertEqual(cm.exception.new, 'second')
+
+    def test_directory_created_concurrently(self):
+        """Another process creating a directory first isn't an error"""
+        real_isdir = os.path.isdir
+        def isdir(path):
+            # pretend to be too late to see the directory the first time.
+            os.path.isdir = real_isdir
+            real_isdir(path) or os.mkdir(path)
+            return False
+        os.path.isdir = isdir
+        try:
+            self.writer.ensure_directories((self.tempdir, 'a', 'index.html'))
+        finally:
+            os.path.isdir = real_isdir
+        self.assertTrue(os.path.isdir(os.path.join(self.tempdir, 'a')))
+
+class TestCopyFile(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(suffix='-jules')
+        self.src = os.path.join(self.tempdir, 'src')
+        self.dst = os.path.join(self.tempdir, 'dst')
+        with open(self.src, 'wb') as f:
+            f.write(b'\x00data' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        writer.copy_file(self.src, self.dst)
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+        self.assertNotEqual(os.stat(self.dst).st_ino, os.stat(self.src).st_ino)
+
+    def test_replace(self):
+        with open(self.dst, 'wb') as f:
+            f.write(b'old data, longer than the new data' * 1000)
+        writer.copy_file(self.src, self.dst)
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+
+    def test_link(self):
+        writer.copy_file(self.src, self.dst, link=True)
+        self.assertEqual(os.stat(self.dst).st_ino, os.stat(self.src).st_ino)
+
+    def test_source_file(self):
+        self.assertEqual(
+            writer.SourceFile(self.src).read(),
+            self.read(self.src))
@@ -76,3 +76,37 @@ def del_key(G, k):
     del G[k]
     for s in G.itervalues():
         if k in s: s.remove(k)
+
+class ChunkReader(object):
+    """A read-only file-like object over an iterable of string chunks"""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = None
+
+    def read(self, size=-1):
+        buffer = [] if self.buffer is None else [self.buffer]
+        length = sum(map(len, buffer))
+        while size < 0 or length < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            buffer.append(chunk)
+            length += len(chunk)
+        if not buffer:
+            return ''
+        data = buffer[0][:0].join(buffer)
+        if size < 0:
+            self.buffer = None
+            return data
+        self.buffer = data[size:] or None
+        return data[:size]
+
+def join_chunks(data):
+    """Given a string or an iterable of string chunks, return a string"""
+    if isinstance(data, basestring):
+        return data
+    chunks = list(data)
+    if not chunks:
+        return ''
+    return chunks[0][:0].join(chunks)
@@ -0,0 +1,219 @@
+"""Rebuilding a site whenever its sources change, for `jules serve --watch`.
+
+Every rebuild is an incremental build (see jules.incremental), done by the
+same engine (see JulesEngine.rebuild): the other bundles, the plugins and
+their caches, the bundle index and the jinja2 environment are all kept in
+memory. So a change to one post only re-prepares that bundle, reruns the
+entries that depend on it, and rewrites the outputs that changed.
+
+A change to site.yaml, or a failed build, starts over with a new engine,
+from the manifest of the last build that succeeded.
+
+Changes are noticed with inotify, if pyinotify is installed, and otherwise by
+polling the modification times of the sources.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import traceback
+
+import jules
+from jules.incremental import walk_files
+from jules.plugins.rendering import Renderer
+
+# How long to wait for more changes after one, so that saving several files
+# at once causes only one rebuild.
+SETTLE_TIME = 0.1
+
+def _under(path, roots):
+    return any(path == root or path.startswith(root + os.sep) for root in roots)
+
+class PollingWatcher(object):
+    """Watches files and directories by checking their mtimes periodically"""
+    def __init__(self, paths, ignore=(), interval=0.5):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.ignore = [os.path.abspath(path) for path in ignore]
+        self.interval = interval
+        self.last = self.snapshot()
+
+    def snapshot(self):
+        snapshot = {}
+        for path in self.paths:
+            if not os.path.exists(path):
+                continue
+            for filepath in walk_files(path):
+                if _under(filepath, self.ignore):
+                    continue
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                snapshot[filepath] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def changes(self):
+        """Return the paths that changed since the last call"""
+        new = self.snapshot()
+        old, self.last = self.last, new
+        return set(path for path in set(old) | set(new)
+            if old.get(path) != new.get(path))
+
+    def wait(self):
+        """Block until something changes, and return the changed paths"""
+        while True:
+            time.sleep(self.interval)
+            changed = self.changes()
+            if changed:
+                time.sleep(SETTLE_TIME)
+                return changed | self.changes()
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    """Watches files and directories with inotify (through pyinotify)"""
+    def __init__(self, paths, ignore=()):
+        import pyinotify
+        self.ignore = [os.path.abspath(path) for path in ignore]
+        self.dirs = []
+        self.files = set()
+        self.changed = set()
+
+        watcher = self
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                path = event.pathname
+                if _under(path, watcher.ignore):
+                    return
+                if _under(path, watcher.dirs) or path in watcher.files:
+                    watcher.changed.add(path)
+
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.manager, Handler())
+        mask = (pyinotify.IN_CREATE | pyinotify.IN_DELETE
+            | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MODIFY
+            | pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+            | pyinotify.IN_ATTRIB)
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                self.dirs.append(path)
+                self.manager.add_watch(path, mask, rec=True, auto_add=True)
+            elif os.path.exists(path):
+                # watch the directory, since editors often replace files
+                # rather than writing to them.
+                self.files.add(path)
+                self.manager.add_watch(os.path.dirname(path), mask)
+
+    def _read(self, timeout):
+        if self.notifier.check_events(timeout):
+            self.notifier.read_events()
+            self.notifier.process_events()
+
+    def wait(self):
+        while not self.changed:
+            self._read(None)
+        self._read(SETTLE_TIME * 1000)
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def close(self):
+        self.notifier.stop()
+
+def make_watcher(paths, ignore=()):
+    try:
+        import pyinotify
+    except ImportError:
+        return PollingWatcher(paths, ignore)
+    return InotifyWatcher(paths, ignore)
+
+class SiteWatcher(object):
+    """Builds a site, then rebuilds it whenever its sources change.
+
+    If `memory` is true, the outputs are kept in the `outputs` dict instead
+    of being written to the output directory.
+    """
+
+    def __init__(self, src_path, jobs=1, memory=False, out=sys.stdout):
+        self.src_path = src_path
+        self.jobs = jobs
+        self.out = out
+        self.engine = None # of the last build that succeeded
+        self.warm = None # the engine to rebuild with, see build()
+        self.state = None
+        self.outputs = {} if memory else None
+        # the fingerprinted URLs of the last build, for the server.
+        self.fingerprinted = set()
+
+    def build(self, changed=None):
+        """Do an incremental build, returning True if it succeeded.
+
+        `changed` is the paths that changed since the last build. If it's
+        given, the engine of the last build does this one, if it can.
+        """
+        start = time.time()
+        # an engine whose build failed might be left half-updated.
+        engine, self.warm = self.warm, None
+        try:
+            if engine is None or changed is None or not engine.rebuild(changed):
+                engine = jules.JulesEngine(self.src_path,
+                    incremental=True, jobs=self.jobs, previous=self.state,
+                    outputs=self.outputs)
+                engine.run()
+        except Exception:
+            # keep watching: the next change will probably fix it.
+            traceback.print_exc(file=self.out)
+            print("Build failed.", file=self.out)
+            return False
+        self.engine = self.warm = engine
+        self.state = engine.manifest.state()
+        # updated in place, since the server is using it. The new URLs are
+        # added before the old ones are dropped, so a URL in both is never
+        # served as no-cache in between.
+        fingerprinted = set(
+            engine.plugins.produce_instance(Renderer).fingerprints.values())
+        self.fingerprinted |= fingerprinted
+        self.fingerprinted &= fingerprinted
+        print("Built in %.2fs" % (time.time() - start), file=self.out)
+        return True
+
+    def watched_paths(self):
+        """Return (paths to watch, paths under them to ignore)"""
+        if self.engine is not None:
+            return self.engine.source_paths(), []
+        # never built successfully, so we don't know what the sources are.
+        # Watch everything but what builds write to.
+        try:
+            config = jules.load_config(self.src_path)
+        except Exception:
+            config = {}
+        return [self.src_path], [
+            jules.find_cache_dir(self.src_path, config),
+            os.path.join(self.src_path, config.get('output_dir', '_build'))]
+
+    def run(self):
+        self.build()
+        self.watch()
+
+    def watch(self):
+        """Rebuild whenever the sources change, forever"""
+        paths = self.watched_paths()
+        watcher = make_watcher(*paths)
+        try:
+            while True:
+                changed = watcher.wait()
+                print("Changed: %s" % ', '.join(
+                    os.path.relpath(path, self.src_path)
+                    for path in sorted(changed)), file=self.out)
+                self.build(changed)
+                # changes during the build are picked up by the same watcher,
+                # unless there's a different set of paths to watch now.
+                if self.watched_paths() != paths:
+                    watcher.close()
+                    paths = self.watched_paths()
+                    watcher = make_watcher(*paths)
+        finally:
+            watcher.close()
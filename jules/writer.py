@@ -1,4 +1,7 @@
 import os
+import time
+import errno
+import shutil
 import posixpath
 
 class URLWriteConflict(Exception):
@@ -13,8 +16,43 @@ class URLWriteConflict(Exception):
         self.new = new
         super(URLWriteConflict, self).__init__(url, old, new)
 
+class SourceFile(object):
+    """Render action data that's the contents of a file on disk.
+    
+    The file is only read if something needs to process its contents.
+    Otherwise it's copied (or, if `link` is true, hard-linked) straight into
+    the output.
+    """
+    def __init__(self, path, link=False):
+        self.path = path
+        self.link = link
+    
+    def __repr__(self):
+        return 'SourceFile(%r)' % (self.path,)
+    
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+def copy_file(src, dst, link=False):
+    """Copy the file at src to dst, without reading it into memory.
+    
+    If link is true, try to hard-link dst to src first.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass # e.g. across filesystems, so copy instead.
+    
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
 # FIXME: pass this into plugins
-# FIXME: add shutil wrapping
 class URLWriter(object):
     def __init__(self, output_path):
         self.output_path = output_path
@@ -36,14 +74,26 @@ class URLWriter(object):
         new_dir = '.'
         for dir in dirs:
             new_dir = os.path.join(new_dir, dir)
-            # FIXME: race condition precludes parallelism
+            # Somebody else (e.g. another writer process) may create the
+            # directory between the check and the mkdir, and that's fine.
             if not os.path.isdir(new_dir):
-                os.mkdir(new_dir)
-        
-        
+                try:
+                    os.mkdir(new_dir)
+                except OSError as e:
+                    if e.errno != errno.EEXIST or not os.path.isdir(new_dir):
+                        raise
+    
+    
     def urlopen(self, urlpath, owner=None):
         """Open an URL for writing to.
         
+        In the case that an URL conflict is found, raise URLWriteConflict
+        """
+        return open(self.urlpath(urlpath, owner), 'w')
+
+    def urlpath(self, urlpath, owner=None):
+        """Claim an URL for writing to, and return the path to write it at.
+
         In the case that an URL conflict is found, raise URLWriteConflict
         """
         url = self.normalize_url(urlpath)
@@ -52,13 +102,51 @@ class URLWriter(object):
             old_owner = self.ownership[split]
         except KeyError:
             self.ensure_directories(split)
-            path = os.path.join(*split)
-            f = open(path, 'w')
             self.ownership[split] = owner
-            return f
+            return os.path.join(*split)
         else:
             raise URLWriteConflict(url, old_owner, owner)
 
+    def remove(self, urlpath):
+        """Remove the file at the URL, if there is one."""
+        path = os.path.join(
+            self.output_path, *self.split_url(self.normalize_url(urlpath)))
+        if os.path.isfile(path):
+            os.remove(path)
+
+class MemoryURLWriter(URLWriter):
+    """Claims URLs like URLWriter, but the outputs are kept in a dict.
+
+    `outputs` maps each normalized URL to (data, mtime), where data is a
+    string or a SourceFile, and mtime is when the data last changed.
+    """
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.ownership = {}
+
+    def urlpath(self, urlpath, owner=None):
+        """Claim an URL for writing to, and return its key in `outputs`.
+
+        In the case that an URL conflict is found, raise URLWriteConflict
+        """
+        url = self.normalize_url(urlpath)
+        try:
+            old_owner = self.ownership[url]
+        except KeyError:
+            self.ownership[url] = owner
+            return url
+        else:
+            raise URLWriteConflict(url, old_owner, owner)
+
+    def write(self, url, data):
+        old = self.outputs.get(url)
+        if (old is None or isinstance(data, SourceFile)
+                or isinstance(old[0], SourceFile) or old[0] != data):
+            self.outputs[url] = (data, time.time())
+
+    def remove(self, urlpath):
+        self.outputs.pop(self.normalize_url(urlpath), None)
+
 def split_path(path, pathmodule=os.path):
     head = path
     reversed_split = []